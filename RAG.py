@@ -1,16 +1,69 @@
 # RAG model implementation
+import asyncio
+import hashlib
+import json
 import logging
+import re
+import sqlite3
+import threading
+import time
+import weakref
+import zlib
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 import google.generativeai as genai
 from chromadb import Documents, EmbeddingFunction, Embeddings
 from google.api_core import retry
 import chromadb
+import numpy as np
 import os
 
 logging.basicConfig(level=logging.INFO)
-genai.configure(api_key=API_KEY)
+API_KEY = os.getenv("GOOGLE_API_KEY")
+if API_KEY:
+    genai.configure(api_key=API_KEY)
 
-chroma_client = chromadb.Client()
+# Embeddings: "gemini" calls the API, "local" is an offline hashing stand-in
+EMBED_BACKEND = os.getenv("RAG_EMBED_BACKEND", "gemini").lower()
+EMBED_MODEL = os.getenv("RAG_GEMINI_EMBED_MODEL", "models/text-embedding-004")
+EMBED_LOCAL_DIM = int(os.getenv("RAG_LOCAL_EMBED_DIM", "768"))
+EMBED_BATCH_SIZE = int(os.getenv("RAG_EMBED_BATCH_SIZE", "100"))  # batchEmbedContents caps requests at 100
+EMBED_CONCURRENCY = int(os.getenv("RAG_EMBED_CONCURRENCY", "4"))
+EMBED_CACHE_PATH = os.getenv("RAG_EMBED_CACHE_PATH", "rag_embeddings.db")
+
+# Ingestion: chunk size/overlap in whitespace tokens (a close, cheap proxy for model tokens)
+CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "256"))
+CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "48"))
+SECTION_HEADING_RE = re.compile(r"^(?:\d+(?:\.\d+)*\.?\s+[A-Z][^.]{1,80}|[A-Z][A-Z0-9 &/,()\-]{3,80})$")
+
+# Retrieval: top-k after reranking RETRIEVE_CANDIDATES by similarity + lexical overlap with MMR diversity
+RETRIEVE_K = int(os.getenv("RAG_RETRIEVE_K", "4"))
+RETRIEVE_CANDIDATES = int(os.getenv("RAG_RETRIEVE_CANDIDATES", "20"))
+CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "1200"))
+LEXICAL_WEIGHT = float(os.getenv("RAG_LEXICAL_WEIGHT", "0.3"))
+MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", "256"))
+
+# Generation: one model instance per name, answers cached by (kind, normalized text, passage hash)
+GENERATION_MODEL = os.getenv("RAG_GENERATION_MODEL", "gemini-1.5-flash-latest")
+RESPONSE_CACHE_SIZE = int(os.getenv("RAG_RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL_SEC = int(os.getenv("RAG_RESPONSE_CACHE_TTL_SEC", "3600"))
+GENERATION_CONCURRENCY = int(os.getenv("RAG_GENERATION_CONCURRENCY", "8"))
+SERVICE_MAX_PENDING = int(os.getenv("RAG_SERVICE_MAX_PENDING", "256"))
+
+# Each build goes into its own "<COLLECTION_NAME>__<ns timestamp>" collection; the manifest names the live one
+COLLECTION_NAME = "googlecardb"
+# On-disk Chroma index + manifest; set empty for the old in-memory client
+CHROMA_PATH = os.getenv("RAG_CHROMA_PATH", "rag_chroma")
+MANIFEST_NAME = "manifest.json"
+
+chroma_client = chromadb.PersistentClient(path=CHROMA_PATH) if CHROMA_PATH else chromadb.Client()
 db = None
+_reload_lock = threading.Lock()
+_manifest = {}
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
 
 def create_documents_from_dict(topic_text_dict):
     documents = []
@@ -22,44 +75,405 @@ def create_documents_from_dict(topic_text_dict):
     
     return documents
 
+def iter_sections(pdf_path: str):
+    """
+    Stream a PDF as (topic, text, page) fragments, one page at a time.
+    A heading line (numbered, or all caps) starts a new topic; consecutive
+    fragments with the same topic belong to the same section.
+    """
+    from pypdf import PdfReader  # optional dependency, only needed for ingestion
+
+    topic = os.path.splitext(os.path.basename(pdf_path))[0]
+    for page_no, page in enumerate(PdfReader(pdf_path).pages, start=1):
+        lines = []
+        for line in (page.extract_text() or "").splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if SECTION_HEADING_RE.match(line):
+                if lines:
+                    yield topic, "\n".join(lines), page_no
+                    lines = []
+                topic = line
+            else:
+                lines.append(line)
+        if lines:
+            yield topic, "\n".join(lines), page_no
+
+
+def extract_sections(pdf_path: str) -> dict:
+    """Whole-document {topic: text}; prefer iter_sections for large files."""
+    sections = {}
+    for topic, text, _ in iter_sections(pdf_path):
+        sections[topic] = f"{sections[topic]}\n{text}" if topic in sections else text
+    return sections
+
+
+def iter_chunks(fragments, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP):
+    """
+    Split streamed (topic, text, page) fragments into overlapping chunks of at most
+    max_tokens tokens that never cross a topic boundary. Yields (id, document, metadata);
+    only the current section's unflushed tail is held in memory.
+    """
+    overlap = min(overlap, max_tokens - 1)
+    topic, first_page, index = None, None, 0
+    buf, fresh = [], 0  # fresh = tokens in buf not yet emitted in any chunk
+
+    def emit(tokens, page):
+        document = f"{topic}\n{' '.join(tokens)}"
+        return document_id(document), document, {"topic": topic, "chunk": index, "page": page}
+
+    for frag_topic, text, page in fragments:
+        if frag_topic != topic:
+            if fresh:
+                yield emit(buf, first_page)
+            topic, first_page, index = frag_topic, page, 0
+            buf, fresh = [], 0
+        tokens = text.split()
+        buf.extend(tokens)
+        fresh += len(tokens)
+        while len(buf) >= max_tokens:
+            yield emit(buf[:max_tokens], first_page)
+            index += 1
+            buf = buf[max_tokens - overlap:]
+            fresh = max(0, len(buf) - overlap)
+            first_page = page
+    if fresh:
+        yield emit(buf, first_page)
+
+
+class GeminiEmbeddingBackend:
+    """Gemini embedding API; one call per batch, retried on transient errors."""
+
+    def __init__(self, model: str = EMBED_MODEL):
+        self.model = model
+        self.name = f"gemini:{model}"
+
+    def embed(self, texts: list[str], task: str) -> list[list[float]]:
+        retry_policy = {"retry": retry.Retry(predicate=retry.if_transient_error)}
+        response = genai.embed_content(
+            model=self.model,
+            content=texts,
+            task_type=task,
+            request_options=retry_policy,
+        )
+        return response["embedding"]
+
+
+class LocalEmbeddingBackend:
+    """Offline stand-in: signed feature hashing of word unigrams and bigrams.
+    Deterministic and needs no model or API, so the pipeline can run and be benchmarked offline.
+    Same scheme as app.py's _HashingEmbedder (float64 here), so the two give matching vectors.
+    """
+
+    _word = re.compile(r"[a-z0-9]+")
+
+    def __init__(self, dim: int = EMBED_LOCAL_DIM):
+        self.dim = dim
+        self.name = f"local-hashing-{dim}"
+
+    def embed(self, texts: list[str], task: str) -> list[list[float]]:
+        # hash every feature, then one bincount builds the whole batch
+        rows, cols, signs = array("q"), array("q"), array("d")
+        for i, text in enumerate(texts):
+            toks = self._word.findall(text.lower())
+            for feat in toks + [f"{a} {b}" for a, b in zip(toks, toks[1:])]:
+                h = zlib.crc32(feat.encode())
+                rows.append(i)
+                cols.append(h % self.dim)
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+        flat = np.frombuffer(rows, dtype=np.int64) * self.dim + np.frombuffer(cols, dtype=np.int64)
+        out = np.bincount(flat, weights=np.frombuffer(signs), minlength=len(texts) * self.dim)
+        out = out.reshape(len(texts), self.dim).astype(np.float64, copy=False)
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out.tolist()
+
+
+def get_embedding_backend(name: str = None):
+    name = (name or EMBED_BACKEND).lower()
+    if name == "local":
+        return LocalEmbeddingBackend()
+    if name == "gemini":
+        return GeminiEmbeddingBackend()
+    raise ValueError(f"Unknown embedding backend '{name}' (expected 'gemini' or 'local')")
+
+
+class EmbeddingCache:
+    """Embeddings on disk (SQLite), keyed by sha256 of backend name, task and text."""
+
+    def __init__(self, path: str = EMBED_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(backend_name: str, task: str, text: str) -> str:
+        return hashlib.sha256(f"{backend_name}\0{task}\0{text}".encode()).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):  # stay under SQLite's bound-parameter limit
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, items: dict[str, list[float]]) -> None:
+        if not items:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(k, array("f", v).tobytes()) for k, v in items.items()],
+            )
+            self._conn.commit()
+
+
+_embedding_cache = None
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
 class GeminiEmbeddingFunction(EmbeddingFunction):
     # Specify whether to generate embeddings for documents, or queries
     document_mode = True
 
+    def __init__(self, backend=None, cache: EmbeddingCache = None, batch_size: int = EMBED_BATCH_SIZE,
+                 concurrency: int = EMBED_CONCURRENCY):
+        self.backend = backend or get_embedding_backend()
+        self.cache = cache if cache is not None else get_embedding_cache()
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+
     def __call__(self, input: Documents) -> Embeddings:
         if self.document_mode:
             embedding_task = "retrieval_document"
         else:
             embedding_task = "retrieval_query"
 
-        retry_policy = {"retry": retry.Retry(predicate=retry.if_transient_error)}
+        keys = [EmbeddingCache.key(self.backend.name, embedding_task, text) for text in input]
+        vectors = self.cache.get_many(list(set(keys)))
 
-        response = genai.embed_content(
-            model="models/text-embedding-004",
-            content=input,
-            task_type=embedding_task,
-            request_options=retry_policy,
-        )
-        return response["embedding"]
+        # Embed each distinct uncached text once, in provider-sized batches sent concurrently
+        missing = {}
+        for key, text in zip(keys, input):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            miss_keys, miss_texts = list(missing), list(missing.values())
+            batches = [miss_texts[i:i + self.batch_size] for i in range(0, len(miss_texts), self.batch_size)]
+            if len(batches) == 1 or self.concurrency == 1:
+                results = [self.backend.embed(batch, embedding_task) for batch in batches]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as pool:
+                    results = list(pool.map(lambda batch: self.backend.embed(batch, embedding_task), batches))
+            fresh = dict(zip(miss_keys, (vec for batch in results for vec in batch)))
+            self.cache.put_many(fresh)
+            vectors.update(fresh)
+            logging.info(f"Embedded {len(fresh)} texts in {len(batches)} batches ({len(set(keys)) - len(fresh)} cached).")
 
+        return [vectors[key] for key in keys]
 
-def get_contextual_definition(highlighted_text):
-    search_term = highlighted_text.strip()
-    print(f"🔍 Looking up: '{search_term}'")
 
-    results = db.query(query_texts=[search_term], n_results=1)
+_WORD_RE = re.compile(r"[a-z0-9]+")
 
-    if not results["documents"] or not results["documents"][0]:
-        print("⚠️ No relevant passage found. Returning fallback.")
-        return f"❌ No relevant passage found for '{search_term}'. Please try a more specific phrase."
+def normalize_query(text: str) -> str:
+    return " ".join(_WORD_RE.findall(text.lower()))
 
-    [[passage]] = results["documents"]
 
-    print(f"📚 Found passage: {passage[:200]}...")
-    
-    # Create explanation prompt
-    prompt = f"""Explain the specific meaning and context of the term '{search_term}' 
-based EXCLUSIVELY on this technical document passage and give a properly structured answer with proper line spacing and framework. Include:
+def count_tokens(text: str) -> int:
+    return len(text.split())
+
+
+def _lexical_overlap(query_terms: set, document: str) -> float:
+    """Share of distinct query terms that appear in the document."""
+    if not query_terms:
+        return 0.0
+    return len(query_terms & set(_WORD_RE.findall(document.lower()))) / len(query_terms)
+
+
+def _mmr(relevance: np.ndarray, vectors: np.ndarray, k: int, lam: float) -> list[int]:
+    """Maximal marginal relevance: trade relevance against similarity to already picked passages."""
+    picked, left = [], list(range(len(relevance)))
+    max_sim = np.zeros(len(relevance), dtype=np.float32)
+    while left and len(picked) < k:
+        scores = lam * relevance[left] - (1 - lam) * max_sim[left]
+        best = left.pop(int(np.argmax(scores)))
+        picked.append(best)
+        max_sim = np.maximum(max_sim, vectors @ vectors[best])
+    return picked
+
+
+def retrieve(query: str, k: int = RETRIEVE_K, budget_tokens: int = CONTEXT_TOKENS, collection=None) -> list[dict]:
+    """
+    Top-k passages for a query, best first: [{"document", "metadata", "score"}].
+    Fetches RETRIEVE_CANDIDATES by vector similarity, reranks them with lexical overlap
+    and MMR, then keeps as many as fit budget_tokens. Results are cached per normalized
+    query until the next reload. Returns [] when there is no index or no match.
+    Searches the module index unless another ``collection`` is given.
+    """
+    coll = db if collection is None else collection
+    key = (normalize_query(query), k, budget_tokens, id(coll))
+    with _query_cache_lock:
+        if key in _query_cache:
+            _query_cache.move_to_end(key)
+            return _query_cache[key]
+
+    count = coll.count() if coll is not None else 0
+    if not key[0] or count == 0:
+        return []
+
+    embed = GeminiEmbeddingFunction()
+    embed.document_mode = False
+    qvec = np.asarray(embed([query])[0], dtype=np.float32)
+    res = coll.query(
+        query_embeddings=[qvec.tolist()],
+        n_results=min(max(k, RETRIEVE_CANDIDATES), count),
+        include=["documents", "metadatas", "embeddings"],
+    )
+    docs = (res.get("documents") or [[]])[0]
+    if not docs:
+        return []
+    metas = (res.get("metadatas") or [[None] * len(docs)])[0]
+    vecs = np.asarray(res["embeddings"][0], dtype=np.float32)
+    vecs /= np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+    qvec /= max(float(np.linalg.norm(qvec)), 1e-12)
+
+    terms = set(key[0].split())
+    relevance = (1 - LEXICAL_WEIGHT) * (vecs @ qvec) + LEXICAL_WEIGHT * np.array(
+        [_lexical_overlap(terms, d) for d in docs], dtype=np.float32
+    )
+
+    passages, used = [], 0
+    for i in _mmr(relevance, vecs, len(docs), MMR_LAMBDA):
+        if relevance[i] <= 0:
+            continue
+        tokens = count_tokens(docs[i])
+        if passages and used + tokens > budget_tokens:
+            continue  # a smaller, lower-ranked passage may still fit
+        passages.append({"document": docs[i], "metadata": metas[i] or {}, "score": float(relevance[i])})
+        used += tokens
+        if len(passages) >= k:
+            break
+
+    with _query_cache_lock:
+        _query_cache[key] = passages
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    return passages
+
+
+def format_context(passages: list[dict]) -> str:
+    return "\n\n".join(p["document"].replace("\n", " ") for p in passages)
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+def get_model(name: str = GENERATION_MODEL):
+    """Shared GenerativeModel per model name; constructing one per call is wasted work."""
+    model = _models.get(name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(name)
+            if model is None:
+                model = _models[name] = genai.GenerativeModel(name)
+    return model
+
+
+class ResponseCache:
+    """Thread-safe LRU of generated answers with a per-entry TTL."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, ttl_sec: int = RESPONSE_CACHE_TTL_SEC):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(kind: str, text: str, passage: str) -> tuple:
+        return kind, normalize_query(text), hashlib.sha256(passage.encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_sec, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+response_cache = ResponseCache()
+_inflight = {}
+_generation_slots = weakref.WeakKeyDictionary()  # event loop -> Semaphore
+
+
+def generate(kind: str, text: str, passage: str, prompt: str) -> str:
+    key = ResponseCache.key(kind, text, passage)
+    answer = response_cache.get(key)
+    if answer is None:
+        answer = get_model().generate_content(prompt).text
+        response_cache.put(key, answer)
+    return answer
+
+
+async def generate_async(kind: str, text: str, passage: str, prompt: str) -> str:
+    """
+    Async generate(): concurrent calls for the same key share one request, and at most
+    GENERATION_CONCURRENCY requests per event loop are in flight at once.
+    """
+    key = ResponseCache.key(kind, text, passage)
+    answer = response_cache.get(key)
+    if answer is not None:
+        return answer
+    loop = asyncio.get_running_loop()
+    task = _inflight.get((loop, key))
+    if task is None:
+        task = _inflight[(loop, key)] = loop.create_task(_generate_once(loop, key, prompt))
+    return await asyncio.shield(task)
+
+
+async def _generate_once(loop, key, prompt: str) -> str:
+    try:
+        slots = _generation_slots.get(loop)
+        if slots is None:
+            slots = _generation_slots[loop] = asyncio.Semaphore(GENERATION_CONCURRENCY)
+        async with slots:
+            response = await get_model().generate_content_async(prompt)
+        response_cache.put(key, response.text)
+        return response.text
+    finally:
+        _inflight.pop((loop, key), None)
+
+
+def _definition_prompt(search_term: str, passage: str) -> str:
+    return f"""Explain the specific meaning and context of the term '{search_term}' 
+based EXCLUSIVELY on these technical document passages and give a properly structured answer with proper line spacing and framework. Include:
 
 1. Operational context
 
@@ -67,15 +481,52 @@ based EXCLUSIVELY on this technical document passage and give a properly structu
 
 Give me the answer in a paragraph with two headings 'Operational Context' and 'Other Use-cases'. Each paragraph should not exceed 50 words.
 
-Passage: {passage.replace('\n', ' ')}
+Passages:
+{passage}
 """
 
-    
-    # Generate and return answer
-    model = genai.GenerativeModel("gemini-1.5-flash-latest")
-    response = model.generate_content(prompt)
+
+def _chat_prompt(query: str, passage: str) -> str:
+    return f"""You are a helpful and friendly assistant that answers questions based on the technical document. 
+Answer casually and clearly, but stay factually accurate and refer only to the passages. 
+Here are the passages:
+{passage}
+Question: {query}
+Answer:"""
+
+
+def _no_definition(search_term: str) -> str:
+    return f"❌ No relevant passage found for '{search_term}'. Please try a more specific phrase."
+
+
+NO_ANSWER = "I couldn't find anything about that in the document. Could you rephrase or be more specific?"
+
+
+def get_contextual_definition(highlighted_text):
+    search_term = highlighted_text.strip()
+    print(f"🔍 Looking up: '{search_term}'")
+
+    passages = retrieve(search_term)
+    if not passages:
+        print("⚠️ No relevant passage found. Returning fallback.")
+        return _no_definition(search_term)
+
+    passage = format_context(passages)
+    print(f"📚 Found {len(passages)} passages: {passage[:200]}...")
+
+    answer = generate("definition", search_term, passage, _definition_prompt(search_term, passage))
     s = f"\nContextual meaning of '{search_term}':"
-    return(s + response.text)
+    return(s + answer)
+
+
+async def get_contextual_definition_async(highlighted_text):
+    search_term = highlighted_text.strip()
+    passages = await asyncio.to_thread(retrieve, search_term)
+    if not passages:
+        return _no_definition(search_term)
+    passage = format_context(passages)
+    answer = await generate_async("definition", search_term, passage, _definition_prompt(search_term, passage))
+    return f"\nContextual meaning of '{search_term}':" + answer
 
 # Run the interactive lookup
 '''
@@ -83,44 +534,327 @@ for highlighted_text in clipboard_highight_monitor():
     print(get_contextual_definition(highlighted_text))
 '''
 
-def reload_rag_model(pdf_path: str = None) -> None:
+def document_id(document: str) -> str:
+    """Content-hash id: unchanged sections keep their id (and embedding) across reloads."""
+    return hashlib.sha256(document.encode()).hexdigest()[:32]
+
+
+def _get_collection(name: str):
+    try:
+        return chroma_client.get_collection(name=name, embedding_function=GeminiEmbeddingFunction())
+    except Exception:
+        return None
+
+
+def _drop_collections(keep: set) -> None:
+    """Drop index collections not in ``keep``: superseded builds and leftovers of interrupted reloads."""
+    for coll in chroma_client.list_collections():
+        name = getattr(coll, "name", coll)
+        if (name == COLLECTION_NAME or name.startswith(f"{COLLECTION_NAME}__")) and name not in keep:
+            try:
+                chroma_client.delete_collection(name)
+            except Exception as e:
+                logging.warning(f"Could not drop RAG collection '{name}': {e}")
+
+
+def _copy_in_batches(src, dst, ids: list[str], batch_size: int = 1000) -> None:
+    """Copy stored documents and embeddings between collections without re-embedding."""
+    for i in range(0, len(ids), batch_size):
+        got = src.get(ids=ids[i:i + batch_size], include=["documents", "embeddings", "metadatas"])
+        dst.add(ids=got["ids"], documents=got["documents"], embeddings=got["embeddings"],
+                metadatas=got["metadatas"])
+
+
+class _ShadowBuilder:
     """
-    Build or rebuild the Chroma collection from scratch.
+    Fills the shadow collection as chunks stream in: new chunks are embedded in
+    batches sized to keep every embedding worker busy, unchanged ones are copied
+    over with their stored vectors. The shadow is only created once there is a change,
+    under a fresh versioned name, so it never collides with a collection being read.
+    """
+
+    def __init__(self, live, batch_size: int):
+        self.live = live
+        self.batch_size = batch_size
+        self.shadow = None
+        self.kept_ids = []
+        self._copied = 0
+        self._ids, self._docs, self._metas = [], [], []
+        self.added = 0
+
+    def _ensure_shadow(self):
+        if self.shadow is None:
+            self.shadow = chroma_client.create_collection(
+                name=f"{COLLECTION_NAME}__{time.time_ns()}",
+                embedding_function=GeminiEmbeddingFunction()
+            )
+        return self.shadow
+
+    @property
+    def changed(self) -> bool:
+        return self.added > 0 or bool(self._ids)
+
+    def keep(self, doc_id: str) -> None:
+        self.kept_ids.append(doc_id)
+        if self.shadow is not None and len(self.kept_ids) - self._copied >= 1000:
+            self._copy_kept()
+
+    def add(self, doc_id: str, document: str, metadata: dict) -> None:
+        self._ids.append(doc_id)
+        self._docs.append(document)
+        self._metas.append({k: v for k, v in metadata.items() if v is not None})
+        if len(self._ids) >= self.batch_size:
+            self._flush_added()
+
+    def _copy_kept(self) -> None:
+        if self._copied < len(self.kept_ids):
+            _copy_in_batches(self.live, self._ensure_shadow(), self.kept_ids[self._copied:])
+            self._copied = len(self.kept_ids)
+
+    def _flush_added(self) -> None:
+        if self._ids:
+            self._ensure_shadow().add(ids=self._ids, documents=self._docs, metadatas=self._metas)
+            self.added += len(self._ids)
+            self._ids, self._docs, self._metas = [], [], []
+
+    def finish(self):
+        self._flush_added()
+        self._copy_kept()
+        return self.shadow
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_manifest() -> dict:
+    """What the stored index was built from: source hash, embedding model and live collection name."""
+    global _manifest
+    if not _manifest and CHROMA_PATH:
+        try:
+            with open(os.path.join(CHROMA_PATH, MANIFEST_NAME)) as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            _manifest = {}
+    return _manifest
+
+
+def _write_manifest(manifest: dict) -> None:
+    global _manifest
+    _manifest = manifest
+    if CHROMA_PATH:
+        path = os.path.join(CHROMA_PATH, MANIFEST_NAME)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+
+def load_rag_model(pdf_path: str = None) -> None:
+    """
+    Open the stored index if it was built from this exact file with the current
+    embedding model; otherwise (re)index it. Without a path, open whatever is stored.
     """
     global db
-    try:
-        chroma_client.delete_collection("googlecardb")
-        logging.info("Deleted existing collection.")
-    except:
-        logging.info("No existing collection to delete; continuing.")
-
-    db = chroma_client.get_or_create_collection(
-        name="googlecardb",
-        embedding_function=GeminiEmbeddingFunction()
-    )
+    manifest = _read_manifest()
+    embedding_model = get_embedding_backend().name
+    source_hash = file_sha256(pdf_path) if pdf_path else manifest.get("source_sha256")
+    if manifest.get("source_sha256") == source_hash and manifest.get("embedding_model") == embedding_model:
+        coll = _get_collection(manifest.get("collection") or COLLECTION_NAME)
+        if coll is not None and coll.count() == manifest.get("doc_count"):
+            db = coll
+            with _query_cache_lock:
+                _query_cache.clear()
+            logging.info(f"✅ Opened stored RAG index ({manifest['doc_count']} docs from '{manifest.get('source_path')}').")
+            return
+    if pdf_path:
+        reload_rag_model(pdf_path)
+    else:
+        logging.info("No usable stored RAG index; call load_rag_model with a PDF path.")
+
 
-    # Extract text sections & ingest
-    topic_text_dict = extract_sections(pdf_path)
-    docs = create_documents_from_dict(topic_text_dict)
-    db.add(documents=docs, ids=[str(i) for i in range(len(docs))])
-    logging.info(f"✅ RAG model reset from '{pdf_path}', {len(docs)} docs loaded.")
+def reload_rag_model(pdf_path: str = None, sections=None) -> None:
+    """
+    Incrementally re-index the Chroma collection from the PDF.
+
+    Sections are keyed by content hash and diffed against the live collection.
+    Only new or edited sections are embedded. The next index is built in a shadow
+    collection from the unchanged rows (copied with their stored embeddings) plus the
+    new ones, then swapped in, so queries keep hitting the old index during a reload.
+    Every build gets its own collection name and the manifest points at the live one;
+    the previous build is kept until the next reload so in-flight queries on it finish.
+    ``sections`` may supply (topic, text, page) fragments instead of reading ``pdf_path``.
+    """
+    global db
+    embedding_model = get_embedding_backend().name
+    source_hash = file_sha256(pdf_path) if pdf_path and os.path.isfile(pdf_path) else None
+
+    with _reload_lock:
+        live = db or _get_collection(_read_manifest().get("collection") or COLLECTION_NAME)
+        # Stored embeddings are only reusable if they came from the same model
+        reusable = live is not None and _read_manifest().get("embedding_model", embedding_model) == embedding_model
+        live_ids = set(live.get(include=[])["ids"]) if reusable else set()
+
+        builder = _ShadowBuilder(live, EMBED_BATCH_SIZE * EMBED_CONCURRENCY)
+        seen = set()
+        for doc_id, document, metadata in iter_chunks(sections if sections is not None else iter_sections(pdf_path)):
+            if doc_id in seen:
+                continue
+            seen.add(doc_id)
+            if doc_id in live_ids:
+                builder.keep(doc_id)
+            else:
+                builder.add(doc_id, document, metadata)
+        removed = live_ids - seen
+
+        manifest = {
+            "source_path": pdf_path,
+            "source_sha256": source_hash,
+            "embedding_model": embedding_model,
+            "collection": live.name if live is not None else None,
+            "doc_count": len(seen),
+            "built_at": int(time.time()),
+        }
+        if reusable and not builder.changed and not removed:
+            db = live
+            manifest["previous_collection"] = _read_manifest().get("previous_collection")
+            _write_manifest(manifest)
+            logging.info(f"✅ RAG index for '{pdf_path}' unchanged ({len(seen)} docs).")
+            return
+
+        shadow = builder.finish() or builder._ensure_shadow()  # an empty document still swaps in an empty index
+
+        # Swap: readers pick up the new collection object and the manifest names it;
+        # only builds older than the one just replaced are dropped
+        manifest["collection"] = shadow.name
+        manifest["previous_collection"] = live.name if live is not None else None
+        db = shadow
+        _write_manifest(manifest)
+        with _query_cache_lock:
+            _query_cache.clear()
+        _drop_collections({shadow.name, manifest["previous_collection"]})
+
+    logging.info(
+        f"✅ RAG index updated from '{pdf_path}': {builder.added} embedded, {len(builder.kept_ids)} reused, "
+        f"{len(removed)} removed ({len(seen)} docs)."
+    )
 
 
 def chat_with_doc(user_question):
     # Clean the input
     query = user_question.strip()
 
-    # Query ChromaDB for relevant context
-    results = db.query(query_texts=[query], n_results=1)
-    [[passage]] = results["documents"]
+    # Retrieve, rerank and pack the most relevant passages
+    passages = retrieve(query)
+    if not passages:
+        return NO_ANSWER
+    passage = format_context(passages)
+    return generate("chat", query, passage, _chat_prompt(query, passage))
 
-    # Chat-style prompt
-    prompt = f"""You are a helpful and friendly assistant that answers questions based on the technical document. 
-Answer casually and clearly, but stay factually accurate and refer only to the passage. 
-Here is the passage: {passage.replace('\n', ' ')}
-Question: {query}
-Answer:"""
 
-    model = genai.GenerativeModel("gemini-1.5-flash-latest")
-    response = model.generate_content(prompt)
-    return response.text
+async def chat_with_doc_async(user_question):
+    query = user_question.strip()
+    passages = await asyncio.to_thread(retrieve, query)
+    if not passages:
+        return NO_ANSWER
+    passage = format_context(passages)
+    return await generate_async("chat", query, passage, _chat_prompt(query, passage))
+
+
+class RagOverloaded(RuntimeError):
+    """The service already has max_pending distinct questions in flight."""
+
+
+class GeminiGenerator:
+    """Async text generator backed by the shared Gemini model."""
+
+    def __init__(self, model_name: str = GENERATION_MODEL):
+        self.model_name = model_name
+
+    async def generate(self, prompt: str) -> str:
+        response = await get_model(self.model_name).generate_content_async(prompt)
+        return response.text
+
+
+class RagService:
+    """
+    Async front for a collection and a generator, for serving many lookups at once.
+
+    Identical in-flight questions (after normalization) are coalesced into one
+    retrieval + generation; at most max_concurrency run at a time and new distinct
+    questions beyond max_pending raise RagOverloaded. Answers go through the shared
+    ResponseCache. Await chat()/define() from a single event loop, or use call() from
+    threads, which runs them on the service's own background loop.
+    """
+
+    def __init__(self, collection=None, generator=None, max_concurrency: int = GENERATION_CONCURRENCY,
+                 max_pending: int = SERVICE_MAX_PENDING, cache: ResponseCache = None):
+        self.collection = collection  # None follows the module index across reloads
+        self.generator = generator or GeminiGenerator()
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.cache = cache if cache is not None else response_cache
+        self.stats = {"requests": 0, "coalesced": 0, "cache_hits": 0, "generated": 0, "rejected": 0}
+        self._inflight = {}
+        self._slots = None
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    async def chat(self, question: str) -> str:
+        return await self._answer("chat", question.strip())
+
+    async def define(self, term: str) -> str:
+        return await self._answer("definition", term.strip())
+
+    async def _answer(self, kind: str, text: str) -> str:
+        self.stats["requests"] += 1
+        key = (kind, normalize_query(text))
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            if len(self._inflight) >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise RagOverloaded(f"{len(self._inflight)} questions already in flight")
+            task = self._inflight[key] = asyncio.get_running_loop().create_task(self._run(kind, text, key))
+        return await asyncio.shield(task)
+
+    async def _run(self, kind: str, text: str, key) -> str:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        try:
+            async with self._slots:
+                passages = await asyncio.to_thread(retrieve, text, collection=self.collection)
+                if not passages:
+                    return _no_definition(text) if kind == "definition" else NO_ANSWER
+                passage = format_context(passages)
+                cache_key = ResponseCache.key(kind, text, passage)
+                answer = self.cache.get(cache_key)
+                if answer is None:
+                    prompt = _definition_prompt(text, passage) if kind == "definition" else _chat_prompt(text, passage)
+                    answer = await self.generator.generate(prompt)
+                    self.cache.put(cache_key, answer)
+                    self.stats["generated"] += 1
+                else:
+                    self.stats["cache_hits"] += 1
+            return f"\nContextual meaning of '{text}':" + answer if kind == "definition" else answer
+        finally:
+            self._inflight.pop(key, None)
+
+    def call(self, method: str, text: str, timeout: float = None) -> str:
+        """Blocking entry point for threaded callers (e.g. Flask views)."""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="rag-service", daemon=True).start()
+        coro = {"chat": self.chat, "define": self.define}[method](text)
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            future.cancel()  # drops this waiter; a shared in-flight answer still completes and is cached
+            raise
+
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 # Lazy imports for heavy ML deps; populated when STT is enabled
 AutoProcessor = None
@@ -30,8 +30,24 @@ import html as htmllib
 import json
 import random
 import math
+import base64
+import binascii
+import bisect
+import hashlib
+import itertools
+import heapq
+import socket
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
 from datetime import datetime, timedelta, timezone
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from array import array
+from collections.abc import Callable
+from dataclasses import dataclass
+from functools import lru_cache
 from apscheduler.schedulers.background import BackgroundScheduler
 from urllib.parse import urlparse
 
@@ -46,7 +62,30 @@ HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "5001"))
 DB_PATH = os.getenv("DB_PATH", os.path.join(os.getcwd(), "zuno.db"))
 SCHED_ENABLED = str(os.getenv("SCHED_ENABLED", "1")).lower() in ("1", "true", "yes")
-SCHED_INTERVAL_MIN = int(os.getenv("SCHED_INTERVAL_MIN", "30"))
+SCHED_INTERVAL_MIN = int(os.getenv("SCHED_INTERVAL_MIN", "30"))  # per-watch recheck interval
+SCHED_TICK_SEC = int(os.getenv("SCHED_TICK_SEC", "60"))
+SCHED_BATCH_SIZE = int(os.getenv("SCHED_BATCH_SIZE", "200"))
+SCHED_MAX_BATCHES_PER_TICK = int(os.getenv("SCHED_MAX_BATCHES_PER_TICK", "10"))
+SCHED_LEASE_SEC = int(os.getenv("SCHED_LEASE_SEC", "300"))
+WATCH_BULK_MAX = int(os.getenv("WATCH_BULK_MAX", "1000"))
+WAYBACK_CONCURRENCY = int(os.getenv("WAYBACK_CONCURRENCY", "6"))
+WAYBACK_CDX_TTL_HOURS = int(os.getenv("WAYBACK_CDX_TTL_HOURS", "24"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+RAG_CACHE_MAX_BYTES = int(os.getenv("RAG_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+RAG_TTL_HOURS = int(os.getenv("RAG_TTL_HOURS", "168"))
+RAG_EMBED_MODEL = os.getenv("RAG_EMBED_MODEL", "")  # sentence-transformers model; empty -> hashing vectorizer
+RAG_EMBED_DIM = int(os.getenv("RAG_EMBED_DIM", "512"))
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+RAG_IVF_MIN_CHUNKS = int(os.getenv("RAG_IVF_MIN_CHUNKS", "2048"))
+RAG_IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "32"))
+RAG_CHUNK_MAX_TOKENS = int(os.getenv("RAG_CHUNK_MAX_TOKENS", "150"))  # ~ the old 450-char chunks
+RAG_MAX_CHUNKS = int(os.getenv("RAG_MAX_CHUNKS", "50"))
+RAG_CHUNK_HALF_LIFE_DAYS = float(os.getenv("RAG_CHUNK_HALF_LIFE_DAYS", "90"))  # recency decay when ranking chunks
+RAG_DOC_PDF_PATH = os.getenv("RAG_DOC_PDF_PATH", "")  # document for /rag/doc/ask; empty opens the stored RAG.py index
+RAG_DOC_TIMEOUT_SEC = float(os.getenv("RAG_DOC_TIMEOUT_SEC", "60"))
+RAG_DOC_RETRY_SEC = float(os.getenv("RAG_DOC_RETRY_SEC", "60"))  # how long a failed RAG.py load is served as 503
+SUBSCRIPTIONS_AUDIT_MAX_AGE_SEC = int(os.getenv("SUBSCRIPTIONS_AUDIT_MAX_AGE_SEC", "900"))
+SUBSCRIPTION_GAP_WINDOW = int(os.getenv("SUBSCRIPTION_GAP_WINDOW", "24"))  # recent gaps kept per key for scoring
 APP_ENV = os.getenv("APP_ENV", "development")
 
 # Knot API Configuration
@@ -65,85 +104,682 @@ app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
 # -------------------------------------------------
-# Lightweight RAG store for Deal Hunter personalization
+# Normalized transaction records
 # -------------------------------------------------
-RAG_STORE: dict[str, list[str]] = {}
+# Knot transactions arrive as nested dicts. Each one is normalized once into a
+# TxnRecord (epoch timestamp, merchant, cents); a sync's records are packed into
+# a columnar TxnBatch that analytics (RAG chunking, recurrence detection, audit
+# state, watch matching, product search) run over instead of re-walking dicts.
 
-def _chunk_transactions(transactions: list[dict], max_chars: int = 450) -> list[str]:
-    """Create simple textual chunks from transaction dicts.
-    Groups by merchant and month to keep chunks relevant and short.
-    """
+def _parse_dt(value: str) -> datetime | None:
     try:
-        from collections import defaultdict
-        from datetime import datetime
+        dt = datetime.fromisoformat((value or "").replace("Z", "+00:00"))
+        # Ensure timezone-aware in UTC
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.astimezone(timezone.utc)
     except Exception:
-        return []
-    by_key = defaultdict(list)
-    for t in transactions or []:
-        merchant_name = None
-        m = t.get("merchant") or {}
-        if isinstance(m, dict):
-            merchant_name = m.get("name") or m.get("merchant_name")
-        elif m:
-            merchant_name = str(m)
-        merchant_name = merchant_name or (t.get("retailer") or t.get("brand") or "Unknown")
-        ts = t.get("datetime") or t.get("ts") or t.get("date") or ""
+        return None
+
+@lru_cache(maxsize=65536)
+def _parse_epoch(value: str) -> float | None:
+    """Epoch seconds for an ISO timestamp; feeds repeat the same stamps across merchants and syncs."""
+    dt = _parse_dt(value)
+    return dt.timestamp() if dt else None
+
+def _cents(value) -> int | None:
+    if value is None:
+        return None
+    try:
+        return round(float(value) * 100)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return round(float(str(value).replace("$", "").replace(",", "")) * 100)
+    except ValueError:
+        return None
+
+@dataclass(slots=True)
+class TxnProduct:
+    name: str
+    total_cents: int | None
+    external_id: str | None = None
+    url: str | None = None
+    quantity: float | None = None
+
+@dataclass(slots=True)
+class TxnRecord:
+    ts: float | None  # epoch seconds, UTC
+    merchant_id: int | None
+    merchant_name: str | None
+    total_cents: int | None
+    title: str
+    products: tuple[TxnProduct, ...]
+    raw: dict
+    has_discount: bool = False
+    txn_id: str | None = None  # the feed's transaction id, when it has one
+
+    @property
+    def month(self) -> str:
+        if self.ts is None:
+            return "unknown"
+        return time.strftime("%Y-%m", time.gmtime(self.ts))
+
+def _product_cents(p: dict) -> int | None:
+    # prefer 'total' then 'sub_total' then unit_price * quantity
+    price_info = p.get("price") or {}
+    cents = _cents(price_info.get("total"))
+    if cents is None:
+        cents = _cents(price_info.get("sub_total"))
+    if cents is None:
+        unit = _cents(price_info.get("unit_price"))
+        if unit is not None:
+            try:
+                cents = round(unit * float(p.get("quantity") or 1))
+            except (TypeError, ValueError):
+                cents = None
+    return cents
+
+def _normalize_txn(t: dict) -> TxnRecord:
+    m = t.get("merchant") or {}
+    if isinstance(m, dict):
+        merchant_id = m.get("id")
+        merchant_name = m.get("name") or m.get("merchant_name")
+    else:
+        merchant_id, merchant_name = None, (str(m) if m else None)
+    merchant_name = merchant_name or t.get("retailer") or t.get("brand")
+
+    products = []
+    for p in t.get("products") or []:
+        if not isinstance(p, dict):
+            continue
+        qty = p.get("quantity")
+        products.append(TxnProduct(
+            p.get("name") or "", _product_cents(p), p.get("external_id"), p.get("url"),
+            float(qty) if isinstance(qty, (int, float)) else None,
+        ))
+    price = t.get("price")
+    total = _cents(price.get("total")) if isinstance(price, dict) else None
+    if total is None and isinstance(t.get("price_total"), (int, float)):
+        total = _cents(t["price_total"])
+    adjustments = (price.get("adjustments") if isinstance(price, dict) else None) or []
+    ts = t.get("datetime") or t.get("ts") or t.get("date")
+    txn_id = t.get("id") or t.get("transaction_id")
+    return TxnRecord(
+        ts=_parse_epoch(str(ts)) if ts else None,
+        merchant_id=merchant_id if isinstance(merchant_id, int) else None,
+        merchant_name=merchant_name,
+        total_cents=total,
+        title=(products[0].name if products else None) or t.get("description") or t.get("title") or "Purchase",
+        products=tuple(products),
+        raw=t,
+        has_discount=any(isinstance(a, dict) and a.get("type") == "DISCOUNT" for a in adjustments),
+        txn_id=str(txn_id) if txn_id is not None else None,
+    )
+
+def _as_txn_records(transactions) -> list[TxnRecord]:
+    """Normalize raw transaction dicts; records that are already normalized pass through."""
+    return [t if isinstance(t, TxnRecord) else _normalize_txn(t) for t in transactions or [] if t]
+
+def _numpy():
+    global np
+    if np is None:
+        import numpy as _np
+        np = _np
+    return np
+
+class TxnBatch:
+    """Columnar transactions built once per sync: one array per field, strings interned.
+
+    Transaction columns are indexed by row. Product lines are flattened into their
+    own columns; prod_txn maps each line to its row and prod_offsets[i]:prod_offsets[i+1]
+    slices row i's lines. String columns hold codes into ``strings`` (-1 for None);
+    missing timestamps/amounts are NaN and missing merchant ids -1.
+    """
+
+    __slots__ = ("ts", "total_cents", "merchant_id", "merchant", "title", "discount", "txn_id",
+                 "prod_offsets", "prod_txn", "prod_name", "prod_cents", "prod_ext", "prod_url", "prod_qty",
+                 "strings", "raw")
+
+    def __init__(self, transactions, keep_raw: bool = True):
+        _numpy()
+        pool: dict[str, int] = {}
+        strings: list[str] = []
+
+        def intern(s: str | None) -> int:
+            if s is None:
+                return -1
+            code = pool.get(s)
+            if code is None:
+                code = pool[s] = len(strings)
+                strings.append(s)
+            return code
+
+        nan = float("nan")
+        ts, total, mid, merch, title, disc = array("d"), array("d"), array("q"), array("i"), array("i"), array("b")
+        txn_id = array("i")
+        offsets = array("q", [0])
+        p_name, p_cents, p_ext, p_url, p_qty = array("i"), array("d"), array("i"), array("i"), array("d")
+        raw: list[dict] | None = [] if keep_raw else None
+        for t in transactions or []:
+            if not t:
+                continue
+            r = t if isinstance(t, TxnRecord) else _normalize_txn(t)
+            ts.append(nan if r.ts is None else r.ts)
+            total.append(nan if r.total_cents is None else r.total_cents)
+            mid.append(-1 if r.merchant_id is None else r.merchant_id)
+            merch.append(intern(r.merchant_name))
+            title.append(intern(r.title))
+            disc.append(r.has_discount)
+            txn_id.append(intern(r.txn_id))
+            for p in r.products:
+                p_name.append(intern(p.name))
+                p_cents.append(nan if p.total_cents is None else p.total_cents)
+                p_ext.append(intern(p.external_id))
+                p_url.append(intern(p.url))
+                p_qty.append(nan if p.quantity is None else p.quantity)
+            offsets.append(len(p_name))
+            if raw is not None:
+                raw.append(r.raw)
+
+        self.ts = np.frombuffer(ts, dtype=np.float64)
+        self.total_cents = np.frombuffer(total, dtype=np.float64)
+        self.merchant_id = np.frombuffer(mid, dtype=np.int64)
+        self.merchant = np.frombuffer(merch, dtype=np.int32)
+        self.title = np.frombuffer(title, dtype=np.int32)
+        self.discount = np.frombuffer(disc, dtype=np.int8).astype(bool)
+        self.txn_id = np.frombuffer(txn_id, dtype=np.int32)
+        self.prod_offsets = np.frombuffer(offsets, dtype=np.int64)
+        self.prod_txn = np.repeat(np.arange(len(ts), dtype=np.int64), np.diff(self.prod_offsets))
+        self.prod_name = np.frombuffer(p_name, dtype=np.int32)
+        self.prod_cents = np.frombuffer(p_cents, dtype=np.float64)
+        self.prod_ext = np.frombuffer(p_ext, dtype=np.int32)
+        self.prod_url = np.frombuffer(p_url, dtype=np.int32)
+        self.prod_qty = np.frombuffer(p_qty, dtype=np.float64)
+        self.strings = strings
+        self.raw = raw
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the column arrays (excludes the string pool and raw dicts)."""
+        return sum(getattr(self, f).nbytes for f in self.__slots__ if f not in ("strings", "raw"))
+
+    def string(self, code: int) -> str | None:
+        return self.strings[code] if code >= 0 else None
+
+    def record(self, i: int) -> TxnRecord:
+        lo, hi = int(self.prod_offsets[i]), int(self.prod_offsets[i + 1])
+        ts, total = float(self.ts[i]), float(self.total_cents[i])
+        return TxnRecord(
+            ts=None if ts != ts else ts,
+            merchant_id=None if self.merchant_id[i] < 0 else int(self.merchant_id[i]),
+            merchant_name=self.string(self.merchant[i]),
+            total_cents=None if total != total else int(total),
+            title=self.string(self.title[i]),
+            products=tuple(
+                TxnProduct(
+                    self.string(self.prod_name[j]),
+                    None if self.prod_cents[j] != self.prod_cents[j] else int(self.prod_cents[j]),
+                    self.string(self.prod_ext[j]),
+                    self.string(self.prod_url[j]),
+                    None if self.prod_qty[j] != self.prod_qty[j] else float(self.prod_qty[j]),
+                )
+                for j in range(lo, hi)
+            ),
+            raw=self.raw[i] if self.raw is not None else {},
+            has_discount=bool(self.discount[i]),
+            txn_id=self.string(self.txn_id[i]),
+        )
+
+    def to_records(self) -> list[TxnRecord]:
+        return [self.record(i) for i in range(len(self))]
+
+def _as_txn_batch(transactions) -> TxnBatch:
+    return transactions if isinstance(transactions, TxnBatch) else TxnBatch(transactions)
+
+# -------------------------------------------------
+# Lightweight RAG store for Deal Hunter personalization
+# -------------------------------------------------
+# Chunks live in SQLite (shared by every worker, survive restarts) together with
+# their embeddings; a byte-bounded LRU keeps hot users' chunk indexes in memory and
+# is validated against the row version on read.
+
+class _HashingEmbedder:
+    """Signed feature hashing of word unigrams and bigrams into ``dim`` buckets.
+    Needs no model and is deterministic across processes, so stored vectors stay valid.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: list[str]):
+        _numpy()
+        rows, cols, signs = array("q"), array("q"), array("d")
+        for i, text in enumerate(texts):
+            toks = _tokenize(text)
+            for feat in itertools.chain(toks, (f"{a} {b}" for a, b in zip(toks, toks[1:]))):
+                h = zlib.crc32(feat.encode())
+                rows.append(i)
+                cols.append(h % self.dim)
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+        flat = np.frombuffer(rows, dtype=np.int64) * self.dim + np.frombuffer(cols, dtype=np.int64)
+        out = np.bincount(flat, weights=np.frombuffer(signs), minlength=len(texts) * self.dim)
+        out = out.reshape(len(texts), self.dim).astype(np.float32)
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out
+
+class _SentenceEmbedder:
+    """Local sentence-transformers model on CPU (optional dependency)."""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.name = f"st:{model_name}"
+
+    def embed(self, texts: list[str]):
+        _numpy()
+        return np.asarray(self.model.encode(texts, batch_size=64, normalize_embeddings=True), dtype=np.float32)
+
+_embedder = None
+
+def _get_embedder():
+    global _embedder
+    if _embedder is None:
+        if RAG_EMBED_MODEL:
+            try:
+                _embedder = _SentenceEmbedder(RAG_EMBED_MODEL)
+            except Exception as e:
+                logger.warning(f"RAG embed model '{RAG_EMBED_MODEL}' unavailable, using hashing vectorizer: {e}")
+        if _embedder is None:
+            _embedder = _HashingEmbedder(RAG_EMBED_DIM)
+    return _embedder
+
+class _ChunkIndex:
+    """One user's chunks and their unit-length embeddings.
+
+    Searched brute force (one matrix-vector product); users with at least
+    RAG_IVF_MIN_CHUNKS chunks also get a coarse IVF partition (spherical k-means)
+    and only the RAG_IVF_NPROBE closest lists are scanned.
+    """
+
+    __slots__ = ("chunks", "vectors", "embedder", "version", "nbytes", "centroids", "lists")
+
+    def __init__(self, chunks: list[str], vectors, embedder: str, version: str, text_bytes: int):
+        self.chunks = chunks
+        self.vectors = vectors
+        self.embedder = embedder
+        self.version = version
+        self.centroids = self.lists = None
+        if len(chunks) >= RAG_IVF_MIN_CHUNKS:
+            self._build_ivf()
+        self.nbytes = text_bytes + vectors.nbytes + (self.centroids.nbytes if self.centroids is not None else 0)
+
+    def _build_ivf(self, iters: int = 6) -> None:
+        v = self.vectors
+        nlist = max(1, int(math.sqrt(len(v))))
+        rng = np.random.default_rng(0)
+        centroids = v[rng.choice(len(v), nlist, replace=False)].copy()
+        for _ in range(iters):
+            assign = np.argmax(v @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, v)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        assign = np.argmax(v @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        self.centroids = centroids
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(nlist)]
+
+    def search(self, query_vec, k: int) -> list[tuple[int, float]]:
+        """Top-k (chunk position, cosine similarity), best first."""
+        if not self.chunks:
+            return []
+        if self.centroids is None:
+            cand = None
+            scores = self.vectors @ query_vec
+        else:
+            nprobe = min(RAG_IVF_NPROBE, len(self.lists))
+            probe = np.argpartition(-(self.centroids @ query_vec), nprobe - 1)[:nprobe]
+            cand = np.concatenate([self.lists[c] for c in probe])
+            scores = self.vectors[cand] @ query_vec
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        pos = top if cand is None else cand[top]
+        return [(int(i), float(s)) for i, s in zip(pos, scores[top])]
+
+class _SqliteRagBackend:
+    """rag_chunks table: one row per user holding the chunk list as JSON and float16 embeddings."""
+
+    def head(self, user: str) -> tuple[str, float] | None:
+        conn = _db_connect()
         try:
-            dt = datetime.fromisoformat(str(ts).replace("Z","+00:00"))
-            key_month = dt.strftime("%Y-%m")
-        except Exception:
-            key_month = "unknown"
-        key = f"{merchant_name}:{key_month}"
-        title = None
-        if t.get("products") and isinstance(t["products"], list) and t["products"]:
-            title = t["products"][0].get("name")
-        title = title or t.get("description") or t.get("title") or "Purchase"
-        total = None
-        p = t.get("price") or {}
-        if isinstance(p, dict):
-            total = p.get("total")
-        if total is None and isinstance(t.get("price_total"), (int,float)):
-            total = t.get("price_total")
-        by_key[key].append({"title": title, "total": total, "raw": t})
+            row = conn.execute(
+                "SELECT version, expires_at FROM rag_chunks WHERE external_user_id = ?", (user,)
+            ).fetchone()
+            return (row[0], row[1]) if row else None
+        finally:
+            conn.close()
+
+    def load(self, user: str) -> dict | None:
+        conn = _db_connect()
+        try:
+            row = conn.execute(
+                "SELECT chunks, bytes, version, expires_at, vectors, embedder FROM rag_chunks WHERE external_user_id = ?",
+                (user,),
+            ).fetchone()
+            return _row_to_dict(row) if row else None
+        finally:
+            conn.close()
+
+    def save(self, user: str, payload: str, size: int, version: str, expires_at: float,
+             vectors: bytes | None, embedder: str | None) -> None:
+        conn = _db_connect()
+        try:
+            conn.execute(
+                """
+                INSERT INTO rag_chunks (external_user_id, chunks, bytes, version, updated_at, expires_at, vectors, embedder)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(external_user_id) DO UPDATE SET
+                    chunks = excluded.chunks, bytes = excluded.bytes, version = excluded.version,
+                    updated_at = excluded.updated_at, expires_at = excluded.expires_at,
+                    vectors = excluded.vectors, embedder = excluded.embedder
+                """,
+                (user, payload, size, version, datetime.utcnow().isoformat(), expires_at, vectors, embedder),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def save_vectors(self, user: str, version: str, vectors: bytes, embedder: str) -> None:
+        conn = _db_connect()
+        try:
+            conn.execute(
+                "UPDATE rag_chunks SET vectors = ?, embedder = ? WHERE external_user_id = ? AND version = ?",
+                (vectors, embedder, user, version),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def delete(self, user: str) -> None:
+        conn = _db_connect()
+        try:
+            conn.execute("DELETE FROM rag_chunks WHERE external_user_id = ?", (user,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def purge(self, now: float) -> int:
+        conn = _db_connect()
+        try:
+            n = conn.execute("DELETE FROM rag_chunks WHERE expires_at <= ?", (now,)).rowcount
+            conn.commit()
+            return n
+        finally:
+            conn.close()
+
+class RagStore:
+    """Per-user RAG chunks with a persistent backend and an in-memory LRU tier.
+
+    The LRU holds each user's _ChunkIndex and is capped at ``max_bytes`` (chunk
+    text plus embeddings); each user's entry expires ``ttl_sec`` after it was
+    written. Any object with the _SqliteRagBackend methods can serve as the backend.
+    """
+
+    def __init__(self, backend, max_bytes: int, ttl_sec: int):
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._lru: OrderedDict[str, _ChunkIndex] = OrderedDict()
+        self._bytes = 0
+        self.hits = self.misses = 0
+
+    def _cache(self, user: str, index: _ChunkIndex) -> None:
+        with self._lock:
+            self._drop(user)
+            if index.nbytes > self.max_bytes:
+                return
+            self._lru[user] = index
+            self._bytes += index.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._lru.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def _drop(self, user: str) -> None:
+        entry = self._lru.pop(user, None)
+        if entry:
+            self._bytes -= entry.nbytes
+
+    def put(self, user: str, chunks: list[str], ttl_sec: int | None = None) -> None:
+        payload = json.dumps(chunks)
+        size = len(payload.encode("utf-8"))
+        version = uuid.uuid4().hex
+        _numpy()
+        embedder = _get_embedder()
+        vectors = embedder.embed(chunks) if chunks else np.zeros((0, 0), dtype=np.float32)
+        self.backend.save(user, payload, size, version, time.time() + (ttl_sec or self.ttl_sec),
+                          vectors.astype(np.float16).tobytes(), embedder.name)
+        self._cache(user, _ChunkIndex(list(chunks), vectors, embedder.name, version, size))
+
+    def index(self, user: str) -> _ChunkIndex | None:
+        """The user's chunk index, or None if nothing (unexpired) was ingested."""
+        head = self.backend.head(user)
+        if head is None or head[1] <= time.time():
+            if head is not None:
+                self.backend.delete(user)
+            with self._lock:
+                self._drop(user)
+            return None
+        with self._lock:
+            entry = self._lru.get(user)
+            if entry and entry.version == head[0]:
+                self._lru.move_to_end(user)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        row = self.backend.load(user)
+        if row is None:
+            return None
+        chunks = json.loads(row["chunks"])
+        _numpy()
+        embedder = _get_embedder()
+        if row["embedder"] == embedder.name and row["vectors"] is not None and chunks:
+            vectors = np.frombuffer(row["vectors"], dtype=np.float16).astype(np.float32).reshape(len(chunks), -1)
+        else:
+            # stored under another embedder (or before embeddings were kept): re-embed once and write back
+            vectors = embedder.embed(chunks) if chunks else np.zeros((0, 0), dtype=np.float32)
+            self.backend.save_vectors(user, row["version"], vectors.astype(np.float16).tobytes(), embedder.name)
+        index = _ChunkIndex(chunks, vectors, embedder.name, row["version"], row["bytes"])
+        self._cache(user, index)
+        return index
+
+    def get(self, user: str) -> list[str]:
+        index = self.index(user)
+        return list(index.chunks) if index else []
+
+    def delete(self, user: str) -> None:
+        self.backend.delete(user)
+        with self._lock:
+            self._drop(user)
+
+    def purge_expired(self) -> int:
+        n = self.backend.purge(time.time())
+        if n:
+            logger.info(f"rag store: purged {n} expired users")
+        return n
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cached_users": len(self._lru), "cached_bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+RAG_STORE = RagStore(_SqliteRagBackend(), max_bytes=RAG_CACHE_MAX_BYTES, ttl_sec=RAG_TTL_HOURS * 3600)
+
+def _rag_retrieve(user: str, query: str, k: int = RAG_TOP_K) -> list[tuple[str, float]]:
+    """Top-k stored chunks for the user most similar to the query (cosine > 0), best first."""
+    index = RAG_STORE.index(user)
+    if index is None or not index.chunks or not query:
+        return []
+    query_vec = _get_embedder().embed([query])[0]
+    return [(index.chunks[i], s) for i, s in index.search(query_vec, k) if s > 0]
+
+_LLM_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+def _count_tokens(text: str) -> int:
+    """Words and punctuation marks: a cheap, tokenizer-free stand-in for LLM token counts."""
+    return len(_LLM_TOKEN_RE.findall(text))
+
+_SUBTOTAL_TOKENS = _count_tokens("Subtotal: $0.00")
+_CONT_TOKENS = _count_tokens(" (cont. 2)")
+
+def _chunk_transactions(transactions: TxnBatch, max_tokens: int = RAG_CHUNK_MAX_TOKENS,
+                        max_chunks: int = RAG_MAX_CHUNKS) -> list[str]:
+    """Create textual chunks from a transaction batch, grouped by merchant and month.
+    Rows are packed in time order into chunks of at most max_tokens; a group that outgrows
+    one continues in "(cont. N)" chunks instead of being truncated (a single oversized line
+    still gets its own chunk). Chunk spans and scores are computed from per-row token counts
+    in one pass, then only the max_chunks best (recency with half-life
+    RAG_CHUNK_HALF_LIFE_DAYS, times log spend) are rendered to text.
+    """
+    b = _as_txn_batch(transactions)
+    n = len(b)
+    if not n:
+        return []
+    no_month = np.iinfo(np.int64).min
+    known = ~np.isnan(b.ts)
+    months = np.full(n, no_month, dtype=np.int64)
+    months[known] = b.ts[known].astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+    order = np.lexsort((np.where(known, b.ts, -np.inf), months, b.merchant))
+    merchant, month = b.merchant[order], months[order]
+    group_starts = np.flatnonzero(np.r_[True, (merchant[1:] != merchant[:-1]) | (month[1:] != month[:-1])])
+
+    # Token cost of each row's "- title ($x.yz)" line; titles are interned, so count each once
+    titles = b.title[order]
+    cents = b.total_cents[order]
+    priced = ~np.isnan(cents)
+    codes = np.unique(titles)
+    title_tokens = np.zeros(int(codes[-1]) + 1, dtype=np.int64)
+    title_tokens[codes] = [_count_tokens(b.strings[c]) for c in codes.tolist()]
+    row_tokens = title_tokens[titles] + 1 + np.where(priced, 6 + (cents < 0), 0)
+
+    headers = []
+    for g in group_starts.tolist():
+        m = int(month[g])
+        headers.append((b.string(int(merchant[g])) or "Unknown", "unknown" if m == no_month else str(np.datetime64(m, "M"))))
+    header_tokens = [_count_tokens(f"Merchant: {name}\nMonth: {m}") + _SUBTOTAL_TOKENS for name, m in headers]
+
+    # Greedy packing within each group: bisect the running token total for each chunk's end
+    chunk_start, chunk_group, chunk_part = [], [], []
+    cum = [0] + np.cumsum(row_tokens).tolist()
+    bounds = group_starts.tolist() + [n]
+    for g in range(len(headers)):
+        i, end, part = bounds[g], bounds[g + 1], 1
+        budget = max_tokens - header_tokens[g]
+        while i < end:
+            chunk_start.append(i); chunk_group.append(g); chunk_part.append(part)
+            i = max(i + 1, bisect.bisect_right(cum, cum[i] + budget, i + 1, end + 1) - 1)
+            part += 1
+            budget = max_tokens - header_tokens[g] - _CONT_TOKENS
+
+    starts = np.asarray(chunk_start)
+    ends = np.r_[starts[1:], n]
+    spend = np.add.reduceat(np.where(priced, cents, 0.0), starts)
+    last_ts = b.ts[order][ends - 1]
+    age_days = np.maximum(0.0, time.time() - last_ts) / 86400
+    recency = np.where(np.isnan(last_ts), 0.0, 0.5 ** (np.nan_to_num(age_days) / RAG_CHUNK_HALF_LIFE_DAYS))
+    score = recency * (1 + np.log1p(np.maximum(spend, 0) / 100))
+    best = np.lexsort((np.arange(len(starts)), -score))[:max_chunks]
 
     chunks: list[str] = []
-    for key, items in by_key.items():
-        merchant, month = key.split(":", 1)
-        lines = [f"Merchant: {merchant}", f"Month: {month}"]
-        subtotal = 0.0
-        for it in items:
-            ttl = it.get("title")
-            amt = it.get("total")
-            if isinstance(amt, str):
-                try:
-                    amt = float(amt.replace("$", ""))
-                except Exception:
-                    amt = None
-            if isinstance(amt, (int,float)):
-                subtotal += float(amt)
-                lines.append(f"- {ttl} (${float(amt):.2f})")
-            else:
-                lines.append(f"- {ttl}")
-            if sum(len(x)+1 for x in lines) > max_chars:
-                break
-        lines.append(f"Subtotal: ${subtotal:.2f}")
-        chunk = "\n".join(lines)
-        chunks.append(chunk[:max_chars])
-    return chunks[:50]
+    for c in best.tolist():
+        name, m = headers[chunk_group[c]]
+        part = chunk_part[c]
+        lines = [f"Merchant: {name}", f"Month: {m}" + (f" (cont. {part})" if part > 1 else "")]
+        for i in range(chunk_start[c], int(ends[c])):
+            ttl = b.strings[titles[i]]
+            lines.append(f"- {ttl} (${cents[i] / 100:.2f})" if priced[i] else f"- {ttl}")
+        lines.append(f"Subtotal: ${spend[c] / 100:.2f}")
+        chunks.append("\n".join(lines))
+    return chunks
 
 @app.route('/rag/ingest_transactions', methods=['POST'])
 def rag_ingest_transactions():
     try:
         data = request.get_json() or {}
         external_user_id = data.get('external_user_id') or 'zuno_user_123'
-        transactions = data.get('transactions') or []
+        transactions = TxnBatch(data.get('transactions'))
         chunks = _chunk_transactions(transactions)
-        RAG_STORE[external_user_id] = chunks
+        RAG_STORE.put(external_user_id, chunks)
         return jsonify({"ok": True, "external_user_id": external_user_id, "chunks": len(chunks)})
     except Exception as e:
         logger.error(f"rag_ingest failed: {e}")
         return jsonify({"error": str(e)}), 500
 
+_doc_rag_service = None
+_doc_rag_failure = None  # (monotonic time, message) of the last failed load
+_doc_rag_lock = threading.Lock()
+
+class DocRagUnavailable(RuntimeError):
+    """RAG.py could not be imported or its index could not be loaded."""
+
+def get_doc_rag_service():
+    """RAG.py document Q&A service, imported on first use (needs chromadb + google-generativeai).
+
+    A failed import or load is remembered for RAG_DOC_RETRY_SEC and re-raised as
+    DocRagUnavailable, so requests don't rebuild the index from scratch each time.
+    """
+    global _doc_rag_service, _doc_rag_failure
+    if _doc_rag_service is None:
+        with _doc_rag_lock:
+            if _doc_rag_service is None:
+                if _doc_rag_failure and time.monotonic() - _doc_rag_failure[0] < RAG_DOC_RETRY_SEC:
+                    raise DocRagUnavailable(_doc_rag_failure[1])
+                try:
+                    import RAG
+                    RAG.load_rag_model(RAG_DOC_PDF_PATH or None)
+                    _doc_rag_service = RAG.RagService()
+                except Exception as e:
+                    logger.error(f"document RAG load failed: {e}")
+                    _doc_rag_failure = (time.monotonic(), f"{type(e).__name__}: {e}")
+                    raise DocRagUnavailable(_doc_rag_failure[1]) from e
+                _doc_rag_failure = None
+    return _doc_rag_service
+
+@app.route('/rag/doc/ask', methods=['POST'])
+def rag_doc_ask():
+    """Answer a question about the indexed document, or define a highlighted term (mode=define)."""
+    data = request.get_json() or {}
+    mode = data.get('mode') or 'chat'
+    text = (data.get('question') or data.get('term') or '').strip()
+    if mode not in ('chat', 'define'):
+        return jsonify({"error": "mode must be 'chat' or 'define'"}), 400
+    if not text:
+        return jsonify({"error": "missing question"}), 400
+    try:
+        service = get_doc_rag_service()
+    except DocRagUnavailable as e:
+        return jsonify({"error": f"document RAG unavailable: {e}"}), 503
+    import RAG
+    try:
+        answer = service.call(mode, text, timeout=RAG_DOC_TIMEOUT_SEC)
+    except FutureTimeout:
+        return jsonify({"error": "timed out"}), 504
+    except RAG.RagOverloaded as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        logger.error(f"rag_doc_ask failed: {e}")
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"mode": mode, "answer": answer})
+
 @app.route('/dealhunter/rag_search', methods=['POST'])
 def dealhunter_rag_search():
     """RAG-augmented search: use stored chunks as context to expand the query, then call dealhunter/claude_search."""
@@ -155,7 +791,7 @@ def dealhunter_rag_search():
         max_results = int(data.get('max_results') or 6)
         if not query:
             return jsonify({"error": "missing query"}), 400
-        chunks = RAG_STORE.get(external_user_id) or []
+        retrieved = _rag_retrieve(external_user_id, query)
         base = os.getenv('SELF_BASE_URL') or 'http://localhost:5001'
 
         # If query is vague (e.g., "suggest me something"), prefer picking 1-2 items from history (Amazon) and searching for those
@@ -242,7 +878,10 @@ def dealhunter_rag_search():
                     continue
             return jsonify({"ok": True, "count": len(combined), "items": combined, "rag": {"used": False, "strategy": "anthropic_only_vague"}})
 
-        # Anthropic-only expansion (RAG disabled but preserved in code)
+        # Anthropic expansion, grounded in the user's most relevant purchase-history chunks
+        history = ""
+        if retrieved:
+            history = "\nRelevant purchase history:\n" + "\n---\n".join(c for c, _ in retrieved) + "\n"
         try:
             client = get_anthropic_client()
             resp = client.messages.create(
@@ -253,7 +892,7 @@ def dealhunter_rag_search():
                     "Expand the user's query concisely for web search. Prefer trusted merchants (Amazon, Target, Walmart) and reflect likely preferences. "
                     "Return ONLY the expanded query string (10-16 words)."
                 ),
-                messages=[{"role":"user","content": f"User query: '{query}'. Expanded query only:"}],
+                messages=[{"role":"user","content": f"User query: '{query}'.{history} Expanded query only:"}],
             )
             expanded = resp.content[0].text.strip() if getattr(resp, 'content', None) else query
         except Exception as e:
@@ -267,7 +906,12 @@ def dealhunter_rag_search():
             "query": expanded, "budget_cents": budget_cents, "max_results": max_results
         }, timeout=30)
         out = rs.json()
-        out['rag'] = {"used": True, "expanded_query": expanded, "chunks_used": min(8, len(chunks))}
+        out['rag'] = {
+            "used": bool(retrieved),
+            "expanded_query": expanded,
+            "chunks_used": len(retrieved),
+            "chunk_scores": [round(s, 3) for _, s in retrieved],
+        }
         return jsonify(out), rs.status_code
     except Exception as e:
         logger.error(f"rag_search failed: {e}")
@@ -715,24 +1359,29 @@ def _mock_amazon_transactions(limit: int = 10) -> list[dict]:
         "Lunch Order"
     ]
     
-    base = [
-        {
-            "datetime": (now - timedelta(days=i*7)).isoformat() + "Z",
+    # one purchase per week on a fixed weekly grid; id, time and product depend only on the
+    # purchase date, so re-syncs return identical transactions and a new week adds one
+    week_start = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=now.weekday())
+    dates = [week_start - timedelta(days=7 * k) for k in range(max(2, min(limit, 10)))]
+    base = []
+    for d in dates:
+        i = (d - datetime(1970, 1, 5)).days // 7 % len(product_names) + 1  # 1970-01-05 was a Monday
+        base.append({
+            "id": f"mock-{d:%Y%m%d}",
+            "datetime": d.isoformat() + "Z",
             "description": "Amazon Purchase",
             "merchant": {"id": 44, "name": "Amazon"},
             "price": {"total": f"{19.99 + i:.2f}"},
             "products": [
                 {
                     "external_id": f"ASIN{i:03d}",
-                    "name": product_names[i-1] if i-1 < len(product_names) else f"Product {i}",
+                    "name": product_names[i-1],
                     "quantity": 1,
                     "price": {"total": f"{19.99 + i:.2f}"},
                     "url": "https://www.amazon.com/dp/B000000000"
                 }
             ]
-        }
-        for i in range(1, max(2, min(limit, 10)) + 1)
-    ]
+        })
     return base
 
 def _mock_transactions_for_merchant(merchant_id: int, limit: int = 10) -> tuple[list[dict], dict]:
@@ -750,6 +1399,7 @@ def _mock_transactions_for_merchant(merchant_id: int, limit: int = 10) -> tuple[
     # overwrite merchant fields to requested merchant
     for t in txns:
         t["merchant"] = {"id": merchant_id, "name": mname}
+        t["id"] = f"{t['id']}-{merchant_id}"
     return txns, {"id": merchant_id, "name": mname}
 
 @app.route('/knot/health', methods=['GET'])
@@ -913,6 +1563,249 @@ def knot_merchants():
         ]
     })
 
+# --------------------------
+# Background jobs (SQLite-backed)
+# --------------------------
+
+JOB_TERMINAL = ("succeeded", "failed", "cancelled")
+# kind -> handler(params, ctx) -> JSON-serializable result
+JOB_HANDLERS: dict[str, Callable[[dict, "JobContext"], dict]] = {}
+_job_pool: ThreadPoolExecutor | None = None
+_job_pool_lock = threading.Lock()
+
+class JobCancelled(Exception):
+    pass
+
+class JobContext:
+    """Passed to job handlers for progress reporting and cooperative cancellation."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+
+    def progress(self, done: int, total: int | None = None) -> None:
+        """Record progress; raises JobCancelled if cancellation was requested."""
+        conn = _db_connect()
+        try:
+            conn.execute("UPDATE job SET progress_done = ?, progress_total = ? WHERE id = ?", (done, total, self.job_id))
+            conn.commit()
+            row = conn.execute("SELECT cancel_requested FROM job WHERE id = ?", (self.job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row and row[0]:
+            raise JobCancelled()
+
+    def check_cancelled(self) -> None:
+        conn = _db_connect()
+        try:
+            row = conn.execute("SELECT cancel_requested FROM job WHERE id = ?", (self.job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row and row[0]:
+            raise JobCancelled()
+
+def _job_handler(kind: str):
+    def register(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return register
+
+def _get_job_pool() -> ThreadPoolExecutor:
+    global _job_pool
+    with _job_pool_lock:
+        if _job_pool is None:
+            _job_pool = ThreadPoolExecutor(max_workers=max(1, JOB_WORKERS), thread_name_prefix="zuno-job")
+        return _job_pool
+
+def _job_to_dict(row: sqlite3.Row) -> dict:
+    job = _row_to_dict(row)
+    for k in ("params", "result"):
+        if job.get(k):
+            try:
+                job[k] = json.loads(job[k])
+            except Exception:
+                pass
+    job["cancel_requested"] = bool(job.get("cancel_requested"))
+    return job
+
+def _job_get(job_id: str) -> dict | None:
+    conn = _db_connect()
+    try:
+        row = conn.execute("SELECT * FROM job WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return _job_to_dict(row) if row else None
+
+def _run_job(job_id: str) -> None:
+    conn = _db_connect()
+    try:
+        cur = conn.cursor()
+        # claim the job unless it was cancelled while queued
+        cur.execute(
+            "UPDATE job SET status = 'running', started_at = ? WHERE id = ? AND status = 'queued' AND cancel_requested = 0",
+            (datetime.utcnow().isoformat(), job_id)
+        )
+        conn.commit()
+        if cur.rowcount == 0:
+            cur.execute(
+                "UPDATE job SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (datetime.utcnow().isoformat(), job_id)
+            )
+            conn.commit()
+            return
+        row = cur.execute("SELECT kind, params FROM job WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+
+    status, result, error = "succeeded", None, None
+    try:
+        handler = JOB_HANDLERS[row[0]]
+        result = handler(json.loads(row[1] or "{}"), JobContext(job_id))
+    except JobCancelled:
+        status = "cancelled"
+    except Exception as e:
+        logger.error(f"job {job_id} ({row[0]}) failed: {e}")
+        status, error = "failed", str(e)
+
+    conn = _db_connect()
+    try:
+        conn.execute(
+            "UPDATE job SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, datetime.utcnow().isoformat(), job_id)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def _submit_job(kind: str, params: dict, idempotency_key: str | None = None) -> tuple[dict, bool]:
+    """Persist a queued job and hand it to the worker pool.
+    Returns (job, created); an existing job is returned for a repeated idempotency key.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"unknown job kind: {kind}")
+    job_id = uuid.uuid4().hex
+    conn = _db_connect()
+    try:
+        try:
+            conn.execute(
+                "INSERT INTO job (id, kind, status, idempotency_key, params, created_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, idempotency_key, json.dumps(params), datetime.utcnow().isoformat())
+            )
+            conn.commit()
+        except sqlite3.IntegrityError:
+            row = conn.execute("SELECT * FROM job WHERE kind = ? AND idempotency_key = ?", (kind, idempotency_key)).fetchone()
+            if row is None:
+                raise
+            return _job_to_dict(row), False
+    finally:
+        conn.close()
+    _get_job_pool().submit(_run_job, job_id)
+    return _job_get(job_id), True
+
+def _recover_jobs() -> None:
+    """On startup: fail jobs interrupted mid-run and resubmit ones still queued."""
+    conn = _db_connect()
+    try:
+        conn.execute(
+            "UPDATE job SET status = 'failed', error = 'interrupted by restart', finished_at = ? WHERE status = 'running'",
+            (datetime.utcnow().isoformat(),)
+        )
+        conn.commit()
+        queued = [r[0] for r in conn.execute("SELECT id FROM job WHERE status = 'queued' ORDER BY created_at")]
+    finally:
+        conn.close()
+    for job_id in queued:
+        _get_job_pool().submit(_run_job, job_id)
+
+def _wants_async(body: dict) -> bool:
+    prefer = (request.headers.get('Prefer') or '').lower()
+    return bool(body.get('async')) or 'respond-async' in prefer
+
+def _enqueue_response(kind: str, params: dict, body: dict):
+    """202 response for an async request; idempotency key from the Idempotency-Key header or body."""
+    key = request.headers.get('Idempotency-Key') or body.get('idempotency_key')
+    job, created = _submit_job(kind, params, idempotency_key=key)
+    resp = jsonify({"ok": True, "job_id": job["id"], "status": job["status"], "created": created, "status_url": f"/jobs/{job['id']}"})
+    resp.headers['Location'] = f"/jobs/{job['id']}"
+    return resp, 202
+
+@app.route('/jobs', methods=['GET'])
+def jobs_list():
+    try:
+        kind = request.args.get('kind')
+        status = request.args.get('status')
+        limit = max(1, min(int(request.args.get('limit', 50)), 500))
+        clauses, values = [], []
+        if kind:
+            clauses.append("kind = ?")
+            values.append(kind)
+        if status:
+            clauses.append("status = ?")
+            values.append(status)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        conn = _db_connect()
+        try:
+            rows = conn.execute(f"SELECT * FROM job {where} ORDER BY created_at DESC LIMIT ?", (*values, limit)).fetchall()
+        finally:
+            conn.close()
+        return jsonify({"jobs": [_job_to_dict(r) for r in rows]})
+    except Exception as e:
+        logger.error(f"Jobs list error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def jobs_get(job_id: str):
+    try:
+        job = _job_get(job_id)
+        if not job:
+            return jsonify({"error": "not_found"}), 404
+        return jsonify({"job": job})
+    except Exception as e:
+        logger.error(f"Job get error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def jobs_cancel(job_id: str):
+    """Request cancellation. Queued jobs never start; running jobs stop at their next progress report."""
+    try:
+        conn = _db_connect()
+        try:
+            cur = conn.execute(
+                f"UPDATE job SET cancel_requested = 1 WHERE id = ? AND status NOT IN ({','.join('?' * len(JOB_TERMINAL))})",
+                (job_id, *JOB_TERMINAL)
+            )
+            conn.commit()
+            changed = cur.rowcount
+        finally:
+            conn.close()
+        job = _job_get(job_id)
+        if not job:
+            return jsonify({"error": "not_found"}), 404
+        return jsonify({"ok": bool(changed), "job": job})
+    except Exception as e:
+        logger.error(f"Job cancel error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def jobs_events(job_id: str):
+    """Server-sent events stream of job status until it reaches a terminal state."""
+    if not _job_get(job_id):
+        return jsonify({"error": "not_found"}), 404
+    interval = max(0.2, float(request.args.get('interval', 1.0)))
+
+    def _stream():
+        last = None
+        while True:
+            job = _job_get(job_id)
+            snapshot = json.dumps(job, sort_keys=True)
+            if snapshot != last:
+                yield f"data: {snapshot}\n\n"
+                last = snapshot
+            if not job or job["status"] in JOB_TERMINAL:
+                return
+            time.sleep(interval)
+
+    return Response(_stream(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
 # --------------------------
 # Product resolver (URL → title/price)
 # --------------------------
@@ -1092,10 +1985,7 @@ def product_resolve():
             if price is not None and canonical:
                 conn = _db_connect()
                 cur = conn.cursor()
-                cur.execute(
-                    "INSERT INTO price_history (canonical_id, price_cents, title, fetched_at) VALUES (?, ?, ?, ?)",
-                    (canonical, int(round(price * 100)), title, datetime.utcnow().isoformat())
-                )
+                _record_price_point(cur, canonical, int(round(price * 100)), title, datetime.utcnow().isoformat())
                 conn.commit()
                 try:
                     conn.close()
@@ -1367,33 +2257,260 @@ def dealhunter_claude_search():
         logger.error(f"claude_search error: {e}")
         return jsonify({"error": str(e)}), 500
 
+# --------------------------
+# Price history rollups
+# --------------------------
+
+# resolution -> (table, length of the fetched_at ISO prefix that identifies a bucket)
+PRICE_ROLLUPS = {
+    "hour": ("price_history_hourly", 13),  # YYYY-MM-DDTHH
+    "day": ("price_history_daily", 10),    # YYYY-MM-DD
+}
+
+PRICE_HISTORY_CHUNK = int(os.getenv("PRICE_HISTORY_CHUNK", "5000"))
+# price points older than this (backfills, seeded history) never trigger watch matches
+PRICE_EVENT_MAX_AGE_HOURS = int(os.getenv("PRICE_EVENT_MAX_AGE_HOURS", "24"))
+
+def _rollup_upsert_sql(table: str) -> str:
+    return (
+        f"INSERT INTO {table} (canonical_id, bucket, min_cents, max_cents, sum_cents, n, last_cents, last_at, title) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(canonical_id, bucket) DO UPDATE SET "
+        "min_cents = MIN(min_cents, excluded.min_cents), "
+        "max_cents = MAX(max_cents, excluded.max_cents), "
+        "sum_cents = sum_cents + excluded.sum_cents, "
+        "n = n + excluded.n, "
+        "last_cents = CASE WHEN excluded.last_at >= last_at THEN excluded.last_cents ELSE last_cents END, "
+        "title = CASE WHEN excluded.last_at >= last_at THEN COALESCE(excluded.title, title) ELSE title END, "
+        "last_at = MAX(last_at, excluded.last_at)"
+    )
+
+def _fold_rollup_rows(rows: list[tuple], width: int) -> list[tuple]:
+    """Pre-aggregate (canonical_id, price_cents, title, fetched_at) rows per bucket so
+    each bucket costs one upsert per batch instead of one per raw point.
+    """
+    acc: dict[tuple[str, str], list] = {}
+    for canonical_id, cents, title, fetched_at in rows:
+        key = (canonical_id, fetched_at[:width])
+        b = acc.get(key)
+        if b is None:
+            acc[key] = [cents, cents, cents, 1, cents, fetched_at, title]
+            continue
+        b[0] = min(b[0], cents)
+        b[1] = max(b[1], cents)
+        b[2] += cents
+        b[3] += 1
+        if fetched_at >= b[5]:
+            b[4], b[5], b[6] = cents, fetched_at, (title if title is not None else b[6])
+    return [(k[0], k[1], *v) for k, v in acc.items()]
+
+def _write_price_rows(cur: sqlite3.Cursor, rows: list[tuple], match: bool = True) -> int:
+    """Insert (canonical_id, price_cents, title, fetched_at) rows into price_history and
+    fold them into the hourly/daily rollups. With match, recent rows are checked against
+    watches (live prices only; seeded/backfilled history passes False). Caller owns the transaction.
+    """
+    if not rows:
+        return 0
+    cur.executemany(
+        "INSERT INTO price_history (canonical_id, price_cents, title, fetched_at) VALUES (?, ?, ?, ?)",
+        rows
+    )
+    for table, width in PRICE_ROLLUPS.values():
+        cur.executemany(_rollup_upsert_sql(table), _fold_rollup_rows(rows, width))
+    if match:
+        _match_watches_for_prices(cur, rows)
+    return len(rows)
+
+def _match_watches_for_prices(cur: sqlite3.Cursor, rows: list[tuple]) -> int:
+    """Event-driven price-drop detection for freshly written price_history rows.
+    For each canonical id, the newest recent point is checked against the watches on that
+    canonical id (indexed on canonical_id, target_price_cents), so the cost is
+    O(watches-per-product) per price update. Returns number of matches recorded.
+    """
+    now = datetime.utcnow()
+    cutoff = (now - timedelta(hours=PRICE_EVENT_MAX_AGE_HOURS)).isoformat()
+    latest: dict[str, tuple] = {}
+    for row in rows:
+        if row[3] < cutoff:
+            continue
+        prev = latest.get(row[0])
+        if prev is None or row[3] >= prev[3]:
+            latest[row[0]] = row
+    if not latest:
+        return 0
+    now_iso = now.isoformat()
+    matches = []
+    for canonical_id, cents, title, fetched_at in latest.values():
+        cur.execute(
+            "SELECT id FROM price_watch WHERE canonical_id = ? AND target_price_cents >= ? "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (canonical_id, cents, now_iso)
+        )
+        details = json.dumps({"source": "price_history", "canonical_id": canonical_id, "title": title, "fetched_at": fetched_at})
+        matches.extend(_match_row(r[0], canonical_id, cents, details, now_iso) for r in cur.fetchall())
+    return _insert_matches(cur, matches)
+
+def _record_price_point(cur: sqlite3.Cursor, canonical_id: str, price_cents: int, title: str | None, fetched_at: str) -> None:
+    """Insert one price_history row and fold it into the hourly/daily rollups.
+    Caller owns the transaction (commit/close).
+    """
+    _write_price_rows(cur, [(canonical_id, price_cents, title, fetched_at)])
+
+def _bulk_insert_price_history(conn: sqlite3.Connection, rows, chunk_size: int = PRICE_HISTORY_CHUNK,
+                               progress=None, match: bool = True) -> int:
+    """Write an iterable of (canonical_id, price_cents, title, fetched_at) rows with
+    executemany, committing once per chunk so huge seeds don't hold one giant transaction.
+    progress(written) is called after each committed chunk; match is passed to
+    _write_price_rows. Returns the number of rows written.
+    """
+    cur = conn.cursor()
+    written = 0
+    chunk: list[tuple] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            written += _write_price_rows(cur, chunk, match=match)
+            conn.commit()
+            chunk = []
+            if progress:
+                progress(written)
+    if chunk:
+        written += _write_price_rows(cur, chunk, match=match)
+        conn.commit()
+    return written
+
+def _rebuild_price_rollups_if_empty(conn: sqlite3.Connection) -> None:
+    """One-time backfill of rollups for databases created before rollups existed."""
+    cur = conn.cursor()
+    if not cur.execute("SELECT 1 FROM price_history LIMIT 1").fetchone():
+        return
+    if cur.execute("SELECT 1 FROM price_history_daily LIMIT 1").fetchone():
+        return
+    logger.info("Building price_history rollups from raw points...")
+    rows = cur.execute("SELECT canonical_id, price_cents, title, fetched_at FROM price_history ORDER BY fetched_at ASC").fetchall()
+    rows = [(r[0], r[1], r[2], r[3]) for r in rows]
+    for table, width in PRICE_ROLLUPS.values():
+        cur.executemany(_rollup_upsert_sql(table), _fold_rollup_rows(rows, width))
+    conn.commit()
+
+def _ts_to_epoch(ts: str) -> float:
+    dt = datetime.fromisoformat(ts)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+def _lttb(points: list[dict], threshold: int) -> list[dict]:
+    """Largest-Triangle-Three-Buckets downsampling over {ts, price_usd} points.
+    Keeps the first/last point and the visually most significant point per bucket.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return points
+    xs = [_ts_to_epoch(p["ts"]) for p in points]
+    ys = [float(p["price_usd"] or 0.0) for p in points]
+    sampled = [points[0]]
+    a = 0
+    every = (n - 2) / (threshold - 2)
+    for i in range(threshold - 2):
+        # average of the next bucket is the third triangle vertex
+        nxt_start = int((i + 1) * every) + 1
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        span = max(1, nxt_end - nxt_start)
+        avg_x = sum(xs[nxt_start:nxt_end]) / span
+        avg_y = sum(ys[nxt_start:nxt_end]) / span
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        best_area, best_idx = -1.0, start
+        for j in range(start, end):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best_area, best_idx = area, j
+        sampled.append(points[best_idx])
+        a = best_idx
+    sampled.append(points[-1])
+    return sampled
+
+def _pick_price_resolution(cur: sqlite3.Cursor, canonical_id: str, since_iso: str, max_points: int) -> str:
+    """Choose the finest resolution whose point count fits max_points, using the daily rollup for counts."""
+    row = cur.execute(
+        "SELECT COUNT(*), COALESCE(SUM(n), 0) FROM price_history_daily WHERE canonical_id = ? AND bucket >= ?",
+        (canonical_id, since_iso[:10])
+    ).fetchone()
+    days, raw = int(row[0]), int(row[1])
+    if raw <= max_points:
+        return "raw"
+    if days * 24 > max_points:
+        hours = cur.execute(
+            "SELECT COUNT(*) FROM price_history_hourly WHERE canonical_id = ? AND bucket >= ?",
+            (canonical_id, since_iso[:13])
+        ).fetchone()[0]
+        if hours > max_points:
+            return "day"
+    return "hour"
+
 @app.route('/price-history/list', methods=['GET'])
 def price_history_list():
+    """List price points for a canonical id.
+    Query: canonical_id, since_days=365, resolution=raw|hour|day|auto, max_points?
+    With max_points and no explicit resolution, the finest rollup that fits is used and
+    the result is LTTB-downsampled to at most max_points.
+    """
     try:
         canonical_id = request.args.get('canonical_id')
         since_days = int(request.args.get('since_days', '365'))
+        resolution = (request.args.get('resolution') or '').lower() or None
+        max_points = request.args.get('max_points')
+        max_points = max(3, int(max_points)) if max_points else None
         if not canonical_id:
             return jsonify({"error": "missing canonical_id"}), 400
+        if resolution not in (None, 'raw', 'auto', *PRICE_ROLLUPS.keys()):
+            return jsonify({"error": "invalid resolution"}), 400
         since_dt = datetime.utcnow() - timedelta(days=max(1, since_days))
+        since_iso = since_dt.isoformat()
         conn = _db_connect()
         cur = conn.cursor()
-        cur.execute(
-            "SELECT fetched_at, price_cents, title FROM price_history WHERE canonical_id = ? AND fetched_at >= ? ORDER BY fetched_at ASC",
-            (canonical_id, since_dt.isoformat())
-        )
-        rows = cur.fetchall()
+        if resolution in (None, 'auto'):
+            resolution = _pick_price_resolution(cur, canonical_id, since_iso, max_points) if max_points else 'raw'
+        if resolution == 'raw':
+            cur.execute(
+                "SELECT fetched_at, price_cents, title FROM price_history WHERE canonical_id = ? AND fetched_at >= ? ORDER BY fetched_at ASC",
+                (canonical_id, since_iso)
+            )
+            rows = cur.fetchall()
+            points = [
+                {
+                    "ts": r[0],
+                    "price_usd": (r[1] / 100.0) if isinstance(r[1], (int, float)) else None,
+                    "title": r[2],
+                } for r in rows
+            ]
+        else:
+            table, width = PRICE_ROLLUPS[resolution]
+            cur.execute(
+                f"SELECT bucket, min_cents, max_cents, sum_cents, n, last_cents, title FROM {table} WHERE canonical_id = ? AND bucket >= ? ORDER BY bucket ASC",
+                (canonical_id, since_iso[:width])
+            )
+            rows = cur.fetchall()
+            suffix = ":00:00" if resolution == 'hour' else "T00:00:00"
+            points = [
+                {
+                    "ts": r[0] + suffix,
+                    "price_usd": round(r[3] / r[4] / 100.0, 2),
+                    "min_usd": r[1] / 100.0,
+                    "max_usd": r[2] / 100.0,
+                    "last_usd": r[5] / 100.0,
+                    "samples": r[4],
+                    "title": r[6],
+                } for r in rows
+            ]
         try:
             conn.close()
         except Exception:
             pass
-        points = [
-            {
-                "ts": r[0],
-                "price_usd": (r[1] / 100.0) if isinstance(r[1], (int, float)) else None,
-                "title": r[2],
-            } for r in rows
-        ]
-        return jsonify({"ok": True, "count": len(points), "points": points})
+        downsampled = bool(max_points and len(points) > max_points)
+        if downsampled:
+            points = _lttb(points, max_points)
+        return jsonify({"ok": True, "count": len(points), "resolution": resolution, "downsampled": downsampled, "points": points})
     except Exception as e:
         logger.error(f"price history list error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -1415,84 +2532,184 @@ def _build_url_from_canonical(canonical: str) -> str | None:
     except Exception:
         return None
 
-@app.route('/price-history/backfill_wayback', methods=['POST'])
-def price_history_backfill_wayback():
-    """Backfill historical prices via Wayback Machine snapshots.
-    Body: { canonical_id? or url?, months=6, points=10 }
-    """
-    try:
-        body = request.get_json() or {}
-        canonical = body.get('canonical_id')
-        url = body.get('url')
-        months = int(body.get('months', 6))
-        points = int(body.get('points', 10))
-        points = max(1, min(points, 24))
-
-        if not url and canonical:
-            url = _build_url_from_canonical(canonical)
-        if not url:
-            return jsonify({"error": "missing url or canonical_id"}), 400
-
-        meta = _parse_product_url(url)
-        merchant = meta.get('merchant_name') or ''
-        canonical_id = canonical or (f"{meta.get('merchant_id')}:{meta.get('product_id')}" if meta.get('merchant_id') and meta.get('product_id') else url)
+def _wayback_cdx_rows(cur: sqlite3.Cursor, url: str, start: str, end: str) -> list[list]:
+    """Return CDX entries (header stripped) for url in [start, end], cached per window."""
+    cached = cur.execute(
+        "SELECT rows, fetched_at FROM wayback_cdx_cache WHERE url = ? AND window_from = ? AND window_to = ?",
+        (url, start, end)
+    ).fetchone()
+    if cached and datetime.fromisoformat(cached[1]) >= datetime.utcnow() - timedelta(hours=WAYBACK_CDX_TTL_HOURS):
+        return json.loads(cached[0])
+    import urllib.parse as up
+    cdx_url = (
+        f"https://web.archive.org/cdx/search/cdx?url={up.quote(url)}&from={start}&to={end}&output=json&filter=statuscode:200&collapse=digest"
+    )
+    resp = requests.get(cdx_url, timeout=15)
+    rows = resp.json() if resp.status_code == 200 else []
+    entries = rows[1:] if rows else []
+    if resp.status_code == 200:
+        cur.execute(
+            "INSERT OR REPLACE INTO wayback_cdx_cache (url, window_from, window_to, rows, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            (url, start, end, json.dumps(entries), datetime.utcnow().isoformat())
+        )
+    return entries
 
-        # Time window
-        end_dt = datetime.utcnow()
-        start_dt = end_dt - timedelta(days=int(months * 30.5))
-        start = start_dt.strftime('%Y%m%d')
-        end = end_dt.strftime('%Y%m%d')
+def _fetch_wayback_snapshot(ts: str, orig: str, merchant: str) -> tuple[str, int | None, str | None] | None:
+    """Download one archived page and extract (ts, price_cents, title). None on fetch failure."""
+    arch_url = f"https://web.archive.org/web/{ts}id_/{orig}"
+    page = requests.get(arch_url, timeout=20)
+    if page.status_code != 200:
+        return None
+    title, price = _extract_title_and_price(page.text, merchant=merchant)
+    return ts, (int(round(price * 100)) if price is not None else None), title
+
+def _wayback_backfill(canonical_id: str, url: str, merchant: str, months: int, points: int, progress=None) -> dict:
+    """Backfill price_history from Wayback snapshots.
+    Only snapshots not already in the wayback_snapshot cache are downloaded (concurrently,
+    bounded by WAYBACK_CONCURRENCY), and points already stored for canonical_id are skipped.
+    progress(done, total) is called as snapshots complete.
+    """
+    end_dt = datetime.utcnow()
+    start_dt = end_dt - timedelta(days=int(months * 30.5))
+    start = start_dt.strftime('%Y%m%d')
+    end = end_dt.strftime('%Y%m%d')
 
-        # Query Wayback CDX API
-        import urllib.parse as up
-        cdx_url = (
-            f"https://web.archive.org/cdx/search/cdx?url={up.quote(url)}&from={start}&to={end}&output=json&filter=statuscode:200&collapse=digest"
-        )
-        try:
-            resp = requests.get(cdx_url, timeout=15)
-            rows = resp.json() if resp.status_code == 200 else []
-        except Exception as e:
-            return jsonify({"error": f"wayback_cdx_failed: {e}"}), 502
-        if not rows or len(rows) <= 1:
-            return jsonify({"ok": False, "snapshots": 0, "reason": "no snapshots"}), 200
-        entries = rows[1:]
+    conn = _db_connect()
+    try:
+        cur = conn.cursor()
+        entries = _wayback_cdx_rows(cur, url, start, end)
+        conn.commit()
+        if not entries:
+            return {"ok": False, "snapshots": 0, "reason": "no snapshots"}
         # Sample evenly across available snapshots
         step = max(1, len(entries) // points)
         sampled = [entries[i] for i in range(0, len(entries), step)][:points]
 
-        inserted = 0
-        conn = _db_connect()
-        cur = conn.cursor()
-        for r in sampled:
-            try:
-                ts = r[1]
-                orig = r[2]
-                arch_url = f"https://web.archive.org/web/{ts}id_/{orig}"
-                page = requests.get(arch_url, timeout=20)
-                if page.status_code != 200:
-                    continue
-                title, price = _extract_title_and_price(page.text, merchant=merchant)
-                if price is None:
-                    continue
-                # Convert ts (YYYYMMDDhhmmss) to ISO
-                dt = datetime.strptime(ts, '%Y%m%d%H%M%S')
-                cur.execute(
-                    "INSERT INTO price_history (canonical_id, price_cents, title, fetched_at) VALUES (?, ?, ?, ?)",
-                    (canonical_id, int(round(price * 100)), title, dt.isoformat())
-                )
-                inserted += 1
-            except Exception as _:
-                continue
+        known = {
+            r[0]: (r[1], r[2]) for r in cur.execute(
+                f"SELECT ts, price_cents, title FROM wayback_snapshot WHERE url = ? AND ts IN ({','.join('?' * len(sampled))})",
+                (url, *[r[1] for r in sampled])
+            )
+        }
+        todo = [r for r in sampled if r[1] not in known]
+        total = len(sampled)
+        done = total - len(todo)
+        if progress:
+            progress(done, total)
+
+        fetched = []
+        with ThreadPoolExecutor(max_workers=max(1, min(WAYBACK_CONCURRENCY, len(todo) or 1))) as pool:
+            futures = [pool.submit(_fetch_wayback_snapshot, r[1], r[2], merchant) for r in todo]
+            try:
+                for fut in as_completed(futures):
+                    try:
+                        res = fut.result()
+                    except Exception:
+                        res = None
+                    if res is not None:
+                        fetched.append(res)
+                    done += 1
+                    if progress:
+                        progress(done, total)
+            except BaseException:
+                for fut in futures:
+                    fut.cancel()
+                raise
+
+        now_iso = datetime.utcnow().isoformat()
+        cur.executemany(
+            "INSERT OR REPLACE INTO wayback_snapshot (url, ts, price_cents, title, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            [(url, ts, cents, title, now_iso) for ts, cents, title in fetched]
+        )
         conn.commit()
+        for ts, cents, title in fetched:
+            known[ts] = (cents, title)
+
+        # Convert ts (YYYYMMDDhhmmss) to ISO and drop points we already have
+        candidates = {}
+        for ts, (cents, title) in known.items():
+            if cents is None:
+                continue
+            try:
+                candidates[datetime.strptime(ts, '%Y%m%d%H%M%S').isoformat()] = (cents, title)
+            except ValueError:
+                continue
+        existing = set()
+        if candidates:
+            existing = {
+                r[0] for r in cur.execute(
+                    f"SELECT fetched_at FROM price_history WHERE canonical_id = ? AND fetched_at IN ({','.join('?' * len(candidates))})",
+                    (canonical_id, *candidates.keys())
+                )
+            }
+        new_rows = [
+            (canonical_id, cents, title, iso)
+            for iso, (cents, title) in sorted(candidates.items()) if iso not in existing
+        ]
+        inserted = _bulk_insert_price_history(conn, new_rows, match=False)  # archived prices are history, not events
+        return {
+            "ok": True,
+            "inserted": inserted,
+            "snapshots": total,
+            "fetched": len(todo),
+            "cached": total - len(todo),
+            "skipped_existing": len(existing),
+        }
+    finally:
         try:
             conn.close()
         except Exception:
             pass
-        return jsonify({"ok": True, "inserted": inserted, "snapshots": len(sampled)})
+
+@_job_handler('wayback_backfill')
+def _wayback_backfill_job(params: dict, ctx: JobContext) -> dict:
+    return _wayback_backfill(
+        params['canonical_id'], params['url'], params['merchant'], params['months'], params['points'],
+        progress=ctx.progress
+    )
+
+@app.route('/price-history/backfill_wayback', methods=['POST'])
+def price_history_backfill_wayback():
+    """Backfill historical prices via Wayback Machine snapshots.
+    Body: { canonical_id? or url?, months=6, points=10, async=false }
+    With async=true (or Prefer: respond-async) a background job is queued; see /jobs/<id>.
+    """
+    try:
+        body = request.get_json() or {}
+        canonical = body.get('canonical_id')
+        url = body.get('url')
+        months = int(body.get('months', 6))
+        points = int(body.get('points', 10))
+        points = max(1, min(points, 24))
+
+        if not url and canonical:
+            url = _build_url_from_canonical(canonical)
+        if not url:
+            return jsonify({"error": "missing url or canonical_id"}), 400
+
+        meta = _parse_product_url(url)
+        merchant = meta.get('merchant_name') or ''
+        canonical_id = canonical or (f"{meta.get('merchant_id')}:{meta.get('product_id')}" if meta.get('merchant_id') and meta.get('product_id') else url)
+
+        if _wants_async(body):
+            return _enqueue_response('wayback_backfill', {
+                "canonical_id": canonical_id, "url": url, "merchant": merchant, "months": months, "points": points
+            }, body)
+
+        try:
+            result = _wayback_backfill(canonical_id, url, merchant, months, points)
+        except requests.RequestException as e:
+            return jsonify({"error": f"wayback_cdx_failed: {e}"}), 502
+        return jsonify(result)
     except Exception as e:
         logger.error(f"price history backfill error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/price-history/backfill_wayback/<job_id>', methods=['GET'])
+def price_history_backfill_status(job_id: str):
+    """Alias of GET /jobs/<job_id> kept for backfill clients."""
+    return jobs_get(job_id)
+
 @app.route('/price-history/llm_series', methods=['POST'])
 def price_history_llm_series():
     """Generate a price series using the configured LLM (Cerebras/OpenAI-compatible).
@@ -1568,70 +2785,100 @@ def price_history_llm_series():
         logger.error(f"price history llm series error: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/price-history/seed_demo', methods=['POST'])
-def price_history_seed_demo():
-    try:
-        body = request.get_json() or {}
-        days = int(body.get('days', 365))
-        num_points = int(body.get('points', 36))
-        jitter_pct = float(body.get('jitter_pct', 0.2))  # +/- 20%
-        external_user_id = body.get('external_user_id')
+def _demo_price_series(rng: random.Random, canonical: str, note: str | None, days: int, num_points: int,
+                       jitter_pct: float, now: datetime):
+    """Yield price_history rows forming a smooth, realistic-looking series for one product."""
+    # Choose a realistic base price
+    base = rng.uniform(20.0, 400.0)
+    # Pick a gentle long-term drift: slight downtrend or flat
+    trend_direction = rng.choice([-1, 0])
+    drift_pct = 0.03 if trend_direction == -1 else 0.0  # up to ~3% decline over the year
+    # Seasonal amplitude small to avoid big swings
+    seasonal_amp = rng.uniform(0.01, 0.05)  # 1% - 5%
+    # One-time sale drop somewhere in the series
+    sale_idx = rng.randint(int(num_points * 0.3), int(num_points * 0.9)) if num_points >= 10 else None
+    sale_drop_pct = rng.uniform(0.05, 0.15)  # 5% - 15%
+
+    for i in range(num_points):
+        t = i / max(1, num_points - 1)
+        # Long-term drift (monotonic slight decline if chosen)
+        drift = (1.0 - drift_pct * t)
+        # Mild seasonal pattern
+        seasonal = 1.0 + seasonal_amp * math.sin(2.0 * math.pi * t)
+        price = base * drift * seasonal
+        # Occasional small noise (very mild)
+        price *= (1.0 + min(0.02, jitter_pct) * (rng.random() - 0.5))
+        # Apply a single sale drop point to make it look real
+        if sale_idx is not None and i == sale_idx:
+            price *= (1.0 - sale_drop_pct)
+
+        ts = (now - timedelta(days=int(days * (1.0 - t)))).isoformat()
+        yield (canonical, int(round(max(1.0, price) * 100)), note, ts)
+
+def _seed_demo_history(conn: sqlite3.Connection, watches: list[tuple], days: int = 365, num_points: int = 36,
+                       jitter_pct: float = 0.2, seed: int | None = None, chunk_size: int = PRICE_HISTORY_CHUNK,
+                       progress=None) -> int:
+    """Seed demo price series for (watch_id, canonical_id, note) tuples. A fixed seed makes
+    the generated prices reproducible (e.g. for load tests). Returns rows written.
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    rows = (
+        row
+        for _, canonical, note in watches
+        for row in _demo_price_series(rng, canonical, note, days, num_points, jitter_pct, now)
+    )
+    total = len(watches) * num_points
+    return _bulk_insert_price_history(
+        conn, rows, chunk_size=chunk_size,
+        progress=(lambda written: progress(written, total)) if progress else None,
+        match=False,  # synthetic series end at "now"; they must not record real matches
+    )
 
-        conn = _db_connect()
+def _seed_demo(params: dict, progress=None) -> dict:
+    conn = _db_connect()
+    try:
         cur = conn.cursor()
-        if external_user_id:
-            cur.execute("SELECT id, canonical_id, note FROM price_watch WHERE external_user_id = ?", (external_user_id,))
+        if params.get('external_user_id'):
+            cur.execute("SELECT id, canonical_id, note FROM price_watch WHERE external_user_id = ?", (params['external_user_id'],))
         else:
             cur.execute("SELECT id, canonical_id, note FROM price_watch")
-        rows = cur.fetchall()
-        watches = [(r[0], r[1], r[2]) for r in rows if r[1]]
-
+        watches = [(r[0], r[1], r[2]) for r in cur.fetchall() if r[1]]
         if not watches:
-            try:
-                conn.close()
-            except Exception:
-                pass
-            return jsonify({"ok": True, "seeded": 0, "reason": "no watches"})
-
-        now = datetime.utcnow()
-        seeded = 0
-        for _, canonical, note in watches:
-            # Choose a realistic base price
-            base = random.uniform(20.0, 400.0)
-            # Pick a gentle long-term drift: slight downtrend or flat
-            trend_direction = random.choice([-1, 0])
-            drift_pct = 0.03 if trend_direction == -1 else 0.0  # up to ~3% decline over the year
-            # Seasonal amplitude small to avoid big swings
-            seasonal_amp = random.uniform(0.01, 0.05)  # 1% - 5%
-            # One-time sale drop somewhere in the series
-            sale_idx = random.randint(int(num_points * 0.3), int(num_points * 0.9)) if num_points >= 10 else None
-            sale_drop_pct = random.uniform(0.05, 0.15)  # 5% - 15%
-
-            for i in range(num_points):
-                t = i / max(1, num_points - 1)
-                # Long-term drift (monotonic slight decline if chosen)
-                drift = (1.0 - drift_pct * t)
-                # Mild seasonal pattern
-                seasonal = 1.0 + seasonal_amp * math.sin(2.0 * math.pi * t)
-                price = base * drift * seasonal
-                # Occasional small noise (very mild)
-                price *= (1.0 + min(0.02, jitter_pct) * (random.random() - 0.5))
-                # Apply a single sale drop point to make it look real
-                if sale_idx is not None and i == sale_idx:
-                    price *= (1.0 - sale_drop_pct)
-
-                ts = (now - timedelta(days=int(days * (1.0 - t)))).isoformat()
-                cur.execute(
-                    "INSERT INTO price_history (canonical_id, price_cents, title, fetched_at) VALUES (?, ?, ?, ?)",
-                    (canonical, int(round(max(1.0, price) * 100)), note, ts)
-                )
-                seeded += 1
-        conn.commit()
+            return {"ok": True, "seeded": 0, "reason": "no watches"}
+        seeded = _seed_demo_history(
+            conn, watches, days=params['days'], num_points=params['points'], jitter_pct=params['jitter_pct'],
+            seed=params.get('seed'), progress=progress
+        )
+        return {"ok": True, "seeded": seeded}
+    finally:
         try:
             conn.close()
         except Exception:
             pass
-        return jsonify({"ok": True, "seeded": seeded})
+
+@_job_handler('seed_demo')
+def _seed_demo_job(params: dict, ctx: JobContext) -> dict:
+    return _seed_demo(params, progress=ctx.progress)
+
+@app.route('/price-history/seed_demo', methods=['POST'])
+def price_history_seed_demo():
+    """Seed demo price history for current watches.
+    Body: { days=365, points=36, jitter_pct=0.2, external_user_id?, seed?, async=false }
+    """
+    try:
+        body = request.get_json() or {}
+        seed = body.get('seed')
+        params = {
+            "days": int(body.get('days', 365)),
+            "points": int(body.get('points', 36)),
+            "jitter_pct": float(body.get('jitter_pct', 0.2)),  # +/- 20%
+            "external_user_id": body.get('external_user_id'),
+            "seed": int(seed) if seed is not None else None,
+        }
+        if _wants_async(body):
+            return _enqueue_response('seed_demo', params, body)
+        return jsonify(_seed_demo(params))
     except Exception as e:
         logger.error(f"price history seed demo error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -1665,89 +2912,467 @@ def optimize_payment():
 # Subscriptions auditor (scaffold)
 # --------------------------
 
-def _parse_dt(value: str) -> datetime | None:
-    try:
-        dt = datetime.fromisoformat((value or "").replace("Z", "+00:00"))
-        # Ensure timezone-aware in UTC
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt.astimezone(timezone.utc)
-    except Exception:
-        return None
+# cadence -> (period in days, allowed relative deviation of a single gap from the period)
+RECURRING_CADENCES = {
+    "weekly": (7.0, 0.25),
+    "monthly": (30.44, 0.2),
+    "quarterly": (91.31, 0.15),
+    "annual": (365.25, 0.1),
+}
+# share of gaps that must land within tolerance of the cadence period
+RECURRING_MIN_PERIODICITY = 0.6
+# coefficient of variation under which charges count as the same amount
+RECURRING_AMOUNT_MAX_CV = 0.1
+
+def _group_median(codes, values, n_groups: int):
+    """Per-group median of ``values`` keyed by integer ``codes``; NaN for empty groups."""
+    order = np.lexsort((values, codes))
+    v = values[order]
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    out = np.full(n_groups, np.nan)
+    has = counts > 0
+    lo = starts[has] + (counts[has] - 1) // 2
+    hi = starts[has] + counts[has] // 2
+    out[has] = (v[lo] + v[hi]) / 2
+    return out
+
+def _recurring_candidates(key_names: list[str], occurrences, last_ts, mean_gap, gap_codes, gaps,
+                          n_priced, amt_sum, amt_sumsq) -> list[dict | None]:
+    """Score keys as recurring charges; returns one candidate dict (or None) per key.
+
+    ``gap_codes``/``gaps`` hold the gaps (days) to score, keyed by index into
+    ``key_names``. Median gap picks the nearest cadence, the periodicity score is
+    the share of gaps within that cadence's tolerance, and MAD / amount CV
+    describe how regular the charge is.
+    """
+    n = len(key_names)
+    n_gaps = np.maximum(np.bincount(gap_codes, minlength=n), 1)
+    median = _group_median(gap_codes, gaps, n)
+    mad = _group_median(gap_codes, np.abs(gaps - median[gap_codes]), n)
+
+    names = list(RECURRING_CADENCES)
+    periods = np.array([RECURRING_CADENCES[c][0] for c in names])
+    tols = np.array([RECURRING_CADENCES[c][1] for c in names])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dist = np.abs(np.log(median[:, None] / periods[None, :]))
+    cadence = np.argmin(np.nan_to_num(dist, nan=np.inf), axis=1)
+    period = periods[cadence]
+    tol = tols[cadence] * period
+    on_beat = np.abs(gaps - period[gap_codes]) <= tol[gap_codes]
+    periodicity = np.bincount(gap_codes, weights=on_beat, minlength=n) / n_gaps
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        amt_mean = amt_sum / n_priced
+        amt_cv = np.sqrt(np.maximum(amt_sumsq / n_priced - amt_mean ** 2, 0.0)) / amt_mean
+    amt_cv[~np.isfinite(amt_cv)] = np.nan  # zero mean (e.g. $0 trials): CV undefined
+    # charges that are all $0 are trivially the same amount
+    amt_consistent = (n_priced >= 2) & ((amt_cv <= RECURRING_AMOUNT_MAX_CV) | (amt_sumsq == 0))
+
+    hits = (
+        (occurrences >= 2)
+        & (np.abs(median - period) <= tol)
+        & (periodicity >= RECURRING_MIN_PERIODICITY)
+    )
+    out: list[dict | None] = [None] * n
+    for k in np.flatnonzero(hits):
+        last = float(last_ts[k])
+        out[k] = {
+            "key": key_names[k],
+            "occurrences": int(occurrences[k]),
+            "avg_gap_days": round(float(mean_gap[k]), 2),
+            "median_gap_days": round(float(median[k]), 2),
+            "gap_mad_days": round(float(mad[k]), 2),
+            "cadence": names[cadence[k]],
+            "period_days": float(period[k]),
+            "periodicity_score": round(float(periodicity[k]), 3),
+            "avg_amount_cents": int(round(amt_mean[k])) if n_priced[k] else None,
+            "amount_cv": round(float(amt_cv[k]), 4) if n_priced[k] >= 2 and not np.isnan(amt_cv[k]) else None,
+            "amount_consistent": bool(amt_consistent[k]),
+            "last_seen_at": datetime.fromtimestamp(last, tz=timezone.utc).isoformat(),
+            "next_expected_at": datetime.fromtimestamp(last + period[k] * 86400.0, tz=timezone.utc).isoformat(),
+        }
+    return out
 
-def _detect_recurring(transactions: list[dict]) -> list[dict]:
-    """Very simple heuristic: same merchant/product names appearing with ~monthly cadence."""
-    by_key: dict[str, list[datetime]] = defaultdict(list)
-    for t in transactions:
-        dt = _parse_dt(t.get("datetime") or t.get("ts") or "")
-        if not dt:
-            continue
-        merchant_name = None
-        m = t.get("merchant") or {}
-        if isinstance(m, dict):
-            merchant_name = m.get("name")
-        else:
-            merchant_name = str(m)
-        # prefer product-level recurrence if products present
-        prods = t.get("products") or []
-        if prods:
-            for p in prods:
-                key = f"prod::{merchant_name or ''}::{p.get('name','')}"
-                by_key[key].append(dt)
-        else:
-            key = f"merchant::{merchant_name or ''}"
-            by_key[key].append(dt)
+def _recurring_occurrences(batch: TxnBatch) -> tuple:
+    """Occurrence arrays for recurrence detection:
+    (key names, key code, epoch ts, cents or NaN, batch row, product line within the row or -1).
 
-    candidates = []
-    for key, dates in by_key.items():
-        if len(dates) < 2:
-            continue
-        dates.sort()
-        gaps = [(dates[i+1] - dates[i]).days for i in range(len(dates)-1)]
-        if not gaps:
+    Product lines key as ``prod::merchant::name`` (product-level recurrence is preferred);
+    transactions without products key as ``merchant::name``. Key codes follow first
+    appearance in the feed. Occurrences without a timestamp are dropped.
+    """
+    width = len(batch.strings) + 1
+    bare = np.flatnonzero(np.diff(batch.prod_offsets) == 0)
+    rows = np.concatenate([batch.prod_txn, bare])
+    lines = np.concatenate([np.arange(len(batch.prod_txn)) - batch.prod_offsets[batch.prod_txn],
+                            np.full(len(bare), -1, dtype=np.int64)])
+    merchant = batch.merchant.astype(np.int64) + 1
+    raw_keys = np.concatenate([merchant[batch.prod_txn] * width + batch.prod_name + 1, merchant[bare] * width])
+    amt = np.concatenate([batch.prod_cents, batch.total_cents[bare]])
+    order = np.argsort(rows, kind="stable")
+    rows, raw_keys, amt, lines = rows[order], raw_keys[order], amt[order], lines[order]
+    ts = batch.ts[rows]
+    ok = ~np.isnan(ts)
+    rows, raw_keys, amt, ts, lines = rows[ok], raw_keys[ok], amt[ok], ts[ok], lines[ok]
+    if not len(rows):
+        return [], rows, ts, amt, rows, lines
+
+    uniq, first, inverse = np.unique(raw_keys, return_index=True, return_inverse=True)
+    by_first = np.argsort(first)
+    remap = np.empty_like(by_first)
+    remap[by_first] = np.arange(len(by_first))
+    names = []
+    for k in uniq[by_first].tolist():
+        m, name = divmod(k, width)
+        merchant_name = batch.string(m - 1) or ''
+        names.append(f"prod::{merchant_name}::{batch.strings[name - 1]}" if name else f"merchant::{merchant_name}")
+    return names, remap[inverse.ravel()], ts, amt, rows, lines
+
+def _detect_recurring(transactions: TxnBatch) -> list[dict]:
+    """Find keys (product or merchant) charged on a weekly/monthly/quarterly/annual cadence.
+
+    Occurrences are grouped into arrays by key and scored in one vectorized pass.
+    """
+    names, codes, ts, amt, _, _ = _recurring_occurrences(_as_txn_batch(transactions))
+    if not names:
+        return []
+
+    n = len(names)
+    order = np.lexsort((ts, codes))
+    codes, ts, amt = codes[order], ts[order], amt[order]
+
+    occurrences = np.bincount(codes, minlength=n)
+    ends = np.cumsum(occurrences) - 1
+    same = codes[1:] == codes[:-1]
+    gap_codes = codes[1:][same]
+    gaps = np.diff(ts)[same] / 86400.0
+    mean_gap = np.bincount(gap_codes, weights=gaps, minlength=n) / np.maximum(occurrences - 1, 1)
+
+    priced = ~np.isnan(amt)
+    amt0 = np.where(priced, amt, 0.0)
+    candidates = _recurring_candidates(
+        names, occurrences, ts[ends], mean_gap, gap_codes, gaps,
+        np.bincount(codes, weights=priced, minlength=n),
+        np.bincount(codes, weights=amt0, minlength=n),
+        np.bincount(codes, weights=amt0 * amt0, minlength=n),
+    )
+    return [c for c in candidates if c is not None]
+
+# --- persisted per-user recurrence state ---
+# Every occurrence is stored once per (user, key, transaction id, product line), so a
+# re-synced transaction is recognised by id rather than by timestamp. Each (user, key)
+# state row keeps the last occurrence, running gap/amount sums and a bounded window of
+# recent gaps: occurrences newer than the last one are folded in directly, anything
+# older or changed rebuilds that key from its stored occurrences. Only touched keys
+# are rescored.
+
+def _txn_ids(batch: TxnBatch) -> list[str]:
+    """Per-row transaction id: the feed's id, else a hash of the row's content."""
+    out = []
+    for i, code in enumerate(batch.txn_id.tolist()):
+        if code >= 0:
+            out.append(batch.strings[code])
             continue
-        avg_gap = sum(gaps) / len(gaps)
-        # monthly-ish cadence between 25 and 35 days
-        if 25 <= avg_gap <= 35:
-            candidates.append({
-                "key": key,
-                "occurrences": len(dates),
-                "avg_gap_days": avg_gap,
+        lo, hi = int(batch.prod_offsets[i]), int(batch.prod_offsets[i + 1])
+        content = (batch.string(batch.merchant[i]), float(batch.ts[i]), float(batch.total_cents[i]),
+                   [batch.string(c) for c in batch.prod_name[lo:hi].tolist()])
+        out.append("h:" + hashlib.sha1(repr(content).encode()).hexdigest())
+    return out
+
+def _empty_recurrence_state() -> dict:
+    return {"first_at": None, "last_at": None, "occurrences": 0, "gap_sum": 0.0, "recent_gaps": [],
+            "amount_n": 0, "amount_sum": 0.0, "amount_sumsq": 0.0}
+
+def _fold_occurrence(s: dict, ts: float, cents: float) -> None:
+    """Append one occurrence no older than s["last_at"] to a key's running state."""
+    if s["last_at"] is None:
+        s["first_at"] = ts
+    else:
+        gap = (ts - s["last_at"]) / 86400.0
+        s["gap_sum"] += gap
+        s["recent_gaps"] = (s["recent_gaps"] + [gap])[-SUBSCRIPTION_GAP_WINDOW:]
+    s["last_at"] = ts
+    s["occurrences"] += 1
+    if cents == cents:  # not NaN
+        s["amount_n"] += 1
+        s["amount_sum"] += cents
+        s["amount_sumsq"] += cents * cents
+
+def _load_recurrence_state(cur: sqlite3.Cursor, external_user_id: str, keys: list[str]) -> dict[str, dict]:
+    state: dict[str, dict] = {}
+    for i in range(0, len(keys), 500):
+        part = keys[i:i + 500]
+        cur.execute(
+            f"""
+            SELECT key, first_at, last_at, occurrences, gap_sum, recent_gaps, amount_n, amount_sum, amount_sumsq
+            FROM subscription_key_state
+            WHERE external_user_id = ? AND key IN ({','.join('?' * len(part))})
+            """,
+            (external_user_id, *part),
+        )
+        for r in cur.fetchall():
+            s = _row_to_dict(r)
+            s["recent_gaps"] = json.loads(s["recent_gaps"] or "[]")
+            state[s.pop("key")] = s
+    return state
+
+def _rebuild_recurrence_state(cur: sqlite3.Cursor, external_user_id: str, key: str) -> dict:
+    s = _empty_recurrence_state()
+    cur.execute(
+        "SELECT ts, cents FROM subscription_occurrence WHERE external_user_id = ? AND key = ? ORDER BY ts",
+        (external_user_id, key),
+    )
+    for ts, cents in cur.fetchall():
+        _fold_occurrence(s, ts, float("nan") if cents is None else cents)
+    return s
+
+def _update_recurrence_state(cur: sqlite3.Cursor, external_user_id: str, transactions: TxnBatch) -> int:
+    """Fold a synced feed into the user's stored occurrences and per-key state, rescoring touched keys.
+
+    Occurrences are deduped by transaction id, so re-syncing the same feed is a no-op;
+    a known transaction that comes back with a different time or amount replaces its
+    old occurrence. Returns the number of transactions not seen before.
+    """
+    batch = _as_txn_batch(transactions)
+    if not len(batch):
+        return 0
+    ids = _txn_ids(batch)
+    row_ts = batch.ts.tolist()
+    row_merchant = [None if m < 0 else m for m in batch.merchant_id.tolist()]
+
+    # transactions seen before (by id) vs. new
+    known_txns: set[str] = set()
+    uniq_ids = list(dict.fromkeys(ids))
+    for i in range(0, len(uniq_ids), 500):
+        part = uniq_ids[i:i + 500]
+        cur.execute(
+            f"SELECT txn_id FROM subscription_txn WHERE external_user_id = ? AND txn_id IN ({','.join('?' * len(part))})",
+            (external_user_id, *part),
+        )
+        known_txns.update(r[0] for r in cur.fetchall())
+    cur.executemany(
+        """
+        INSERT INTO subscription_txn (external_user_id, txn_id, merchant_id, ts) VALUES (?, ?, ?, ?)
+        ON CONFLICT(external_user_id, txn_id) DO UPDATE SET merchant_id = excluded.merchant_id, ts = excluded.ts
+        """,
+        [(external_user_id, t, m, None if ts != ts else ts) for t, m, ts in zip(ids, row_merchant, row_ts)],
+    )
+    new_txns = len(set(uniq_ids) - known_txns)
+
+    names, codes, stamps, amounts, txn_rows, lines = _recurring_occurrences(batch)
+    if not names:
+        return new_txns
+    # latest delivery wins for an occurrence repeated within one feed
+    incoming: dict[tuple[str, str, int], tuple[float, float]] = {}
+    key_merchant: dict[str, int | None] = {}
+    for code, ts, cents, row, line in zip(codes.tolist(), stamps.tolist(), amounts.tolist(),
+                                          txn_rows.tolist(), lines.tolist()):
+        incoming[(names[code], ids[row], line)] = (ts, cents)
+        key_merchant[names[code]] = row_merchant[row]
+
+    stored: dict[tuple[str, str, int], tuple[float, float]] = {}
+    if known_txns:
+        known = list(known_txns)
+        for i in range(0, len(known), 500):
+            part = known[i:i + 500]
+            cur.execute(
+                f"""
+                SELECT key, txn_id, line, ts, cents FROM subscription_occurrence
+                WHERE external_user_id = ? AND txn_id IN ({','.join('?' * len(part))})
+                """,
+                (external_user_id, *part),
+            )
+            for key, txn_id, line, ts, cents in cur.fetchall():
+                stored[(key, txn_id, line)] = (ts, float("nan") if cents is None else cents)
+
+    changed = {}
+    for occ, (ts, cents) in incoming.items():
+        old = stored.get(occ)
+        if old is None or old[0] != ts or not (old[1] == cents or (old[1] != old[1] and cents != cents)):
+            changed[occ] = (ts, cents, old is not None)
+    if not changed:
+        return new_txns
+    cur.executemany(
+        """
+        INSERT INTO subscription_occurrence (external_user_id, key, txn_id, line, ts, cents) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(external_user_id, key, txn_id, line) DO UPDATE SET ts = excluded.ts, cents = excluded.cents
+        """,
+        [(external_user_id, k, t, line, ts, None if cents != cents else cents)
+         for (k, t, line), (ts, cents, _) in changed.items()],
+    )
+
+    by_key: dict[str, list[tuple[float, float, bool]]] = defaultdict(list)
+    for (key, _, _), occ in changed.items():
+        by_key[key].append(occ)
+    state = _load_recurrence_state(cur, external_user_id, list(by_key))
+    touched: dict[str, dict] = {}
+    for key, occs in by_key.items():
+        s = state.get(key)
+        occs.sort()
+        if s is None and not any(replaced for _, _, replaced in occs):
+            s = _empty_recurrence_state()
+        if s is not None and not any(replaced for _, _, replaced in occs) and (
+                s["last_at"] is None or occs[0][0] >= s["last_at"]):
+            for ts, cents, _ in occs:
+                _fold_occurrence(s, ts, cents)
+        else:  # late/older or edited occurrence: rebuild this key from what is stored
+            s = _rebuild_recurrence_state(cur, external_user_id, key)
+        touched[key] = s
+
+    names = list(touched)
+    rows = [touched[k] for k in names]
+    gap_codes = np.fromiter((k for k, s in enumerate(rows) for _ in s["recent_gaps"]), dtype=np.int64)
+    gaps = np.fromiter((g for s in rows for g in s["recent_gaps"]), dtype=np.float64)
+    occ = np.array([s["occurrences"] for s in rows])
+    candidates = _recurring_candidates(
+        names, occ, np.array([s["last_at"] for s in rows]),
+        np.array([s["gap_sum"] for s in rows]) / np.maximum(occ - 1, 1), gap_codes, gaps,
+        np.array([s["amount_n"] for s in rows], dtype=np.float64),
+        np.array([s["amount_sum"] for s in rows]),
+        np.array([s["amount_sumsq"] for s in rows]),
+    )
+    now = datetime.utcnow().isoformat()
+    cur.executemany(
+        """
+        INSERT INTO subscription_key_state (external_user_id, key, merchant_id, first_at, last_at, occurrences,
+            gap_sum, recent_gaps, amount_n, amount_sum, amount_sumsq, candidate, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(external_user_id, key) DO UPDATE SET
+            merchant_id = excluded.merchant_id, first_at = excluded.first_at, last_at = excluded.last_at, occurrences = excluded.occurrences,
+            gap_sum = excluded.gap_sum, recent_gaps = excluded.recent_gaps, amount_n = excluded.amount_n,
+            amount_sum = excluded.amount_sum, amount_sumsq = excluded.amount_sumsq,
+            candidate = excluded.candidate, updated_at = excluded.updated_at
+        """,
+        [
+            (external_user_id, k, key_merchant[k], s["first_at"], s["last_at"], s["occurrences"], s["gap_sum"],
+             json.dumps(s["recent_gaps"]), s["amount_n"], s["amount_sum"], s["amount_sumsq"],
+             json.dumps(c) if c else None, now)
+            for k, s, c in zip(names, rows, candidates)
+        ],
+    )
+    return new_txns
+
+def _subscriptions_snapshot(external_user_id: str, lookback_days: int, merchants: list) -> dict | None:
+    """Precomputed audit for a user: the requested merchants' transactions and candidates
+    active within the lookback window. ``merchants`` lists the requested ones already synced
+    and ``computed_at`` is the oldest of their syncs.
+    """
+    since = (datetime.now(timezone.utc) - timedelta(days=lookback_days)).timestamp()
+    conn = _db_connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT merchants FROM subscription_audit_state WHERE external_user_id = ?", (external_user_id,))
+        head = cur.fetchone()
+        synced_at = json.loads(head["merchants"] or "{}") if head else {}
+        requested = sorted({str(m) for m in merchants} & set(synced_at))
+        if not requested:
+            return None
+        in_merchants = f"CAST(merchant_id AS TEXT) IN ({','.join('?' * len(requested))})"
+        cur.execute(
+            f"""
+            SELECT COUNT(*) FROM subscription_txn
+            WHERE external_user_id = ? AND {in_merchants} AND (ts IS NULL OR ts >= ?)
+            """,
+            (external_user_id, *requested, since),
+        )
+        total = cur.fetchone()[0]
+        cur.execute(
+            f"""
+            SELECT candidate FROM subscription_key_state
+            WHERE external_user_id = ? AND candidate IS NOT NULL AND last_at >= ? AND {in_merchants}
+            ORDER BY last_at DESC
+            """,
+            (external_user_id, since, *requested),
+        )
+        return {
+            "total_transactions": total,
+            "candidates": [json.loads(r[0]) for r in cur.fetchall()],
+            "merchants": requested,
+            "computed_at": min(synced_at[m] for m in requested),
+        }
+    finally:
+        conn.close()
+
+def _subscriptions_audit(external_user_id: str, merchants: list, limit: int, lookback_days: int, progress=None) -> dict:
+    """Sync merchants' transactions into the user's recurrence state and return the refreshed snapshot."""
+    all_txns = []
+    for i, mid in enumerate(merchants):
+        txns = []
+        if KNOT_ENABLED:
+            status, ok, resp = knot_post("/transactions/sync", {
+                "merchant_id": mid,
+                "external_user_id": external_user_id,
             })
-    return candidates
+            if ok and isinstance(resp, dict):
+                txns = (resp.get("transactions") or resp.get("data", {}).get("transactions") or [])
+        else:
+            txns, _ = _mock_transactions_for_merchant(mid, limit)
+        # the state is filtered by merchant; tag transactions the sync returned without one
+        all_txns.extend(
+            t if not isinstance(t, dict) or (t.get("merchant") or {}).get("id") is not None
+            else {**t, "merchant": {**(t.get("merchant") or {}), "id": int(mid) if str(mid).isdigit() else mid}}
+            for t in txns
+        )
+        if progress:
+            progress(i + 1, len(merchants))
+
+    conn = _db_connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        new = _update_recurrence_state(cur, external_user_id, TxnBatch(all_txns, keep_raw=False))
+        cur.execute("SELECT merchants FROM subscription_audit_state WHERE external_user_id = ?", (external_user_id,))
+        row = cur.fetchone()
+        synced = json.loads(row[0] or "{}") if row else {}
+        now = datetime.now(timezone.utc).isoformat()
+        synced.update((str(m), now) for m in merchants)
+        cur.execute(
+            """
+            INSERT INTO subscription_audit_state (external_user_id, merchants, computed_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(external_user_id) DO UPDATE SET
+                merchants = excluded.merchants, computed_at = excluded.computed_at
+            """,
+            (external_user_id, json.dumps(synced, sort_keys=True), now),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    snapshot = _subscriptions_snapshot(external_user_id, lookback_days, merchants)
+    snapshot["new_transactions"] = new
+    return snapshot
+
+def _subscriptions_snapshot_fresh(snapshot: dict | None, merchants: list) -> bool:
+    if not snapshot or not {str(m) for m in merchants} <= set(snapshot["merchants"]):
+        return False
+    age = datetime.now(timezone.utc) - datetime.fromisoformat(snapshot["computed_at"])
+    return age.total_seconds() < SUBSCRIPTIONS_AUDIT_MAX_AGE_SEC
+
+@_job_handler('subscriptions_audit')
+def _subscriptions_audit_job(params: dict, ctx: JobContext) -> dict:
+    return _subscriptions_audit(
+        params['external_user_id'], params['merchants'], params['limit'], params['lookback_days'], progress=ctx.progress
+    )
 
 @app.route('/subscriptions/audit', methods=['POST'])
 def subscriptions_audit():
     try:
         data = request.get_json() or {}
-        external_user_id = data.get('external_user_id', 'demo')
-        merchants = data.get('merchants') or [44, 12, 45, 40, 19, 36, 165]
-        limit = int(data.get('limit', 50))
-        lookback_days = int(data.get('lookback_days', 90))
-        since_dt = datetime.now(timezone.utc) - timedelta(days=lookback_days)
-
-        all_txns = []
-        for mid in merchants:
-            txns = []
-            if KNOT_ENABLED:
-                status, ok, resp = knot_post("/transactions/sync", {
-                    "merchant_id": mid,
-                    "external_user_id": external_user_id,
-                })
-                if ok and isinstance(resp, dict):
-                    txns = (resp.get("transactions") or resp.get("data", {}).get("transactions") or [])
-            else:
-                txns, _ = _mock_transactions_for_merchant(mid, limit)
-            for t in txns:
-                dt = _parse_dt(t.get("datetime") or t.get("ts") or "")
-                if not dt or dt >= since_dt:
-                    all_txns.append(t)
-
-        candidates = _detect_recurring(all_txns)
-        return jsonify({
-            "total_transactions": len(all_txns),
-            "candidates": candidates
-        })
+        params = {
+            "external_user_id": data.get('external_user_id', 'demo'),
+            "merchants": data.get('merchants') or [44, 12, 45, 40, 19, 36, 165],
+            "limit": int(data.get('limit', 50)),
+            "lookback_days": int(data.get('lookback_days', 90)),
+        }
+        # serve the precomputed audit unless it is stale, missing merchants, or a refresh is forced
+        if not data.get('refresh'):
+            snapshot = _subscriptions_snapshot(params['external_user_id'], params['lookback_days'], params['merchants'])
+            if _subscriptions_snapshot_fresh(snapshot, params['merchants']):
+                return jsonify(snapshot)
+        if _wants_async(data):
+            return _enqueue_response('subscriptions_audit', params, data)
+        return jsonify(_subscriptions_audit(**params))
     except Exception as e:
         logger.error(f"Subscriptions audit error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -1807,6 +3432,26 @@ def init_db():
             );
             """
         )
+        # scheduling columns added after the initial schema
+        _ensure_columns(cur, "price_watch", {
+            "expires_at": "TEXT",
+            "next_check_at": "TEXT",
+            "last_checked_at": "TEXT",
+            "lease_owner": "TEXT",
+            "lease_until": "TEXT",
+        })
+        cur.execute(
+            "UPDATE price_watch SET expires_at = strftime('%Y-%m-%dT%H:%M:%f', created_at, '+' || window_days || ' days') "
+            "WHERE window_days IS NOT NULL AND expires_at IS NULL"
+        )
+        unscheduled = [r[0] for r in cur.execute("SELECT id FROM price_watch WHERE next_check_at IS NULL AND last_checked_at IS NULL")]
+        cur.executemany(
+            "UPDATE price_watch SET next_check_at = ? WHERE id = ?",
+            [(_initial_next_check(), wid) for wid in unscheduled]
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_price_watch_due ON price_watch(next_check_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_price_watch_canonical ON price_watch(canonical_id, target_price_cents)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_price_watch_expires ON price_watch(expires_at)")
         # matches table for watch hits
         cur.execute(
             """
@@ -1820,6 +3465,17 @@ def init_db():
             );
             """
         )
+        _ensure_columns(cur, "price_watch_match", {
+            "fingerprint": "TEXT",
+            "last_seen_at": "TEXT",
+            "seen_count": "INTEGER NOT NULL DEFAULT 1",
+        })
+        _dedupe_legacy_matches(cur)
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_price_watch_match_fp ON price_watch_match(fingerprint)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_price_watch_match_created ON price_watch_match(created_at)")
+        # per-user / per-watch keyset listings
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_price_watch_user_id ON price_watch(external_user_id, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_price_watch_match_watch_id ON price_watch_match(watch_id, id)")
         # price history snapshots
         cur.execute(
             """
@@ -1834,7 +3490,164 @@ def init_db():
         )
         cur.execute("CREATE INDEX IF NOT EXISTS idx_price_history_canonical ON price_history(canonical_id)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_price_history_time ON price_history(fetched_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_price_history_canonical_time ON price_history(canonical_id, fetched_at)")
+        # hourly/daily rollups of price_history, maintained on insert
+        for table, _ in PRICE_ROLLUPS.values():
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    canonical_id TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    min_cents INTEGER NOT NULL,
+                    max_cents INTEGER NOT NULL,
+                    sum_cents INTEGER NOT NULL,
+                    n INTEGER NOT NULL,
+                    last_cents INTEGER NOT NULL,
+                    last_at TEXT NOT NULL,
+                    title TEXT,
+                    PRIMARY KEY (canonical_id, bucket)
+                );
+                """
+            )
+        # Wayback caches: CDX listings per (url, window) and extracted price per snapshot
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS wayback_cdx_cache (
+                url TEXT NOT NULL,
+                window_from TEXT NOT NULL,
+                window_to TEXT NOT NULL,
+                rows TEXT NOT NULL,
+                fetched_at TEXT NOT NULL,
+                PRIMARY KEY (url, window_from, window_to)
+            );
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS wayback_snapshot (
+                url TEXT NOT NULL,
+                ts TEXT NOT NULL,
+                price_cents INTEGER,
+                title TEXT,
+                fetched_at TEXT NOT NULL,
+                PRIMARY KEY (url, ts)
+            );
+            """
+        )
+        # RAG chunks per user (RagStore backend)
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rag_chunks (
+                external_user_id TEXT PRIMARY KEY,
+                chunks TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                version TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                vectors BLOB,
+                embedder TEXT
+            );
+            """
+        )
+        _ensure_columns(cur, "rag_chunks", {"vectors": "BLOB", "embedder": "TEXT"})
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_rag_chunks_expires ON rag_chunks(expires_at)")
+        # subscriptions audit: synced transactions and key occurrences, per-key recurrence state + per-user audit head
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'subscription_occurrence'")
+        had_occurrences = cur.fetchone() is not None
+        had_merchants = "merchant_id" in {r[1] for r in cur.execute("PRAGMA table_info(subscription_txn)")}
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS subscription_txn (
+                external_user_id TEXT NOT NULL,
+                txn_id TEXT NOT NULL,
+                merchant_id INTEGER,
+                ts REAL,
+                PRIMARY KEY (external_user_id, txn_id)
+            );
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_subscription_txn_ts ON subscription_txn(external_user_id, ts)")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS subscription_occurrence (
+                external_user_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                txn_id TEXT NOT NULL,
+                line INTEGER NOT NULL,
+                ts REAL NOT NULL,
+                cents REAL,
+                PRIMARY KEY (external_user_id, key, txn_id, line)
+            );
+            """
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_subscription_occurrence_txn "
+            "ON subscription_occurrence(external_user_id, txn_id)"
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS subscription_key_state (
+                external_user_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                merchant_id INTEGER,
+                first_at REAL NOT NULL,
+                last_at REAL NOT NULL,
+                occurrences INTEGER NOT NULL,
+                gap_sum REAL NOT NULL DEFAULT 0,
+                recent_gaps TEXT NOT NULL DEFAULT '[]',
+                amount_n INTEGER NOT NULL DEFAULT 0,
+                amount_sum REAL NOT NULL DEFAULT 0,
+                amount_sumsq REAL NOT NULL DEFAULT 0,
+                candidate TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (external_user_id, key)
+            );
+            """
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_subscription_key_state_candidates "
+            "ON subscription_key_state(external_user_id, last_at) WHERE candidate IS NOT NULL"
+        )
+        _ensure_columns(cur, "subscription_txn", {"merchant_id": "INTEGER"})
+        _ensure_columns(cur, "subscription_key_state", {"merchant_id": "INTEGER"})
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS subscription_audit_state (
+                external_user_id TEXT PRIMARY KEY,
+                merchants TEXT,
+                computed_at TEXT NOT NULL
+            );
+            """
+        )
+        if not (had_occurrences and had_merchants):
+            # state without stored occurrences or merchant ids can't be deduped or filtered; rebuild on the next audit
+            for table in ("subscription_txn", "subscription_occurrence", "subscription_key_state",
+                          "subscription_audit_state"):
+                cur.execute(f"DELETE FROM {table}")
+        # background jobs
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                idempotency_key TEXT,
+                params TEXT,
+                progress_done INTEGER,
+                progress_total INTEGER,
+                result TEXT,
+                error TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT
+            );
+            """
+        )
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_job_idempotency ON job(kind, idempotency_key)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_job_status ON job(status, created_at)")
         conn.commit()
+        _rebuild_price_rollups_if_empty(conn)
     finally:
         try:
             conn.close()
@@ -1844,89 +3657,310 @@ def init_db():
 def _row_to_dict(row: sqlite3.Row) -> dict:
     return {k: row[k] for k in row.keys()}
 
-def _evaluate_watches_once(limit_per_merchant: int = 10) -> int:
-    """Evaluate watches against latest transaction data (mock if Knot disabled).
-    For demo: if any transaction with a numeric total <= target_price matches same merchant namespace in canonical_id, record a match.
-    Returns number of matches created.
+def _ensure_columns(cur: sqlite3.Cursor, table: str, columns: dict[str, str]) -> None:
+    """Add missing columns to an existing table (SQLite has no ADD COLUMN IF NOT EXISTS)."""
+    existing = {r[1] for r in cur.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns.items():
+        if name not in existing:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+def _initial_next_check(now: datetime | None = None) -> str:
+    """Random phase within one interval so checks spread uniformly instead of spiking each tick."""
+    now = now or datetime.utcnow()
+    return (now + timedelta(seconds=random.uniform(0, SCHED_INTERVAL_MIN * 60))).isoformat()
+
+# a watch whose window or target changed is checked again; expired ones were unscheduled by the tick
+WATCH_RESCHEDULE_FIELDS = ('window_days', 'target_price_cents')
+_WATCH_RESCHEDULE_SQL = "UPDATE price_watch SET next_check_at = COALESCE(next_check_at, ?) WHERE id = ?"
+
+def _watch_expires_at(created_at: str, window_days) -> str | None:
+    if window_days in (None, ''):
+        return None
+    return (datetime.fromisoformat(created_at) + timedelta(days=int(window_days))).isoformat()
+
+# identifies this process when leasing watches; several app processes can share one DB
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def _watch_merchant_id(canonical: str | None) -> int:
+    """Infer merchant id from canonical like "<mid>:<external_id>" (Amazon by default)."""
+    parts = (canonical or '').split(':', 1)
+    try:
+        return int(parts[0]) if len(parts) == 2 else 44
+    except Exception:
+        return 44
+
+def _fetch_recent_transactions(external_user_id: str, merchant_id: int, limit: int) -> list[dict]:
+    """Recent transactions for one user/merchant (mock if Knot disabled)."""
+    if not KNOT_ENABLED:
+        txns, _ = _mock_transactions_for_merchant(merchant_id, limit)
+        return txns
+    status, ok, resp = knot_post('/transactions/sync', {
+        'merchant_id': merchant_id,
+        'external_user_id': external_user_id,
+        'limit': limit,
+    })
+    if ok and isinstance(resp, dict):
+        body = resp if 'transactions' in resp else resp.get('data', {})
+        return body.get('transactions') or []
+    return []
+
+class _TxnPriceIndex:
+    """Answers "first transaction (in feed order) priced <= target" in O(log n).
+    Transactions are sorted by cents; first_pos[i] is the smallest feed position among
+    the i+1 cheapest, so a search on the target gives the answer directly.
     """
-    conn = _db_connect()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM price_watch")
-    watches = [dict(row) for row in cur.fetchall()]
-
-    match_count = 0
-    for w in watches:
-        target_cents = w.get('target_price_cents')
-        canonical = (w.get('canonical_id') or '')
-        # infer merchant id from canonical like "<mid>:<external_id>"
-        parts = canonical.split(':', 1)
+
+    def __init__(self, txns: TxnBatch):
+        self.batch = _as_txn_batch(txns)
+        cents = self.batch.total_cents
+        priced = np.flatnonzero(~np.isnan(cents))
+        order = priced[np.argsort(cents[priced], kind="stable")]
+        self.cents = cents[order]
+        self.first_pos = np.minimum.accumulate(order) if len(order) else order
+
+    def first_at_or_below(self, target_cents: int) -> tuple[dict, int] | None:
+        k = int(np.searchsorted(self.cents, target_cents, side="right"))
+        if k == 0:
+            return None
+        pos = int(self.first_pos[k - 1])
+        return self.batch.raw[pos], int(self.batch.total_cents[pos])
+
+def _match_watches(watches: list[tuple], limit_per_merchant: int) -> tuple[list[tuple], int]:
+    """Evaluate (id, external_user_id, canonical_id, target_price_cents) watches.
+    Transactions are fetched once per (external_user_id, merchant) group and each watch is
+    answered from a price index. Returns (match rows ready for insert, number of groups).
+    """
+    groups: dict[tuple[str, int], list[tuple[int, int]]] = defaultdict(list)
+    for watch_id, external_user_id, canonical_id, target_cents in watches:
+        if target_cents is None:
+            continue
+        groups[(external_user_id or 'abc', _watch_merchant_id(canonical_id))].append((watch_id, int(target_cents)))
+
+    now_iso = datetime.utcnow().isoformat()
+    new_matches = []
+    for (external_user_id, mid), group in groups.items():
+        index = _TxnPriceIndex(TxnBatch(_fetch_recent_transactions(external_user_id, mid, limit_per_merchant)))
+        for watch_id, target_cents in group:
+            hit = index.first_at_or_below(target_cents)
+            if hit:  # one hit per watch per run
+                t, cents = hit
+                new_matches.append(_match_row(watch_id, _txn_subject(t), cents, json.dumps({'txn': t}), now_iso))
+    return new_matches, len(groups)
+
+def _txn_subject(t: dict) -> str:
+    """Stable identity of a transaction for match fingerprints."""
+    for k in ('id', 'external_id', 'order_id'):
+        if t.get(k):
+            return str(t[k])
+    prods = t.get('products') or []
+    if prods and isinstance(prods[0], dict) and prods[0].get('external_id'):
+        return str(prods[0]['external_id'])
+    return str(t.get('datetime') or t.get('ts') or '')
+
+def _match_fingerprint(watch_id: int, subject: str, price_cents: int | None) -> str:
+    return hashlib.sha1(f"{watch_id}|{subject}|{price_cents}".encode("utf-8")).hexdigest()
+
+def _match_row(watch_id: int, subject: str, price_cents: int | None, details: str, created_at: str) -> tuple:
+    return (watch_id, price_cents, details, created_at, _match_fingerprint(watch_id, subject, price_cents), created_at)
+
+def _insert_matches(cur: sqlite3.Cursor, matches: list[tuple]) -> int:
+    """Upsert match rows built by _match_row. A repeat of the same watch/subject/price only
+    bumps last_seen_at and seen_count. Returns the number of genuinely new matches.
+    """
+    if not matches:
+        return 0
+    fps = [m[4] for m in matches]
+    existing = set()
+    for i in range(0, len(fps), 500):
+        part = fps[i:i + 500]
+        existing.update(r[0] for r in cur.execute(
+            f"SELECT fingerprint FROM price_watch_match WHERE fingerprint IN ({','.join('?' * len(part))})", part
+        ))
+    cur.executemany(
+        "INSERT INTO price_watch_match (watch_id, found_price_cents, details, created_at, fingerprint, last_seen_at) "
+        "VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(fingerprint) DO UPDATE SET last_seen_at = excluded.last_seen_at, seen_count = seen_count + 1",
+        matches
+    )
+    return len(set(fps) - existing)
+
+def _dedupe_legacy_matches(cur: sqlite3.Cursor) -> None:
+    """Fingerprint matches recorded before fingerprints existed, folding duplicates into the oldest row."""
+    rows = cur.execute(
+        "SELECT id, watch_id, found_price_cents, details, created_at FROM price_watch_match WHERE fingerprint IS NULL ORDER BY id"
+    ).fetchall()
+    if not rows:
+        return
+    keep: dict[str, list] = {}
+    drop = []
+    for mid, watch_id, cents, details, created_at in rows:
         try:
-            mid = int(parts[0]) if len(parts) == 2 else 44
+            d = json.loads(details or '{}')
         except Exception:
-            mid = 44
-        # fetch recent txns (mock or real)
-        txns = []
-        if KNOT_ENABLED:
-            status, ok, resp = knot_post('/transactions/sync', {
-                'merchant_id': mid,
-                'external_user_id': w.get('external_user_id', 'abc'),
-                'limit': limit_per_merchant,
-            })
-            if ok and isinstance(resp, dict):
-                body = resp if 'transactions' in resp else resp.get('data', {})
-                txns = body.get('transactions') or []
+            d = {}
+        subject = _txn_subject(d['txn']) if isinstance(d.get('txn'), dict) else str(d.get('canonical_id') or mid)
+        fp = _match_fingerprint(watch_id, subject, cents)
+        if fp in keep:
+            keep[fp][1] += 1
+            keep[fp][2] = max(keep[fp][2], created_at)
+            drop.append((mid,))
         else:
-            txns, _ = _mock_transactions_for_merchant(mid, limit_per_merchant)
-        # evaluate simple rule
-        def _parse_total(t) -> int | None:
-            try:
-                s = (t.get('price') or {}).get('total')
-                if s is None:
-                    return None
-                return int(round(float(s) * 100))
-            except Exception:
-                return None
-        for t in txns:
-            cents = _parse_total(t)
-            if cents is None:
-                continue
-            if target_cents is not None and cents <= int(target_cents):
-                # record a match
-                cur.execute(
-                    "INSERT INTO price_watch_match (watch_id, found_price_cents, details, created_at) VALUES (?, ?, ?, ?)",
-                    (w['id'], cents, json.dumps({'txn': t}), datetime.utcnow().isoformat())
-                )
-                conn.commit()
-                match_count += 1
-                break  # one hit per watch per run
+            keep[fp] = [mid, 1, created_at]
+    cur.executemany("DELETE FROM price_watch_match WHERE id = ?", drop)
+    cur.executemany(
+        "UPDATE price_watch_match SET fingerprint = ?, seen_count = ?, last_seen_at = ? WHERE id = ?",
+        [(fp, n, last, mid) for fp, (mid, n, last) in keep.items()]
+    )
+
+def _eval_summary(n_watches: int, n_groups: int, n_matches: int, started: float, stats: dict | None) -> dict:
+    elapsed = time.perf_counter() - started
+    summary = {
+        "watches": n_watches,
+        "groups": n_groups,
+        "matches": n_matches,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "watches_per_sec": round(n_watches / elapsed, 1) if elapsed > 0 else None,
+    }
+    if stats is not None:
+        stats.update(summary)
+    return summary
+
+def _evaluate_watches_once(limit_per_merchant: int = 10, stats: dict | None = None) -> int:
+    """Evaluate all unexpired watches against latest transaction data (mock if Knot disabled).
+    For demo: if any transaction with a numeric total <= target_price matches same merchant namespace in canonical_id, record a match.
+    Used for on-demand checks; the scheduler uses _run_due_watches instead.
+    Returns number of new matches (repeats are deduplicated); throughput figures are written into stats if given.
+    """
+    started = time.perf_counter()
+    conn = _db_connect()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT id, external_user_id, canonical_id, target_price_cents FROM price_watch "
+        "WHERE target_price_cents IS NOT NULL AND (expires_at IS NULL OR expires_at > ?)",
+        (datetime.utcnow().isoformat(),)
+    )
+    watches = [tuple(r) for r in cur.fetchall()]
+    new_matches, n_groups = _match_watches(watches, limit_per_merchant)
+    created = _insert_matches(cur, new_matches)
+    conn.commit()
     try:
         conn.close()
     except Exception:
         pass
-    return match_count
+    logger.info(f"watch evaluation: {_eval_summary(len(watches), n_groups, created, started, stats)}")
+    return created
+
+def _claim_due_watches(conn: sqlite3.Connection, batch_size: int) -> list[tuple]:
+    """Lease up to batch_size due, unexpired watches for this worker.
+    Selecting and leasing happen under SQLite's write lock (BEGIN IMMEDIATE), so concurrent
+    processes never claim the same row; both statements go through the next_check_at index
+    and the primary key rather than scanning the table.
+    """
+    now = datetime.utcnow()
+    now_iso = now.isoformat()
+    token = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute(
+            """
+            SELECT id, external_user_id, canonical_id, target_price_cents FROM price_watch
+            WHERE next_check_at <= ?
+              AND (expires_at IS NULL OR expires_at > ?)
+              AND (lease_until IS NULL OR lease_until < ?)
+            ORDER BY next_check_at
+            LIMIT ?
+            """,
+            (now_iso, now_iso, now_iso, batch_size)
+        )
+        watches = [tuple(r) for r in cur.fetchall()]
+        lease_until = (now + timedelta(seconds=SCHED_LEASE_SEC)).isoformat()
+        cur.executemany(
+            "UPDATE price_watch SET lease_owner = ?, lease_until = ? WHERE id = ?",
+            [(token, lease_until, w[0]) for w in watches]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return watches
+
+def _run_due_watches(limit_per_merchant: int = 10, batch_size: int | None = None,
+                     max_batches: int | None = None, stats: dict | None = None) -> int:
+    """Scheduler tick: evaluate only watches whose next_check_at has passed, in leased batches.
+    Each watch is rescheduled one interval after its check; expired watches are unscheduled
+    so they stop costing anything. Returns number of matches created.
+    """
+    started = time.perf_counter()
+    batch_size = batch_size or SCHED_BATCH_SIZE
+    max_batches = max_batches or SCHED_MAX_BATCHES_PER_TICK
+    conn = _db_connect()
+    n_watches = n_groups = n_matches = 0
+    try:
+        cur = conn.cursor()
+        now_iso = datetime.utcnow().isoformat()
+        cur.execute(
+            "UPDATE price_watch SET next_check_at = NULL, lease_owner = NULL, lease_until = NULL "
+            "WHERE expires_at <= ? AND next_check_at IS NOT NULL",
+            (now_iso,)
+        )
+        conn.commit()
+        for _ in range(max_batches):
+            watches = _claim_due_watches(conn, batch_size)
+            if not watches:
+                break
+            new_matches, groups = _match_watches(watches, limit_per_merchant)
+            checked = datetime.utcnow()
+            next_iso = (checked + timedelta(minutes=SCHED_INTERVAL_MIN)).isoformat()
+            created = _insert_matches(cur, new_matches)
+            cur.executemany(
+                "UPDATE price_watch SET next_check_at = ?, last_checked_at = ?, lease_owner = NULL, lease_until = NULL WHERE id = ?",
+                [(next_iso, checked.isoformat(), w[0]) for w in watches]
+            )
+            conn.commit()
+            n_watches += len(watches)
+            n_groups += groups
+            n_matches += created
+            if len(watches) < batch_size:
+                break
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    if n_watches:
+        logger.info(f"due watch evaluation: {_eval_summary(n_watches, n_groups, n_matches, started, stats)}")
+    else:
+        _eval_summary(0, 0, 0, started, stats)
+    return n_matches
+
+_WATCH_INSERT_SQL = """
+    INSERT INTO price_watch (external_user_id, order_id, canonical_id, target_price_cents, window_days, note, created_at, expires_at, next_check_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _watch_insert_row(payload: dict, created_at: str) -> tuple:
+    window_days = payload.get('window_days')
+    return (
+        payload.get('external_user_id') or 'demo',
+        payload.get('order_id'),
+        payload.get('canonical_id'),
+        payload.get('target_price_cents'),
+        window_days,
+        payload.get('note'),
+        created_at,
+        _watch_expires_at(created_at, window_days),
+        _initial_next_check(),
+    )
 
 @app.route('/price-protection/watch', methods=['POST'])
 def price_protection_watch():
     """Create a price watch (backwards-compatible endpoint)."""
     try:
         payload = request.get_json() or {}
-        external_user_id = payload.get('external_user_id') or 'demo'
-        order_id = payload.get('order_id')
-        canonical_id = payload.get('canonical_id')
-        target_price_cents = payload.get('target_price_cents')
-        window_days = payload.get('window_days')
-        note = payload.get('note')
-        created_at = datetime.utcnow().isoformat()
-
         conn = _db_connect()
         cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO price_watch (external_user_id, order_id, canonical_id, target_price_cents, window_days, note, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (external_user_id, order_id, canonical_id, target_price_cents, window_days, note, created_at)
-        )
+        cur.execute(_WATCH_INSERT_SQL, _watch_insert_row(payload, datetime.utcnow().isoformat()))
         conn.commit()
         new_id = cur.lastrowid
         try:
@@ -1938,57 +3972,120 @@ def price_protection_watch():
         logger.error(f"Price watch error: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/price-protection/list', methods=['GET'])
-def price_protection_list():
-    """List price watches, optionally filtered by external_user_id via query param."""
+def _encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return int(json.loads(raw)["id"])
+    except (KeyError, TypeError, ValueError, binascii.Error):
+        raise ValueError("invalid cursor")
+
+def _page_args() -> tuple[int, int | None, str | None]:
+    """(limit, before_id, since) from query args for keyset pagination over id DESC.
+    The position comes from an opaque cursor (next_cursor of the previous page) or a raw before_id.
+    """
+    limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+    cursor = request.args.get('cursor')
+    before_id = request.args.get('before_id')
+    if cursor:
+        before_id = _decode_cursor(cursor)
+    return limit, (int(before_id) if before_id else None), request.args.get('since')
+
+def _projection(cur: sqlite3.Cursor, table: str, alias: str) -> str:
+    """Column list for fields=a,b,c (validated against the table schema; id always included)."""
+    fields = [f.strip() for f in (request.args.get('fields') or '').split(',') if f.strip()]
+    if not fields:
+        return f"{alias}.*"
+    known = {r[1] for r in cur.execute(f"PRAGMA table_info({table})")}
+    unknown = [f for f in fields if f not in known]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    cols = ['id'] + [f for f in fields if f != 'id']
+    return ", ".join(f"{alias}.{c}" for c in cols)
+
+def _keyset_page(table: str, alias: str, clauses: list[str], values: list, order_col: str) -> tuple[list[dict], str | None]:
+    """Run one page of a keyset-paginated listing and return (rows, next_cursor)."""
+    limit, before_id, since = _page_args()
+    clauses, values = list(clauses), list(values)
+    if before_id is not None:
+        clauses.append(f"{order_col} < ?")
+        values.append(before_id)
+    if since:
+        clauses.append(f"{alias}.created_at >= ?")
+        values.append(since)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    conn = _db_connect()
     try:
-        external_user_id = request.args.get('external_user_id')
-        conn = _db_connect()
         cur = conn.cursor()
-        if external_user_id:
-            cur.execute("SELECT * FROM price_watch WHERE external_user_id = ? ORDER BY id DESC", (external_user_id,))
-        else:
-            cur.execute("SELECT * FROM price_watch ORDER BY id DESC")
-        rows = cur.fetchall()
-        watches = [_row_to_dict(r) for r in rows]
+        cols = _projection(cur, table, alias)
+        cur.execute(f"SELECT {cols} FROM {table} {alias} {where} ORDER BY {order_col} DESC LIMIT ?", (*values, limit))
+        rows = [_row_to_dict(r) for r in cur.fetchall()]
+    finally:
         try:
             conn.close()
         except Exception:
             pass
-        return jsonify({"watches": watches})
+    next_cursor = _encode_cursor(rows[-1]['id']) if len(rows) == limit else None
+    return rows, next_cursor
+
+@app.route('/price-protection/list', methods=['GET'])
+def price_protection_list():
+    """List price watches, newest first.
+    Query: external_user_id?, limit=100, cursor? (next_cursor of the previous page) or before_id?,
+    since? (ISO created_at lower bound), fields? (comma-separated column projection)
+    """
+    try:
+        external_user_id = request.args.get('external_user_id')
+        clauses, values = [], []
+        if external_user_id:
+            clauses.append("w.external_user_id = ?")
+            values.append(external_user_id)
+        watches, next_cursor = _keyset_page("price_watch", "w", clauses, values, "w.id")
+        return jsonify({"watches": watches, "next_cursor": next_cursor})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Price watch list error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@_job_handler('price_protection_check')
+def _price_protection_check_job(params: dict, ctx: JobContext) -> dict:
+    stats: dict = {}
+    created = _evaluate_watches_once(stats=stats)
+    return {"ok": True, "matches_created": created, "stats": stats}
+
 @app.route('/price-protection/check', methods=['POST'])
 def price_protection_check():
     try:
-        created = _evaluate_watches_once()
-        return jsonify({"ok": True, "matches_created": created})
+        body = request.get_json(silent=True) or {}
+        if _wants_async(body):
+            return _enqueue_response('price_protection_check', {}, body)
+        stats: dict = {}
+        created = _evaluate_watches_once(stats=stats)
+        return jsonify({"ok": True, "matches_created": created, "stats": stats})
     except Exception as e:
         logger.error(f"Price watch check error: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/price-protection/matches', methods=['GET'])
 def price_protection_matches():
+    """List watch matches, newest first.
+    Query: external_user_id?, limit=100, cursor? or before_id?, since?, fields? (e.g. omit details
+    with fields=watch_id,found_price_cents,created_at)
+    """
     try:
         external_user_id = request.args.get('external_user_id')
-        conn = _db_connect()
-        cur = conn.cursor()
+        clauses, values = [], []
         if external_user_id:
-            cur.execute(
-                "SELECT m.* FROM price_watch_match m JOIN price_watch w ON m.watch_id = w.id WHERE w.external_user_id = ? ORDER BY m.id DESC",
-                (external_user_id,)
-            )
-        else:
-            cur.execute("SELECT * FROM price_watch_match ORDER BY id DESC")
-        rows = cur.fetchall()
-        matches = [_row_to_dict(r) for r in rows]
-        try:
-            conn.close()
-        except Exception:
-            pass
-        return jsonify({"matches": matches})
+            # resolves through idx_price_watch_user_id then idx_price_watch_match_watch_id
+            clauses.append("m.watch_id IN (SELECT id FROM price_watch WHERE external_user_id = ?)")
+            values.append(external_user_id)
+        matches, next_cursor = _keyset_page("price_watch_match", "m", clauses, values, "m.id")
+        return jsonify({"matches": matches, "next_cursor": next_cursor})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Price watch matches error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -2058,6 +4155,13 @@ def price_protection_update(watch_id: int):
             except Exception:
                 pass
             return jsonify({"error": "not_found"}), 404
+        if 'window_days' in payload:
+            created_at = cur.execute("SELECT created_at FROM price_watch WHERE id = ?", (watch_id,)).fetchone()[0]
+            expires_at = _watch_expires_at(created_at, payload['window_days'])
+            cur.execute("UPDATE price_watch SET expires_at = ? WHERE id = ?", (expires_at, watch_id))
+        if any(k in payload for k in WATCH_RESCHEDULE_FIELDS):
+            cur.execute(_WATCH_RESCHEDULE_SQL, (_initial_next_check(), watch_id))
+            conn.commit()
         # Return updated row
         cur.execute("SELECT * FROM price_watch WHERE id = ?", (watch_id,))
         row = cur.fetchone()
@@ -2070,61 +4174,414 @@ def price_protection_update(watch_id: int):
         logger.error(f"Price watch update error: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Bulk watch operations: one transaction per request, per-item results
+
+WATCH_FIELDS = ('external_user_id', 'order_id', 'canonical_id', 'target_price_cents', 'window_days', 'note')
+
+def _validate_watch_item(item, partial: bool = False) -> str | None:
+    """Return an error string for an invalid watch payload, else None."""
+    if not isinstance(item, dict):
+        return "item must be an object"
+    unknown = [k for k in item if k not in WATCH_FIELDS and k != 'id']
+    if unknown:
+        return f"unknown fields: {', '.join(unknown)}"
+    for k in ('external_user_id', 'order_id', 'canonical_id', 'note'):
+        if item.get(k) is not None and not isinstance(item[k], str):
+            return f"{k} must be a string"
+    for k, minimum in (('target_price_cents', 0), ('window_days', 1)):
+        v = item.get(k)
+        if v is not None and (isinstance(v, bool) or not isinstance(v, int) or v < minimum):
+            return f"{k} must be an integer >= {minimum}"
+    if not partial and not item.get('canonical_id'):
+        return "canonical_id is required"
+    if partial:
+        # an update can't clear the owner (NOT NULL) or the watched product
+        for k in ('external_user_id', 'canonical_id'):
+            if k in item and not item[k]:
+                return f"{k} must be a non-empty string"
+    return None
+
+def _bulk_items(body: dict, key: str) -> list:
+    items = body.get(key)
+    if not isinstance(items, list) or not items:
+        raise ValueError(f"'{key}' must be a non-empty array")
+    if len(items) > WATCH_BULK_MAX:
+        raise ValueError(f"at most {WATCH_BULK_MAX} items per request")
+    return items
+
+def _next_watch_ids(cur: sqlite3.Cursor, n: int) -> list[int]:
+    """Ids AUTOINCREMENT will assign to the next n inserts (valid while holding the write lock)."""
+    row = cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'price_watch'").fetchone()
+    start = (row[0] if row else 0) + 1
+    return list(range(start, start + n))
+
+@app.route('/price-protection/watches/bulk', methods=['POST'])
+def price_protection_bulk_create():
+    """Create many watches in one transaction.
+    Body: { watches: [{ canonical_id, external_user_id?, order_id?, target_price_cents?, window_days?, note? }] }
+    Returns per-item { index, ok, watch_id | error } plus created count and latency_ms.
+    """
+    started = time.perf_counter()
+    try:
+        items = _bulk_items(request.get_json() or {}, 'watches')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        results = [None] * len(items)
+        valid = []
+        for i, item in enumerate(items):
+            err = _validate_watch_item(item)
+            if err:
+                results[i] = {"index": i, "ok": False, "error": err}
+            else:
+                valid.append(i)
+        created_at = datetime.utcnow().isoformat()
+        conn = _db_connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            ids = _next_watch_ids(cur, len(valid))
+            cur.executemany(_WATCH_INSERT_SQL, [_watch_insert_row(items[i], created_at) for i in valid])
+            conn.commit()
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        for i, watch_id in zip(valid, ids):
+            results[i] = {"index": i, "ok": True, "watch_id": watch_id}
+        return jsonify({
+            "ok": True,
+            "created": len(valid),
+            "failed": len(items) - len(valid),
+            "results": results,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+    except Exception as e:
+        logger.error(f"Price watch bulk create error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/price-protection/watches/bulk', methods=['PATCH', 'PUT'])
+def price_protection_bulk_update():
+    """Update many watches in one transaction.
+    Body: { watches: [{ id, <fields to change> }] }
+    """
+    started = time.perf_counter()
+    try:
+        items = _bulk_items(request.get_json() or {}, 'watches')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        results = [None] * len(items)
+        conn = _db_connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            ids = [it.get('id') for it in items if isinstance(it, dict) and isinstance(it.get('id'), int)]
+            created = {}
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                created.update(cur.execute(
+                    f"SELECT id, created_at FROM price_watch WHERE id IN ({','.join('?' * len(part))})", part
+                ).fetchall())
+            # executemany needs one statement per distinct set of updated columns
+            by_columns: dict[tuple, list[tuple]] = defaultdict(list)
+            reschedule = []
+            for i, item in enumerate(items):
+                err = _validate_watch_item(item, partial=True)
+                if not err and not isinstance(item.get('id'), int):
+                    err = "id is required"
+                cols = tuple(k for k in WATCH_FIELDS if k in item) if not err else ()
+                if not err and not cols:
+                    err = "no_fields_to_update"
+                if not err and item['id'] not in created:
+                    err = "not_found"
+                if err:
+                    results[i] = {"index": i, "ok": False, "error": err}
+                    continue
+                values = [item[k] for k in cols]
+                if 'window_days' in cols:
+                    cols = cols + ('expires_at',)
+                    values.append(_watch_expires_at(created[item['id']], item['window_days']))
+                by_columns[cols].append((*values, item['id']))
+                if any(k in cols for k in WATCH_RESCHEDULE_FIELDS):
+                    reschedule.append((_initial_next_check(), item['id']))
+                results[i] = {"index": i, "ok": True, "watch_id": item['id']}
+            for cols, rows in by_columns.items():
+                cur.executemany(f"UPDATE price_watch SET {', '.join(f'{c} = ?' for c in cols)} WHERE id = ?", rows)
+            cur.executemany(_WATCH_RESCHEDULE_SQL, reschedule)
+            conn.commit()
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        updated = sum(1 for r in results if r["ok"])
+        return jsonify({
+            "ok": True,
+            "updated": updated,
+            "failed": len(items) - updated,
+            "results": results,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+    except Exception as e:
+        logger.error(f"Price watch bulk update error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/price-protection/watches/bulk', methods=['DELETE'])
+def price_protection_bulk_delete():
+    """Delete many watches in one transaction. Body: { ids: [int] }"""
+    started = time.perf_counter()
+    try:
+        ids = _bulk_items(request.get_json() or {}, 'ids')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        conn = _db_connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            wanted = [w for w in ids if isinstance(w, int) and not isinstance(w, bool)]
+            existing = set()
+            for i in range(0, len(wanted), 500):
+                part = wanted[i:i + 500]
+                existing.update(r[0] for r in cur.execute(
+                    f"SELECT id FROM price_watch WHERE id IN ({','.join('?' * len(part))})", part
+                ))
+            cur.executemany("DELETE FROM price_watch WHERE id = ?", [(w,) for w in existing])
+            conn.commit()
+            results = []
+            for i, watch_id in enumerate(ids):
+                if isinstance(watch_id, bool) or not isinstance(watch_id, int):
+                    results.append({"index": i, "ok": False, "error": "id must be an integer"})
+                elif watch_id in existing:
+                    results.append({"index": i, "ok": True, "watch_id": watch_id})
+                else:
+                    results.append({"index": i, "ok": False, "watch_id": watch_id, "error": "not_found"})
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        deleted = sum(1 for r in results if r["ok"])
+        return jsonify({
+            "ok": True,
+            "deleted": deleted,
+            "failed": len(ids) - deleted,
+            "results": results,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+    except Exception as e:
+        logger.error(f"Price watch bulk delete error: {e}")
+        return jsonify({"error": str(e)}), 500
+
 # --------------------------
 # Deal Hunter (using Knot data)
 # --------------------------
 
-def _normalize_products_from_knot(txns: list[dict], merchant: dict) -> list[dict]:
-    products: list[dict] = []
+def _normalize_products_from_knot(txns: TxnBatch, merchant: dict) -> list[dict]:
+    b = _as_txn_batch(txns)
     mname = (merchant or {}).get('name')
     mid = (merchant or {}).get('id')
-    for t in txns:
-        prods = t.get('products') or []
-        adjustments = (t.get('price') or {}).get('adjustments') or []
-        has_discount = any(a.get('type') == 'DISCOUNT' for a in adjustments)
-        for p in prods:
-            price_info = p.get('price') or {}
-            # prefer 'total' then 'sub_total' then unit_price * quantity
-            total = None
-            if isinstance(price_info.get('total'), str):
-                try:
-                    total = float(price_info.get('total'))
-                except Exception:
-                    total = None
-            if total is None and isinstance(price_info.get('sub_total'), str):
-                try:
-                    total = float(price_info.get('sub_total'))
-                except Exception:
-                    total = None
-            if total is None:
-                try:
-                    unit = float(price_info.get('unit_price')) if price_info.get('unit_price') else None
-                    qty = float(p.get('quantity') or 1)
-                    if unit is not None:
-                        total = unit * qty
-                except Exception:
-                    total = None
-
-            products.append({
-                "external_id": p.get('external_id'),
-                "title": p.get('name'),
-                "url": p.get('url'),
-                "merchant_id": mid,
-                "merchant": mname,
-                "quantity": p.get('quantity'),
-                "price_total": total,
-                "has_discount": has_discount,
-            })
+    s = b.strings
+    products: list[dict] = []
+    for ext, name, url, qty, cents, discount in zip(
+        b.prod_ext.tolist(), b.prod_name.tolist(), b.prod_url.tolist(), b.prod_qty.tolist(),
+        b.prod_cents.tolist(), b.discount[b.prod_txn].tolist(),
+    ):
+        products.append({
+            "external_id": s[ext] if ext >= 0 else None,
+            "title": s[name] or None,
+            "url": s[url] if url >= 0 else None,
+            "merchant_id": mid,
+            "merchant": mname,
+            "quantity": None if qty != qty else (int(qty) if qty.is_integer() else qty),
+            "price_total": None if cents != cents else cents / 100,
+            "has_discount": discount,
+        })
     return products
 
-def _keyword_match(title: str, query: str) -> bool:
-    if not query:
-        return True
-    if not title:
-        return False
-    qwords = [w.strip().lower() for w in query.split() if w.strip()]
-    t = title.lower()
-    return all(w in t for w in qwords)
+PRODUCT_BM25_K1 = 1.2
+PRODUCT_BM25_B = 0.75
+# cap on vocabulary tokens a query term expands to as a prefix
+PRODUCT_PREFIX_EXPANSIONS = 64
+# one index per user: LRU-bounded count, rebuilt from fresh purchases once older than the TTL
+PRODUCT_INDEX_MAX_USERS = int(os.getenv("PRODUCT_INDEX_MAX_USERS", "1000"))
+PRODUCT_INDEX_TTL_SEC = int(os.getenv("PRODUCT_INDEX_TTL_SEC", "3600"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def _tokenize(text: str | None) -> list[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+def _product_key(p: dict) -> str:
+    return f"{p.get('merchant_id')}::{p.get('external_id') or p.get('title')}"
+
+class _ProductIndex:
+    """Inverted index over normalized product titles with prefix matching and BM25 ranking.
+
+    Products are upserted by (merchant_id, external_id) as they are ingested, so the
+    index grows with the catalog and a re-ingested product replaces its old entry.
+    Every query term must match a title token, either exactly or as a prefix.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids: dict[str, int] = {}
+        self._docs: list[dict | None] = []
+        self._doc_terms: list[dict[str, int]] = []
+        self._doc_lens: list[int] = []
+        self._doc_merchants: list[str] = []
+        self._total_len = 0
+        self._postings: dict[str, dict[int, int]] = {}
+        self._vocab: list[str] = []  # sorted, for prefix lookups
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add_many(self, products: list[dict]) -> None:
+        with self._lock:
+            new_terms: list[str] = []
+            for p in products:
+                key = _product_key(p)
+                doc_id = self._ids.get(key)
+                if doc_id is None:
+                    doc_id = self._ids[key] = len(self._docs)
+                    self._docs.append(None)
+                    self._doc_terms.append({})
+                    self._doc_lens.append(0)
+                    self._doc_merchants.append("")
+                else:
+                    self._unindex(doc_id)
+                self._docs[doc_id] = p
+                self._doc_merchants[doc_id] = str(p.get("merchant_id"))
+                terms: dict[str, int] = {}
+                for tok in _tokenize(p.get("title")):
+                    terms[tok] = terms.get(tok, 0) + 1
+                self._doc_terms[doc_id] = terms
+                self._doc_lens[doc_id] = sum(terms.values())
+                self._total_len += self._doc_lens[doc_id]
+                for tok, tf in terms.items():
+                    posting = self._postings.get(tok)
+                    if posting is None:
+                        posting = self._postings[tok] = {}
+                        new_terms.append(tok)
+                    posting[doc_id] = tf
+            if len(new_terms) > PRODUCT_PREFIX_EXPANSIONS:
+                self._vocab = sorted(self._postings)
+            else:
+                for tok in new_terms:
+                    bisect.insort(self._vocab, tok)
+
+    def _unindex(self, doc_id: int) -> None:
+        terms = self._doc_terms[doc_id]
+        self._total_len -= self._doc_lens[doc_id]
+        for tok in terms:
+            posting = self._postings[tok]
+            posting.pop(doc_id, None)
+            if not posting:
+                del self._postings[tok]
+                i = bisect.bisect_left(self._vocab, tok)
+                if i < len(self._vocab) and self._vocab[i] == tok:
+                    self._vocab.pop(i)
+
+    def _expand(self, term: str) -> list[str]:
+        out = [term] if term in self._postings else []
+        i = bisect.bisect_right(self._vocab, term)
+        while i < len(self._vocab) and len(out) < PRODUCT_PREFIX_EXPANSIONS and self._vocab[i].startswith(term):
+            out.append(self._vocab[i])
+            i += 1
+        return out
+
+    def search(self, query: str, merchant_ids: set[str] | None = None, where=None, key=None,
+               limit: int | None = None) -> list[tuple[dict, float]]:
+        """(product, BM25 score) for products matching every query term, best first.
+        An empty query matches everything with score 0. ``where(product)`` filters hits;
+        ``key(product, score)`` overrides the ordering and ``limit`` keeps only the top hits.
+        """
+        terms = list(dict.fromkeys(_tokenize(query)))
+        with self._lock:
+            if not terms:
+                hits = dict.fromkeys(self._ids.values(), 0.0)
+            else:
+                # each term -> postings of the tokens it expands to; intersect rarest first,
+                # then score only the surviving documents
+                expanded = []
+                for term in terms:
+                    postings = [self._postings[tok] for tok in self._expand(term)]
+                    if not postings:
+                        return []
+                    expanded.append(postings)
+                expanded.sort(key=lambda ps: sum(len(p) for p in ps))
+                cand = set().union(*expanded[0])
+                for postings in expanded[1:]:
+                    cand &= postings[0].keys() if len(postings) == 1 else set().union(*postings)
+                    if not cand:
+                        return []
+
+                n_docs = len(self._ids)
+                avgdl = self._total_len / n_docs if n_docs else 1.0
+                k1, b, lens = PRODUCT_BM25_K1, PRODUCT_BM25_B, self._doc_lens
+                c1, c2 = k1 * (1 - b), k1 * b / avgdl
+                hits = dict.fromkeys(cand, 0.0)
+                for postings in expanded:
+                    # a term scores by its best-matching expansion
+                    best = hits if len(postings) == 1 else {}
+                    for p in postings:
+                        num = (k1 + 1) * math.log(1 + (n_docs - len(p) + 0.5) / (len(p) + 0.5))
+                        if len(p) <= len(hits):
+                            pairs = [(d, tf) for d, tf in p.items() if d in hits]
+                        else:
+                            pairs = [(d, p[d]) for d in hits if d in p]
+                        if best is hits:
+                            for d, tf in pairs:
+                                hits[d] += num * tf / (tf + c1 + c2 * lens[d])
+                            continue
+                        for d, tf in pairs:
+                            sc = num * tf / (tf + c1 + c2 * lens[d])
+                            if sc > best.get(d, 0.0):
+                                best[d] = sc
+                    if best is not hits:
+                        for d, sc in best.items():
+                            hits[d] += sc
+            # filter and rank lazily: materializing every hit is the expensive part for broad queries
+            docs, merchants = self._docs, self._doc_merchants
+            pairs = iter(hits.items())
+            if merchant_ids is not None:
+                pairs = ((d, sc) for d, sc in pairs if merchants[d] in merchant_ids)
+            if where is not None:
+                pairs = ((d, sc) for d, sc in pairs if where(docs[d]))
+            order = (lambda x: key(docs[x[0]], x[1])) if key else (lambda x: -x[1])
+            ranked = heapq.nsmallest(limit, pairs, key=order) if limit is not None else sorted(pairs, key=order)
+            return [(docs[d], sc) for d, sc in ranked]
+
+class _UserProductIndexes:
+    """Per-user _ProductIndex instances, so a search only sees that user's purchases.
+    Holds at most max_users (least recently used evicted); an index older than ttl_sec
+    is dropped and rebuilt from the next ingest so stale products age out.
+    """
+
+    def __init__(self, max_users: int, ttl_sec: int):
+        self.max_users = max_users
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._lru: OrderedDict[str, tuple[float, _ProductIndex]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def get(self, user: str) -> _ProductIndex:
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(user)
+            if entry is None or now - entry[0] > self.ttl_sec:
+                entry = self._lru[user] = (now, _ProductIndex())
+            self._lru.move_to_end(user)
+            while len(self._lru) > self.max_users:
+                self._lru.popitem(last=False)
+            return entry[1]
+
+PRODUCT_INDEXES = _UserProductIndexes(PRODUCT_INDEX_MAX_USERS, PRODUCT_INDEX_TTL_SEC)
 
 @app.route('/dealhunter/search', methods=['POST'])
 def dealhunter_search():
@@ -2137,6 +4594,7 @@ def dealhunter_search():
         explain = bool(data.get('explain', False))
         explain_top_k = int(data.get('explain_top_k', 3))
         want_mock = bool(data.get('mock', False)) or (not KNOT_ENABLED)
+        external_user_id = data.get('external_user_id', 'abc')
 
         # Fan out to Knot for each merchant (small N sequential for simplicity)
         all_products: list[dict] = []
@@ -2148,7 +4606,7 @@ def dealhunter_search():
             else:
                 status, ok, resp = knot_post('/transactions/sync', {
                     "merchant_id": mid,
-                    "external_user_id": data.get('external_user_id', 'abc'),
+                    "external_user_id": external_user_id,
                     "limit": 10,
                 })
                 if not ok or not isinstance(resp, dict):
@@ -2159,32 +4617,32 @@ def dealhunter_search():
                 prods = _normalize_products_from_knot(txns, merchant_info)
                 all_products.extend(prods)
 
-        # Deduplicate by (merchant_id, external_id)
-        dedup = {}
-        for p in all_products:
-            key = f"{p.get('merchant_id')}::{p.get('external_id')}"
-            if key not in dedup:
-                dedup[key] = p
-
-        items = list(dedup.values())
-
-        # Filter by keyword and budget
-        items = [p for p in items if _keyword_match(p.get('title') or '', query)]
+        # Filter by budget
+        budget = None
         if budget_cents is not None:
             try:
                 budget = float(budget_cents) / 100.0
-                items = [p for p in items if (p.get('price_total') is None or p.get('price_total') <= budget)]
             except Exception:
                 pass
 
+        def within_budget(p: dict) -> bool:
+            return budget is None or p.get('price_total') is None or p.get('price_total') <= budget
+
         # Score: cheaper first, discount preferred
         def score(p: dict):
             base = p.get('price_total') if p.get('price_total') is not None else 1e9
             discount_bonus = -50.0 if p.get('has_discount') else 0.0
             return base + discount_bonus
 
-        items.sort(key=score)
-        items = items[:limit]
+        # Upsert into this user's index (dedupes by merchant_id/external_id), then take the
+        # most relevant matches; price/discount breaks ties
+        index = PRODUCT_INDEXES.get(external_user_id)
+        index.add_many(all_products)
+        hits = index.search(
+            query, merchant_ids={str(m) for m in merchants}, where=within_budget,
+            key=lambda p, s: (-round(s, 4), score(p)), limit=limit,
+        )
+        items = [dict(p, relevance=round(s, 4)) for p, s in hits]
 
         # Optional LLM explanations for top K
         if explain and items:
@@ -2340,6 +4798,7 @@ if __name__ == '__main__':
     # Ensure database schema exists
     try:
         init_db()
+        _recover_jobs()
     except Exception as e:
         logger.error(f"DB init failed: {e}")
     # Validate env
@@ -2353,9 +4812,10 @@ if __name__ == '__main__':
     if SCHED_ENABLED:
         try:
             scheduler = BackgroundScheduler(daemon=True)
-            scheduler.add_job(_evaluate_watches_once, 'interval', minutes=SCHED_INTERVAL_MIN, max_instances=1, id='watch_eval')
+            scheduler.add_job(_run_due_watches, 'interval', seconds=SCHED_TICK_SEC, max_instances=1, coalesce=True, id='watch_eval')
+            scheduler.add_job(RAG_STORE.purge_expired, 'interval', hours=1, max_instances=1, coalesce=True, id='rag_purge')
             scheduler.start()
-            logger.info(f"Scheduler started (every {SCHED_INTERVAL_MIN} minutes)")
+            logger.info(f"Scheduler started (tick {SCHED_TICK_SEC}s, each watch every {SCHED_INTERVAL_MIN} minutes)")
         except Exception as e:
             logger.error(f"Scheduler failed to start: {e}")
     # Run the Flask app (no reloader by default for background runs)
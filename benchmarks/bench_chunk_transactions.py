@@ -0,0 +1,87 @@
+"""Benchmark RAG chunking of a transaction history (_chunk_transactions).
+
+Builds N synthetic Knot-shaped transactions into a TxnBatch and compares the
+token-budgeted streaming chunker with the char-budgeted version it replaced:
+time, chunk count, token sizes and how many transactions survive into the kept chunks.
+
+    SKIP_WHISPER=1 python benchmarks/bench_chunk_transactions.py --transactions 100000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacy_chunk(b, max_chars: int = 450) -> list[str]:
+    """The previous implementation: re-summed line lengths per row, truncated, first 50 groups."""
+    import app
+    np = app.np
+    no_month = np.iinfo(np.int64).min
+    known = ~np.isnan(b.ts)
+    months = np.full(len(b), no_month, dtype=np.int64)
+    months[known] = b.ts[known].astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+    by_key = defaultdict(list)
+    for i, key in enumerate(zip(b.merchant.tolist(), months.tolist())):
+        by_key[key].append(i)
+    chunks = []
+    totals = b.total_cents.tolist()
+    for (merchant_code, month), rows in by_key.items():
+        lines = [f"Merchant: {b.string(merchant_code) or 'Unknown'}",
+                 f"Month: {'unknown' if month == no_month else np.datetime64(month, 'M')}"]
+        subtotal = 0.0
+        for i in rows:
+            ttl = b.strings[b.title[i]]
+            cents = totals[i]
+            if cents == cents:
+                subtotal += cents / 100
+                lines.append(f"- {ttl} (${cents / 100:.2f})")
+            else:
+                lines.append(f"- {ttl}")
+            if sum(len(x) + 1 for x in lines) > max_chars:
+                break
+        lines.append(f"Subtotal: ${subtotal:.2f}")
+        chunks.append("\n".join(lines)[:max_chars])
+    return chunks[:50]
+
+
+def describe(app, name: str, fn, n: int):
+    t0 = time.perf_counter()
+    chunks = fn()
+    secs = time.perf_counter() - t0
+    tokens = [app._count_tokens(c) for c in chunks]
+    kept_rows = sum(sum(1 for line in c.splitlines() if line.startswith("- ")) for c in chunks)
+    newest = max((c.splitlines()[1] for c in chunks), default="-")
+    print(f"{name:<8}{secs * 1000:>10.1f}{len(chunks):>8}{statistics.mean(tokens):>9.1f}{max(tokens):>8}"
+          f"{kept_rows:>10}{kept_rows / n:>9.2%}  {newest}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transactions", type=int, default=100_000)
+    parser.add_argument("--titles", type=int, default=5_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="zuno_bench_"), "bench.db")
+    import app  # noqa: E402  (DB_PATH must be set before import)
+    from bench_txn_batch import transactions
+
+    batch = app.TxnBatch(transactions(args.transactions, args.titles, args.seed), keep_raw=False)
+    n = len(batch)
+    streamed = app._chunk_transactions(batch, max_chunks=10 ** 9)
+    print(f"transactions={n} groups+continuations={len(streamed)} "
+          f"max_tokens={app.RAG_CHUNK_MAX_TOKENS} max_chunks={app.RAG_MAX_CHUNKS}")
+    print(f"{'':<8}{'ms':>10}{'chunks':>8}{'avg tok':>9}{'max tok':>8}{'txns kept':>10}{'of all':>9}  newest month kept")
+    describe(app, "legacy", lambda: legacy_chunk(batch), n)
+    describe(app, "ranked", lambda: app._chunk_transactions(batch), n)
+    describe(app, "all", lambda: app._chunk_transactions(batch, max_chunks=10 ** 9), n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Benchmark bulk price_history seeding.
+
+Seeds N watches x P points into a throwaway SQLite DB via the same code path as
+/price-history/seed_demo and reports rows/sec.
+
+    SKIP_WHISPER=1 python benchmarks/bench_price_history_seed.py --watches 10000 --points 365
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--watches", type=int, default=10_000)
+    parser.add_argument("--points", type=int, default=365)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--chunk", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="zuno_bench_")
+    os.environ["DB_PATH"] = os.path.join(tmpdir, "bench.db")
+    import app  # noqa: E402  (DB_PATH must be set before import)
+
+    app.init_db()
+    conn = app._db_connect()
+    now = app.datetime.utcnow().isoformat()
+    conn.executemany(
+        "INSERT INTO price_watch (external_user_id, canonical_id, target_price_cents, note, created_at) VALUES (?, ?, ?, ?, ?)",
+        [("bench", f"44:B{i:09d}", 1000, f"Bench product {i}", now) for i in range(args.watches)],
+    )
+    conn.commit()
+    watches = [(r[0], r[1], r[2]) for r in conn.execute("SELECT id, canonical_id, note FROM price_watch")]
+
+    t0 = time.perf_counter()
+    rows = app._seed_demo_history(conn, watches, days=args.days, num_points=args.points, seed=args.seed, chunk_size=args.chunk)
+    elapsed = time.perf_counter() - t0
+    conn.close()
+
+    print(f"watches={args.watches} points={args.points} chunk={args.chunk}")
+    print(f"rows={rows} elapsed={elapsed:.2f}s rows/sec={rows / elapsed:,.0f}")
+    print(f"db={os.environ['DB_PATH']} size={os.path.getsize(os.environ['DB_PATH']) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
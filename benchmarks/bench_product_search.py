@@ -0,0 +1,91 @@
+"""Benchmark the product title index behind /dealhunter/search.
+
+Ingests N synthetic product titles into _ProductIndex in sync-sized batches,
+then compares top-k query latency against the linear substring scan it replaced.
+Substring and token-prefix matching differ slightly, so match counts are the scan's.
+
+    SKIP_WHISPER=1 python benchmarks/bench_product_search.py --titles 500000
+"""
+import argparse
+import gc
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BRANDS = ["Anker", "Logitech", "Samsung", "Sony", "Apple", "Bose", "Philips", "Dyson", "Ninja", "Instant",
+          "Oxo", "Pyrex", "Lodge", "Cuisinart", "Hamilton", "Kasa", "Ring", "Eufy", "Belkin", "Sandisk"]
+ADJECTIVES = ["Wireless", "Portable", "Stainless", "Compact", "Rechargeable", "Organic", "Ergonomic", "Smart",
+              "Heavy-Duty", "Waterproof", "Cotton", "Bamboo", "Magnetic", "Foldable", "Insulated"]
+NOUNS = ["Earbuds", "Mouse", "Keyboard", "Charger", "Cable", "Blender", "Kettle", "Skillet", "Towels", "Lamp",
+         "Speaker", "Camera", "Backpack", "Bottle", "Vacuum", "Router", "Monitor", "Headphones", "Tripod", "Mat"]
+EXTRAS = ["6-Pack", "USB-C", "2-Pack", "Pro", "Mini", "XL", "Bluetooth 5.3", "1080p", "12oz", "Family Size"]
+QUERIES = ["wireless earbuds", "usb-c cable", "stainless skillet", "anker charger", "smart", "blu", "organic cotton towels",
+           "logitech mouse", "waterproof speaker", "xyz nothing"]
+
+
+def products(n: int, seed: int) -> list[dict]:
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        title = " ".join([rng.choice(BRANDS), rng.choice(ADJECTIVES), rng.choice(NOUNS), rng.choice(EXTRAS),
+                          f"M{rng.randrange(100000)}"])
+        out.append({"external_id": f"P{i}", "title": title, "merchant_id": (44, 12, 45)[i % 3],
+                    "price_total": round(rng.uniform(3, 400), 2)})
+    return out
+
+
+def linear_scan(items: list[dict], query: str) -> list[dict]:
+    qwords = [w.strip().lower() for w in query.split() if w.strip()]
+    return [p for p in items if all(w in (p.get("title") or "").lower() for w in qwords)]
+
+
+def rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--titles", type=int, default=500_000)
+    parser.add_argument("--batch", type=int, default=10_000, help="products per add_many call")
+    parser.add_argument("--limit", type=int, default=20, help="results per query, as /dealhunter/search")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="zuno_bench_"), "bench.db")
+    import app  # noqa: E402  (DB_PATH must be set before import)
+
+    items = products(args.titles, args.seed)
+    index = app._ProductIndex()
+    gc.collect()
+    before = rss()
+    t0 = time.perf_counter()
+    for i in range(0, len(items), args.batch):
+        index.add_many(items[i:i + args.batch])
+    build = time.perf_counter() - t0
+    gc.collect()
+    print(f"titles={len(index)} vocab={len(index._vocab)} build={build:.2f}s "
+          f"({len(items) / build:,.0f} titles/sec) rss=+{(rss() - before) / 1e6:.1f} MB")
+
+    merchants = {"44", "12", "45"}
+    print(f"{'query':<24}{'matches':>8}{'index ms':>11}{'scan ms':>10}")
+    for q in QUERIES:
+        idx_t, scan_t = [], []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            index.search(q, merchant_ids=merchants, limit=args.limit)
+            idx_t.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            matches = linear_scan(items, q)
+            scan_t.append(time.perf_counter() - t0)
+        print(f"{q:<24}{len(matches):>8}{statistics.median(idx_t) * 1000:>11.2f}{statistics.median(scan_t) * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Benchmark RAG chunk ingest and retrieval through RagStore.
+
+Ingests U users x C synthetic transaction chunks (embedding + SQLite write),
+then times top-k retrieval for random users with a cold and a warm LRU, and
+brute-force vs IVF search for one very large user.
+
+    SKIP_WHISPER=1 python benchmarks/bench_rag_index.py --users 10000 --chunks 50
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MERCHANTS = ["Amazon", "Target", "Walmart", "Instacart", "DoorDash", "UberEats", "Costco"]
+ITEMS = ["Wireless Earbuds", "USB-C Cable", "Organic Bananas", "Paper Towels", "Pizza Dinner", "Sushi Lunch",
+         "Coffee Beans", "Dog Food", "Running Shoes", "Yoga Mat", "Laptop Stand", "Vitamin D", "Olive Oil",
+         "Phone Case", "Desk Lamp", "Shampoo", "Almond Milk", "Board Game", "Water Filter", "Notebook"]
+QUERIES = ["wireless earbuds deal", "coffee", "running shoes under 100", "healthy groceries", "desk setup"]
+
+
+def chunk(rng: random.Random) -> str:
+    lines = [f"Merchant: {rng.choice(MERCHANTS)}", f"Month: 2025-{rng.randint(1, 12):02d}"]
+    total = 0.0
+    for _ in range(rng.randint(3, 8)):
+        price = rng.uniform(3, 120)
+        total += price
+        lines.append(f"- {rng.choice(ITEMS)} (${price:.2f})")
+    lines.append(f"Subtotal: ${total:.2f}")
+    return "\n".join(lines)
+
+
+def pct(values: list[float], q: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(q * len(values)))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--chunks", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--large-user-chunks", type=int, default=50_000)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="zuno_bench_"), "bench.db")
+    import app  # noqa: E402  (DB_PATH must be set before import)
+
+    app.init_db()
+    rng = random.Random(args.seed)
+    store = app.RAG_STORE
+    embedder = app._get_embedder()
+    print(f"embedder={embedder.name} users={args.users} chunks/user={args.chunks} lru={store.max_bytes / 1e6:.0f} MB")
+
+    t0 = time.perf_counter()
+    for u in range(args.users):
+        store.put(f"user{u}", [chunk(rng) for _ in range(args.chunks)])
+    ingest = time.perf_counter() - t0
+    n_chunks = args.users * args.chunks
+    print(f"ingest: {ingest:.1f}s {args.users / ingest:,.0f} users/sec {n_chunks / ingest:,.0f} chunks/sec "
+          f"db={os.path.getsize(os.environ['DB_PATH']) / 1e6:.0f} MB")
+
+    def run(users: list[str]) -> list[float]:
+        lat = []
+        for user in users:
+            t0 = time.perf_counter()
+            app._rag_retrieve(user, rng.choice(QUERIES), args.k)
+            lat.append(time.perf_counter() - t0)
+        return lat
+
+    # random users across the whole population mostly miss the LRU; a small hot set stays cached
+    cold = run([f"user{rng.randrange(args.users)}" for _ in range(args.queries)])
+    hot_users = [f"user{u}" for u in range(20)]
+    run(hot_users)
+    hot = run([rng.choice(hot_users) for _ in range(args.queries)])
+    for name, lat in (("cold", cold), ("warm", hot)):
+        print(f"query {name}: {len(lat) / sum(lat):,.0f} qps p50={pct(lat, 0.5):.2f} ms p95={pct(lat, 0.95):.2f} ms")
+    print(f"lru: {store.stats()}")
+
+    big = [chunk(rng) for _ in range(args.large_user_chunks)]
+    vectors = embedder.embed(big)
+    t0 = time.perf_counter()
+    ivf = app._ChunkIndex(big, vectors, embedder.name, "bench", 0)
+    build = time.perf_counter() - t0
+    threshold, app.RAG_IVF_MIN_CHUNKS = app.RAG_IVF_MIN_CHUNKS, len(big) + 1
+    brute = app._ChunkIndex(big, vectors, embedder.name, "bench", 0)
+    app.RAG_IVF_MIN_CHUNKS = threshold
+    qvecs = embedder.embed(QUERIES * 40)
+    t_brute, t_ivf, recall = [], [], []
+    for q in qvecs:
+        t0 = time.perf_counter()
+        exact = brute.search(q, args.k)
+        t_brute.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        got = ivf.search(q, args.k)
+        t_ivf.append(time.perf_counter() - t0)
+        # synthetic chunks tie a lot, so count hits scoring at least the exact k-th score
+        kth = exact[-1][1] - 1e-6
+        recall.append(sum(1 for _, sc in got if sc >= kth) / len(exact))
+    print(f"large user: chunks={len(big)} ivf lists={len(ivf.lists)} nprobe={app.RAG_IVF_NPROBE} build={build:.2f}s "
+          f"brute p50={statistics.median(t_brute) * 1000:.2f} ms ivf p50={statistics.median(t_ivf) * 1000:.2f} ms "
+          f"recall@{args.k}={statistics.mean(recall):.2f}")
+
+if __name__ == "__main__":
+    main()
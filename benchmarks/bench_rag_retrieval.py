@@ -0,0 +1,73 @@
+"""Benchmark RAG.py document retrieval latency against k.
+
+Indexes a synthetic manual (topic sections streamed through iter_chunks) into an
+in-memory Chroma collection with the offline local embedding backend, then times
+retrieve() for each k: cold (query cache cleared) and warm (served from the cache).
+
+    python benchmarks/bench_rag_retrieval.py --sections 2000 --ks 1,2,4,8,16
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SYSTEMS = ["brake", "engine", "transmission", "battery", "coolant", "steering", "suspension", "airbag", "tire",
+           "headlight", "wiper", "fuel", "exhaust", "sensor", "infotainment", "charging", "door", "seat", "mirror"]
+WORDS = ["pressure", "warning", "light", "check", "replace", "interval", "torque", "fluid", "level", "indicator",
+         "module", "fault", "reset", "service", "inspect", "temperature", "voltage", "system", "manual", "mode"]
+
+
+def sections(n: int, words_per_section: int, seed: int):
+    rng = random.Random(seed)
+    for i in range(n):
+        system = SYSTEMS[i % len(SYSTEMS)]
+        body = " ".join(rng.choice(WORDS + [system] * 3) for _ in range(words_per_section))
+        yield f"{i + 1} {system.title()} procedure {i}", body, 1 + i // 4
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=400, help="words per section before chunking")
+    parser.add_argument("--ks", default="1,2,4,8,16")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="zuno_bench_")
+    os.environ.update(RAG_EMBED_BACKEND="local", RAG_CHROMA_PATH="",
+                      RAG_EMBED_CACHE_PATH=os.path.join(tmp, "embeddings.db"))
+    import RAG  # noqa: E402  (env must be set before import)
+
+    t0 = time.perf_counter()
+    RAG.reload_rag_model(sections=sections(args.sections, args.words, args.seed))
+    print(f"sections={args.sections} chunks={RAG.db.count()} index={time.perf_counter() - t0:.2f}s")
+
+    rng = random.Random(args.seed + 1)
+    queries = [f"{rng.choice(SYSTEMS)} {rng.choice(WORDS)} {rng.choice(WORDS)}" for _ in range(args.queries)]
+    print(f"{'k':>4}{'cold p50 ms':>13}{'cold p95 ms':>13}{'warm p50 ms':>13}{'passages':>10}{'tokens':>8}")
+    for k in (int(x) for x in args.ks.split(",")):
+        RAG._query_cache.clear()
+        cold, warm, got, tokens = [], [], [], []
+        for q in queries:
+            t0 = time.perf_counter()
+            passages = RAG.retrieve(q, k=k)
+            cold.append(time.perf_counter() - t0)
+            got.append(len(passages))
+            tokens.append(sum(RAG.count_tokens(p["document"]) for p in passages))
+        for q in queries:
+            t0 = time.perf_counter()
+            RAG.retrieve(q, k=k)
+            warm.append(time.perf_counter() - t0)
+        p95 = statistics.quantiles(cold, n=20)[-1]
+        print(f"{k:>4}{statistics.median(cold) * 1000:>13.2f}{p95 * 1000:>13.2f}{statistics.median(warm) * 1000:>13.3f}"
+              f"{statistics.mean(got):>10.1f}{statistics.mean(tokens):>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Load-test POST /rag/doc/ask against RAG.RagService with a stub generator.
+
+Indexes a synthetic manual with the offline local embedding backend, swaps the
+app's document service for one whose generator just sleeps (no API calls), then
+fires requests from many client threads through the Flask test client. A share of
+the questions repeat so coalescing and the answer cache are exercised. RAG.py
+imports chromadb and google-generativeai, so both must be installed; no API key
+is used.
+
+    SKIP_WHISPER=1 python benchmarks/bench_rag_service.py --requests 2000 --clients 64
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubGenerator:
+    """Stands in for Gemini: fixed latency, canned answer."""
+
+    def __init__(self, latency_ms: float):
+        self.latency = latency_ms / 1000
+        self.calls = 0
+
+    async def generate(self, prompt: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return f"stub answer ({len(prompt)} prompt chars)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=64, help="concurrent client threads")
+    parser.add_argument("--distinct", type=int, default=400, help="distinct questions in the request mix")
+    parser.add_argument("--latency-ms", type=float, default=300, help="stub generation latency")
+    parser.add_argument("--concurrency", type=int, default=32, help="RagService max_concurrency")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="zuno_bench_")
+    os.environ.update(DB_PATH=os.path.join(tmp, "bench.db"), RAG_EMBED_BACKEND="local", RAG_CHROMA_PATH="",
+                      RAG_EMBED_CACHE_PATH=os.path.join(tmp, "embeddings.db"))
+    import app  # noqa: E402  (env must be set before import)
+    import RAG  # noqa: E402
+    from bench_rag_retrieval import SYSTEMS, WORDS, sections
+
+    RAG.reload_rag_model(sections=sections(args.sections, 300, args.seed))
+    stub = StubGenerator(args.latency_ms)
+    service = RAG.RagService(generator=stub, max_concurrency=args.concurrency, cache=RAG.ResponseCache())
+    app._doc_rag_service = service
+    client = app.app.test_client()
+
+    rng = random.Random(args.seed)
+    questions = [f"how do I {rng.choice(WORDS)} the {rng.choice(SYSTEMS)} {rng.choice(WORDS)}" for _ in range(args.distinct)]
+    mix = [rng.choice(questions) for _ in range(args.requests)]
+
+    def ask(question):
+        t0 = time.perf_counter()
+        r = client.post("/rag/doc/ask", json={"question": question})
+        return r.status_code, time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        results = list(pool.map(ask, mix))
+    wall = time.perf_counter() - t0
+
+    lat = [t for code, t in results if code == 200]
+    codes = {}
+    for code, _ in results:
+        codes[code] = codes.get(code, 0) + 1
+    q = statistics.quantiles(lat, n=100)
+    print(f"chunks={RAG.db.count()} requests={args.requests} clients={args.clients} distinct={args.distinct} "
+          f"stub_latency={args.latency_ms:.0f}ms concurrency={args.concurrency}")
+    print(f"wall={wall:.2f}s throughput={len(results) / wall:,.0f} req/s status={codes}")
+    print(f"latency p50={q[49] * 1000:.1f}ms p95={q[94] * 1000:.1f}ms p99={q[98] * 1000:.1f}ms")
+    print(f"generator_calls={stub.calls} service={service.stats}")
+
+
+if __name__ == "__main__":
+    main()
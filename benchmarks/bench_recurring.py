@@ -0,0 +1,93 @@
+"""Benchmark recurring-charge detection for the subscriptions audit.
+
+Builds a synthetic multi-year history (Knot transaction shape) mixing weekly,
+monthly, quarterly and annual subscriptions with one-off purchases,
+normalizes it into TxnRecords, runs _detect_recurring over them and reports
+throughput of both phases plus cadence recall.
+
+    SKIP_WHISPER=1 python benchmarks/bench_recurring.py --transactions 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MERCHANTS = ["Amazon", "Target", "Walmart", "Instacart", "DoorDash", "UberEats", "Costco"]
+
+
+def synthetic_history(n_txns: int, recurring_share: float, seed: int) -> tuple[list[dict], dict[str, str]]:
+    import app
+
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    cadences = list(app.RECURRING_CADENCES.items())
+    txns: list[dict] = []
+    truth: dict[str, str] = {}
+
+    def txn(when: datetime, merchant: str, product: str, price: float) -> dict:
+        total = f"{price:.2f}"
+        return {
+            "datetime": when.isoformat(),
+            "merchant": {"name": merchant},
+            "price": {"total": total},
+            "products": [{"name": product, "quantity": 1, "price": {"total": total}}],
+        }
+
+    target_recurring = int(n_txns * recurring_share)
+    sub = 0
+    while len(txns) < target_recurring:
+        name, (period, _) = cadences[sub % len(cadences)]
+        merchant = MERCHANTS[sub % len(MERCHANTS)]
+        product = f"Subscription {sub}"
+        price = rng.uniform(3, 150)
+        count = max(3, min(60, int(5 * 365 / period)))
+        start = now - timedelta(days=period * count)
+        for i in range(count):
+            # billing dates slip by a day or two, a few days at most
+            jitter = rng.uniform(-1, 1) * min(0.08 * period, 4.0)
+            txns.append(txn(start + timedelta(days=period * i + jitter), merchant, product, price))
+        truth[f"prod::{merchant}::{product}"] = name
+        sub += 1
+    while len(txns) < n_txns:
+        when = now - timedelta(days=rng.uniform(0, 5 * 365))
+        txns.append(txn(when, rng.choice(MERCHANTS), f"One-off {len(txns)}", rng.uniform(5, 300)))
+    rng.shuffle(txns)
+    return txns, truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transactions", type=int, default=100_000)
+    parser.add_argument("--recurring-share", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="zuno_bench_"), "bench.db")
+    import app  # noqa: E402  (DB_PATH must be set before import)
+
+    txns, truth = synthetic_history(args.transactions, args.recurring_share, args.seed)
+    t0 = time.perf_counter()
+    records = app._as_txn_records(txns)
+    normalize = time.perf_counter() - t0
+    best = float("inf")
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        candidates = app._detect_recurring(records)
+        best = min(best, time.perf_counter() - t0)
+
+    found = {c["key"]: c["cadence"] for c in candidates}
+    correct = sum(1 for k, cad in truth.items() if found.get(k) == cad)
+    false_pos = sum(1 for k in found if k not in truth)
+    print(f"transactions={len(txns)} subscriptions={len(truth)} repeat={args.repeat}")
+    print(f"normalize={normalize:.3f}s detect_best={best:.3f}s detect txns/sec={len(txns) / best:,.0f}")
+    print(f"recall={correct / max(len(truth), 1):.3f} false_positives={false_pos}")
+
+
+if __name__ == "__main__":
+    main()
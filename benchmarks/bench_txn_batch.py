@@ -0,0 +1,94 @@
+"""Benchmark the columnar TxnBatch against per-transaction TxnRecords.
+
+Streams N synthetic Knot-shaped transactions, builds both representations and
+reports build time, resident memory held and the speed of the analytics that
+consume the batch: recurrence detection, RAG chunking and the watch price index.
+
+    SKIP_WHISPER=1 python benchmarks/bench_txn_batch.py --transactions 1000000
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MERCHANTS = [(44, "Amazon"), (12, "Target"), (45, "Walmart"), (40, "Instacart"), (19, "DoorDash"), (36, "UberEats"), (165, "Costco")]
+
+
+def transactions(n: int, n_titles: int, seed: int):
+    """Yield transactions one at a time so the raw feed is never held in memory."""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    titles = [f"Product {i} {rng.choice(['Pack', 'Set', 'Bundle', 'Refill'])}" for i in range(n_titles)]
+    for i in range(n):
+        mid, mname = MERCHANTS[i % len(MERCHANTS)]
+        total = f"{rng.uniform(2, 300):.2f}"
+        yield {
+            "id": f"T{i}",
+            "datetime": (now - timedelta(seconds=rng.randrange(5 * 365 * 86400))).isoformat(),
+            "merchant": {"id": mid, "name": mname},
+            "price": {"total": total},
+            "products": [{
+                "external_id": f"P{i % n_titles}",
+                "name": titles[i % n_titles],
+                "quantity": 1,
+                "price": {"total": total},
+            }],
+        }
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t0
+
+
+def rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def held(fn):
+    """(result, seconds, growth in resident memory while building the result)."""
+    gc.collect()
+    before = rss()
+    out, secs = timed(fn)
+    gc.collect()
+    return out, secs, rss() - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transactions", type=int, default=1_000_000)
+    parser.add_argument("--titles", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="zuno_bench_"), "bench.db")
+    import app  # noqa: E402  (DB_PATH must be set before import)
+
+    n = args.transactions
+    batch, t_batch, m_batch = held(lambda: app.TxnBatch(transactions(n, args.titles, args.seed), keep_raw=False))
+    records, t_rec, m_rec = held(lambda: [app._normalize_txn(t) for t in transactions(n, args.titles, args.seed)])
+    del records
+    print(f"transactions={n} titles={args.titles} strings={len(batch.strings)}")
+    print(f"records: build={t_rec:.2f}s rss=+{m_rec / 1e6:.1f} MB ({m_rec / n:.0f} B/txn, incl. the raw dicts they reference)")
+    print(f"batch:   build={t_batch:.2f}s rss=+{m_batch / 1e6:.1f} MB ({m_batch / n:.0f} B/txn, columns={batch.nbytes / 1e6:.1f} MB)")
+
+    _, t = timed(lambda: app._detect_recurring(batch))
+    print(f"detect_recurring: {t:.2f}s ({n / t:,.0f} txns/sec)")
+    _, t = timed(lambda: app._chunk_transactions(batch))
+    print(f"chunk_transactions: {t:.2f}s ({n / t:,.0f} txns/sec)")
+    batch.raw = [{}] * n  # index lookups hand back the raw dict; any placeholder will do here
+    index, t = timed(lambda: app._TxnPriceIndex(batch))
+    _, q = timed(lambda: [index.first_at_or_below(c) for c in range(100, 30000, 3)])
+    print(f"price_index: build={t:.2f}s 10k lookups={q * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()